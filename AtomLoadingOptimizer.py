@@ -11,6 +11,7 @@ import numpy as np
 import scipy as sp
 from skimage.filters import threshold_otsu
 import logging
+import os
 
 #Imports for M-LOOP
 import mloop.interfaces as mli
@@ -18,6 +19,9 @@ import mloop.controllers as mlc
 import mloop.visualizations as mlv
 
 from utilities.BaseExperiment import BaseExperiment
+from utilities.optimizer_history import OptimizerHistory
+
+cwd = os.getcwd() # must be called here. if called in class, returns the results level dir
 
 
 # Declare your custom class that inherits from the Interface class
@@ -85,6 +89,11 @@ class AtomLoadingOptimizer(EnvExperiment):
 
         group1 = "optimizer settings"
         self.setattr_argument("max_runs",NumberValue(70, type='int', scale=1, ndecimals=0, step=1),group1)
+        # start M-LOOP from the best point of earlier runs tuning the same things. older points count for less,
+        # see utilities/optimizer_history.py
+        self.setattr_argument("warm_start_from_history", BooleanValue(False), group1)
+        self.setattr_argument("history_max_age_days", NumberValue(7), group1)
+        self.setattr_argument("history_half_life_days", NumberValue(1), group1)
 
         # this should be close to the mean signal from the atom
         self.base.set_datasets_from_gui_args()
@@ -182,12 +191,50 @@ class AtomLoadingOptimizer(EnvExperiment):
         print("min bounds")
         print(min_bounds)
 
+        # every point M-LOOP evaluates is stored, so that later runs can start from the best one. the beam set point
+        # multipliers are stored as set points, since the defaults they multiply change from day to day. the cost is
+        # a number of atoms, so it is only comparable between runs with the same loading and exposure times
+        self.history = OptimizerHistory(os.path.join(cwd, "optimizer_history.sqlite"))
+        n_beams = 4 if self.disable_z_beam_tuning else 6
+        self.history_key = dict(optimizer=self.__class__.__name__, experiment_function="optimization_routine",
+                                cost_function="get_cost",
+                                variables=(self.volt_datasets if self.tune_coils else []) +
+                                          (self.setpoint_datasets[:n_beams] if self.tune_beams else []),
+                                min_bounds=self.absolute_params(min_bounds),
+                                max_bounds=self.absolute_params(max_bounds))
+        self.history_snapshot = {'n_measurements': self.n_measurements, 't_MOT_loading': self.t_MOT_loading,
+                                 't_SPCM_exposure': self.t_SPCM_exposure}
+        controller_kwargs = {}
+        if self.warm_start_from_history:
+            first_params = self.history.warm_start_params(**self.history_key, max_age_days=self.history_max_age_days,
+                                                          half_life_days=self.history_half_life_days,
+                                                          match=self.history_snapshot)
+            if first_params is not None:
+                controller_kwargs['first_params'] = self.relative_params(first_params)
+
         self.mloop_controller = mlc.create_controller(interface,
                                            max_num_runs=self.max_runs,
                                            target_cost=-0.5*self.n_measurements, # -1 * number of atoms to load
                                            num_params=n_params,
                                            min_boundary=min_bounds,
-                                           max_boundary=max_bounds)
+                                           max_boundary=max_bounds,
+                                           **controller_kwargs)
+
+    def absolute_params(self, params):
+        """the coil volts and the beam set points for params, in which the set points are multipliers"""
+        values = np.array(params, dtype=float)
+        if self.tune_beams:
+            n_beams = len(values) - (4 if self.tune_coils else 0)
+            values[len(values) - n_beams:] *= self.default_setpoints[:n_beams]
+        return values
+
+    def relative_params(self, values):
+        """the inverse of absolute_params"""
+        params = np.array(values, dtype=float)
+        if self.tune_beams:
+            n_beams = len(params) - (4 if self.tune_coils else 0)
+            params[len(params) - n_beams:] /= self.default_setpoints[:n_beams]
+        return params
 
     def run(self):
         self.initialize_hardware()
@@ -362,7 +409,11 @@ class AtomLoadingOptimizer(EnvExperiment):
         params = params_dict['params']
 
         cost = self.optimization_routine(params)
-        uncertainty = 1/np.sqrt(-1*cost) if cost < 0 else 0
+        # the cost is -1*(number of atoms loaded), which is Poisson distributed
+        uncertainty = np.sqrt(max(-1*cost, 1))
+
+        self.history.add(**self.history_key, params=self.absolute_params(params), cost=cost,
+                         uncertainty=uncertainty, snapshot=self.history_snapshot)
 
         cost_dict = {'cost': cost, 'uncer': uncertainty}
         return cost_dict
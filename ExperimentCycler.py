@@ -76,8 +76,7 @@ class ExperimentCycler(EnvExperiment):
 
         value = 0.0
         for ch_i in range(len(self.laser_stabilizer.all_channels)):
-            self.set_dataset(self.laser_stabilizer.all_channels[ch_i].dB_history_dataset,
-                             [float(self.initial_RF_dB_values[ch_i])], broadcast=True, persist=True)
+            self.laser_stabilizer.all_channels[ch_i].dB_history.reset([float(self.initial_RF_dB_values[ch_i])])
 
     def reset_datasets(self):
         """
@@ -92,9 +91,8 @@ class ExperimentCycler(EnvExperiment):
         self.set_dataset('photocounts_current_iteration', [0], broadcast=True)
         self.set_dataset('photocounts2_current_iteration', [0], broadcast=True)
 
-        # no reason to let these datasets grow to huge lengths
-        for ch in self.laser_stabilizer.all_channels:
-            self.set_dataset(ch.dataset, [self.get_dataset(ch.dataset)[-1]], broadcast=True)
+        # the monitor datasets no longer need to be trimmed here, since the FeedbackChannel monitor_history
+        # keeps them to a bounded length. see utilities/bounded_history.py
 
     def rerun_base_methods(self):
         # print("I'm done pausing?")
@@ -125,6 +123,7 @@ class ExperimentCycler(EnvExperiment):
             needs_pause = self.scheduler.check_pause()
 
             if needs_pause:
+                self.finish_results()  # so the results are on disk while the other experiment runs
                 self.core.comm.close()  # put the hardware in a safe state before checking pause
                 self.scheduler.pause()  # check if we need to run a new experiment
 
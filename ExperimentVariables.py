@@ -1,6 +1,7 @@
 from artiq.experiment import *
 import numpy as np
 from collections import namedtuple
+import re
 
 
 def setattr_variables(experiment, exclude_list=[], exclude_keywords=[]):
@@ -22,16 +23,23 @@ def setattr_variables(experiment, exclude_list=[], exclude_keywords=[]):
         these. they can lead to timeout errors are also generally not needed as variables within an experiment.
     :return:
     """
+    exclude_set = set(exclude_list)
+    exclude_pattern = re.compile("|".join(re.escape(x) for x in exclude_keywords)) if exclude_keywords else None
+
+    missing = []
     for var in experiment.variables:
-        if not var in exclude_list and not np.product([x in var for x in exclude_keywords]):
-            try:
-                value = experiment.get_dataset(var)
-                setattr(experiment, var, value)
-            except Exception as e:
-                if type(e) == KeyError:  # if the variable does not exist
-                    print(f"Couldn't find variable {e}! Did you define it in vars_list in ExperimentVariables?")
-                else:
-                    print(f"Exception {e}") # todo: replace with raise statement
+        if var in exclude_set or (exclude_pattern is not None and exclude_pattern.search(var)):
+            continue
+        try:
+            value = experiment.get_dataset(var)
+            setattr(experiment, var, value)
+        except KeyError:  # if the variable does not exist
+            missing.append(var)
+        except Exception as e:
+            print(f"Exception {e}") # todo: replace with raise statement
+
+    if missing:
+        print(f"Couldn't find variables {missing}! Did you define them in vars_list in ExperimentVariables?")
 
 class ExperimentVariables(EnvExperiment):
 
@@ -60,14 +68,23 @@ class ExperimentVariables(EnvExperiment):
 
             Variable("n_measurements", 50, NumberValue, {'type': 'int', 'ndecimals':0, 'step':1, 'scale':1}, "general"),
             Variable("require_atom_loading_to_advance", True, BooleanValue, {}, "general"),
+            # per-shot results are buffered on the kernel and sent to the datasets this often, and always at the
+            # end of the measurement loop. 1 updates the datasets every shot.
+            Variable("n_shots_per_dataset_flush", 10, NumberValue, {'type': 'int', 'ndecimals': 0, 'step': 1,
+                                                                    'scale': 1}, "general"),
 
             Variable("n_excitation_attempts", 10, NumberValue, {'type': 'int', 'ndecimals': 0, 'step': 1, 'scale': 1},
                      "general"),
             Variable("n_excitation_cycles", 10, NumberValue, {'type': 'int', 'ndecimals': 0, 'step': 1, 'scale': 1},
                      "general"),
+            # the SPCM click timestamps are read out after this many excitation cycles. the clicks of about two
+            # readouts have to fit in the RTIO input FIFO
+            Variable("n_excitation_cycles_per_readout", 100, NumberValue, {'type': 'int', 'ndecimals': 0, 'step': 1,
+                                                                          'scale': 1}, "general"),
 
             # debugging
             Variable("dummy_variable", 0.0, NumberValue, {'type': 'float'}, "debugging"),
+            Variable("enable_rtio_profiler", False, BooleanValue, {}, "debugging"),
 
             # FORT AOM
             Variable("f_FORT", 80.0 * MHz, NumberValue, {'type': 'float', 'unit': 'MHz'}, "FORT AOM"),
@@ -314,6 +331,19 @@ class ExperimentVariables(EnvExperiment):
                      "Laser feedback"),
             Variable("aom_feedback_periodicity", 2, NumberValue, {'type': 'int', 'ndecimals': 0, 'scale': 1, 'step': 1},
                      "Laser feedback"),
+            Variable("aom_feedback_use_power_curve", True, BooleanValue, {}, "Laser feedback"),
+            # FeedbackChannel.run, e.g. stabilizer_FORT.run(setpoint_index=1) in load_MOT_and_FORT, uses the amplitude
+            # calibrated by the last AOMPowerStabilizer run instead of feeding back in the middle of the shot, if it
+            # was calibrated within this many seconds. every set point is calibrated at the start of each measurement
+            # unless aom_feedback_adaptive skips the run, so this should be longer than the MOT and FORT loading
+            # (~1 s by default) but shorter than aom_feedback_max_interval. set it to 0 to always feed back in the shot
+            Variable("aom_feedback_setpoint_lifetime", 5 * s, NumberValue, {'type': 'float', 'unit': 's',
+                                                                           'ndecimals': 2}, "Laser feedback"),
+            Variable("aom_feedback_adaptive", False, BooleanValue, {}, "Laser feedback"),
+            Variable("aom_feedback_max_interval", 10 * s, NumberValue, {'type': 'float', 'unit': 's', 'ndecimals': 1},
+                     "Laser feedback"),
+            Variable("aom_feedback_drift_safety_factor", 0.5, NumberValue, {'type': 'float', 'ndecimals': 2,
+                                                                             'step': 0.1}, "Laser feedback"),
             Variable("Rigol_carrier_frequency", 40 * kHz, NumberValue, {'type': 'float', 'unit': 'kHz', 'ndecimals': 3},
                      "Rigol DG1022Z settings"),
             Variable("Rigol_FM_deviation", 10 * kHz, NumberValue, {'type': 'float', 'unit': 'kHz', 'ndecimals': 3},
@@ -365,7 +395,7 @@ class ExperimentVariables(EnvExperiment):
                 else:
                     print(f"Exception {e}")
 
-        self.setattr_argument('which_node', EnumerationValue(['alice','bob','two_nodes']), "general")
+        self.setattr_argument('which_node', EnumerationValue(['alice','bob','two_nodes','sim']), "general")
 
     def run(self):
 
@@ -33,10 +33,14 @@ import mloop.controllers as mlc
 import mloop.visualizations as mlv
 
 import sys, os
+import tempfile
 cwd = os.getcwd() + "\\"
 sys.path.append(cwd)
 sys.path.append(cwd+"\\repository\\qn_artiq_routines")
 from utilities.BaseExperiment import BaseExperiment
+from utilities.parameter_interleaver import ParameterInterleaver
+from utilities.early_stopping import EarlyStopping
+from utilities.optimizer_history import OptimizerHistory
 
 # this is where your experiment function should live
 from subroutines.experiment_functions import *
@@ -121,6 +125,19 @@ class GeneralVariableOptimizer(EnvExperiment):
         group1 = "optimizer settings"
         self.setattr_argument("max_runs", NumberValue(70, type='int', scale=1, ndecimals=0, step=1), group1)
         self.setattr_argument("target_cost", NumberValue(-100, type='int', scale=1, ndecimals=0, step=1), group1)
+        # if > 1, each candidate is interleaved shot-by-shot with up to n_interleaved_sets - 1 of the best parameter
+        # sets so far, which are used to correct the cost for drifts. see optimization_routine
+        self.setattr_argument("n_interleaved_sets", NumberValue(1, type='int', scale=1, ndecimals=0, step=1), group1)
+        # if > 0, every this many measurements, stop the candidate if its cost is confidently worse than the best cost.
+        # only for costs which are binomial fractions, e.g. atom_loading_cost. see utilities/early_stopping.py
+        self.setattr_argument("early_stopping_block_size", NumberValue(0, type='int', scale=1, ndecimals=0, step=1),
+                              group1)
+        self.setattr_argument("early_stopping_confidence", NumberValue(0.99, ndecimals=3, step=0.01), group1)
+        # start M-LOOP from the best point of earlier runs with the same variables and functions, and train its
+        # learner on all of their points. older points count for less, see utilities/optimizer_history.py
+        self.setattr_argument("warm_start_from_history", BooleanValue(False), group1)
+        self.setattr_argument("history_max_age_days", NumberValue(7), group1)
+        self.setattr_argument("history_half_life_days", NumberValue(1), group1)
 
         # todo: add keyword arguments for setting up M-LOOP
         #  there is a lot more available than what we've been using
@@ -154,6 +171,7 @@ class GeneralVariableOptimizer(EnvExperiment):
             max_bounds.append(opt_var.max_bound)
 
         self.experiment_name = self.experiment_function
+        self.experiment_kernel = eval(self.experiment_name) # so run_batch can call it
         self.experiment_function = lambda: eval(self.experiment_name)(self)
 
         self.cost_name = self.cost_function
@@ -164,6 +182,9 @@ class GeneralVariableOptimizer(EnvExperiment):
         self.cost_dataset = "cost"
         self.initial_cost = 0
         self.best_cost = 0
+        self.cost_uncertainty = 0.0 # the uncertainty of the last cost, see optimization_routine
+        self.cost_is_bad = False # if no measurements were taken with the last candidate, see optimization_routine
+        self.warned_no_uncertainty = False # see get_cost
 
         # instantiate the M-LOOP interface
         interface = MLOOPInterface()
@@ -171,12 +192,39 @@ class GeneralVariableOptimizer(EnvExperiment):
 
         self.n_params = len(self.var_and_bounds_objects)
 
-        self.mloop_controller = mlc.create_controller(interface,
-                                                      max_num_runs=self.max_runs,
-                                                      target_cost=self.target_cost,
-                                                      num_params=self.n_params,
-                                                      min_boundary=min_bounds,
-                                                      max_boundary=max_bounds)
+        self.n_measurements_per_set = self.n_measurements
+        self.initialize_interleaving()
+        self.initialize_early_stopping()
+
+        # every point M-LOOP evaluates is stored, so that later runs can start from the best one
+        self.history = OptimizerHistory(os.path.join(cwd, "optimizer_history.sqlite"))
+        self.history_key = dict(optimizer=self.__class__.__name__, experiment_function=self.experiment_name,
+                                cost_function=self.cost_name,
+                                variables=[var.name for var in self.var_and_bounds_objects],
+                                min_bounds=min_bounds, max_bounds=max_bounds)
+        # the variables the cost depends on besides the optimized ones, which earlier points must have had the same
+        self.history_snapshot = dict(self.override_ExperimentVariables_dict, n_measurements=self.n_measurements_per_set)
+        controller_kwargs = {}
+        # the controller loads the training archive when it is created, so it is only needed until then
+        with tempfile.TemporaryDirectory() as archive_dir:
+            if self.warm_start_from_history:
+                history_kwargs = dict(max_age_days=self.history_max_age_days,
+                                      half_life_days=self.history_half_life_days, match=self.history_snapshot)
+                first_params = self.history.warm_start_params(**self.history_key, **history_kwargs)
+                if first_params is not None:
+                    controller_kwargs['first_params'] = first_params
+                training_filename = self.history.write_training_archive(
+                    os.path.join(archive_dir, "history_archive.pkl"), **self.history_key, **history_kwargs)
+                if training_filename is not None:
+                    controller_kwargs['training_filename'] = training_filename
+
+            self.mloop_controller = mlc.create_controller(interface,
+                                                          max_num_runs=self.max_runs,
+                                                          target_cost=self.target_cost,
+                                                          num_params=self.n_params,
+                                                          min_boundary=min_bounds,
+                                                          max_boundary=max_bounds,
+                                                          **controller_kwargs)
 
         self.measurement = 0
         self.counts = 0
@@ -194,6 +242,45 @@ class GeneralVariableOptimizer(EnvExperiment):
                      " experiment(s) that I am waiting on to run")
         self.needs_fresh_build = earlier_experiments > 0
 
+    def initialize_interleaving(self):
+        """
+        the interleaver for running each candidate together with the reference parameter sets. each set gets
+        n_measurements measurements, so the counts lists are made long enough for all of them. this has to be
+        called after base.prepare, which replaces the interleaver with a disabled one.
+        """
+        if self.n_interleaved_sets > 1:
+            # next_shot only sets the variables themselves, so anything computed from them on the host, e.g. the
+            # amplitudes, the *_mu times, the feedback set points, or the recorded DMA sequences, would be stale
+            derived_from = set().union(*self.base.dependencies.values(), *self.dma_sequences.dependencies)
+            needs_prepare = [var.name for var in self.var_and_bounds_objects if var.name in derived_from]
+            assert len(needs_prepare) == 0, (f"{needs_prepare} can not be interleaved because base.prepare or the "
+                                             f"DMA sequences must be redone when they change. "
+                                             f"Set n_interleaved_sets to 1 to optimize them.")
+
+        self.n_measurements = self.n_measurements_per_set * self.n_interleaved_sets
+        self.base.initialize_counts_lists()
+        self.interleaver = ParameterInterleaver(self, [var.name for var in self.var_and_bounds_objects],
+                                                max_sets=self.n_interleaved_sets, n_shots=self.n_measurements)
+
+        # the parameter sets which have been run, each with its drift-corrected costs
+        self.parameter_history = []
+
+    def initialize_early_stopping(self):
+        """
+        the early stopping of candidates whose cost is clearly worse than the best cost so far. this has to be
+        called after base.prepare, which replaces it with a disabled one. see utilities/early_stopping.py
+        """
+        successes = None
+        if self.early_stopping_block_size > 0:
+            if self.cost_name not in cost_functions.BINOMIAL_COSTS:
+                logging.warning(f"early stopping is off, since {self.cost_name} is not a binomial fraction")
+            elif self.n_interleaved_sets > 1:
+                logging.warning("early stopping is off, since it can't tell the interleaved parameter sets apart")
+            else:
+                successes = cost_functions.BINOMIAL_COSTS[self.cost_name]
+        self.early_stopping = EarlyStopping(self, successes=successes, block_size=self.early_stopping_block_size,
+                                            confidence=self.early_stopping_confidence)
+
     def initialize_datasets(self):
 
         self.base.initialize_datasets()
@@ -211,13 +298,14 @@ class GeneralVariableOptimizer(EnvExperiment):
             self.optimizer_var_datasets.append("optimizer_var"+str(i))
             self.set_dataset(self.optimizer_var_datasets[i], [0.0], broadcast=True)
 
+        self.set_dataset("cost_drift", [0.0], broadcast=True)
+
         for var, val in self.override_ExperimentVariables_dict.items():
             self.set_dataset(var, val)
 
         value = 0.0
         for ch_i in range(len(self.laser_stabilizer.all_channels)):
-            self.set_dataset(self.laser_stabilizer.all_channels[ch_i].dB_history_dataset,
-                             [float(self.initial_RF_dB_values[ch_i])], broadcast=True, persist=True)
+            self.laser_stabilizer.all_channels[ch_i].dB_history.reset([float(self.initial_RF_dB_values[ch_i])])
 
     def reset_datasets(self):
         """
@@ -236,6 +324,8 @@ class GeneralVariableOptimizer(EnvExperiment):
         if self.needs_fresh_build:
             self.base.build()
             self.base.prepare()
+            self.initialize_interleaving()
+            self.initialize_early_stopping()
 
         self.initialize_datasets()
 
@@ -263,11 +353,19 @@ class GeneralVariableOptimizer(EnvExperiment):
 
         # write the h5 file here in case worker refuses to die
         self.write_results({'name':self.experiment_name[:-11]+"_optimized_for_"+self.cost_name[:-5]})
+        self.finish_results()
         
     @kernel
     def initialize_hardware(self):
         self.base.initialize_hardware()
 
+    @kernel
+    def run_batch(self):
+        """the hardware initialization and the measurement loop for all of the interleaved parameter sets"""
+        self.base.initialize_hardware()
+        self.interleaver.start()
+        self.experiment_kernel(self)
+
     @kernel
     def warm_up(self):
         """hardware init and turn things on"""
@@ -295,9 +393,40 @@ class GeneralVariableOptimizer(EnvExperiment):
             self.laser_stabilizer.run()
         self.dds_FORT.sw.on()
 
-    def get_cost(self) -> TInt32:
-        """cost function wrapper"""
-        return self.cost_function()
+    def get_cost(self) -> CostResult:
+        """cost function wrapper. returns a CostResult of the cost and its uncertainty, see cost_functions"""
+        result = self.cost_function()
+        if not isinstance(result, CostResult):
+            if not self.warned_no_uncertainty:
+                logging.warning(f"{self.cost_name} doesn't return a CostResult, so every cost is given an "
+                                f"uncertainty of {UNKNOWN_COST_UNCERTAINTY}. see cost_functions")
+                self.warned_no_uncertainty = True
+            result = CostResult(result, UNKNOWN_COST_UNCERTAINTY)
+        return result
+
+    def get_interleaved_cost(self, k) -> CostResult:
+        """
+        the cost of only the measurements which were taken with parameter set k in the last run, or None if there
+        weren't any
+        """
+        measurements = self.interleaver.measurements_of_set(k, self.n_measurements)
+        if len(measurements) == 0:
+            logging.warning(f"no measurements were taken with parameter set {k}")
+            return None
+        counts_list, counts2_list = self.counts_list, self.counts2_list
+        self.counts_list = [counts_list[i] for i in measurements]
+        self.counts2_list = [counts2_list[i] for i in measurements]
+        try:
+            return self.get_cost()
+        finally:
+            self.counts_list, self.counts2_list = counts_list, counts2_list
+
+    def reference_sets(self, params) -> list:
+        """the best n_interleaved_sets - 1 parameter sets run so far, other than params, by their mean cost"""
+        if self.n_interleaved_sets < 2:
+            return []
+        others = [record for record in self.parameter_history if not np.allclose(record['params'], params)]
+        return sorted(others, key=lambda record: np.mean(record['costs']))[:self.n_interleaved_sets - 1]
 
     def optimization_routine(self, params: TArray(TFloat), check_initial_cost=False) -> TInt32:
         """
@@ -312,9 +441,16 @@ class GeneralVariableOptimizer(EnvExperiment):
             any improvement.
         return:
             cost: the cost for the optimizer
+
+        if n_interleaved_sets > 1, the shots alternate between params and up to n_interleaved_sets - 1 reference
+        sets, which are the best parameter sets run so far. the drift is the average change of the reference costs
+        from their previous values, and it is subtracted from the cost of params and of the references, so that
+        all of the costs the optimizer sees are comparable. if no measurements were taken with params,
+        cost_is_bad is set, so that M-LOOP is told the point is bad rather than given a made up cost.
         """
 
-        # todo: set the experiment variables from params. see GeneralVariableScan
+        if check_initial_cost:
+            params = [var.default_value for var in self.var_and_bounds_objects]
 
         for i in range(self.n_params):
             if not check_initial_cost:
@@ -325,16 +461,47 @@ class GeneralVariableOptimizer(EnvExperiment):
                 self.set_dataset(self.optimizer_var_datasets[i], [self.var_and_bounds_objects[i].default_value],
                                  broadcast=True)
 
-        self.initialize_hardware()
+        references = self.reference_sets(params)
+        self.interleaver.set_values([list(params)] + [record['params'] for record in references])
+        self.n_measurements = self.n_measurements_per_set * self.interleaver.n_sets
+
         self.reset_datasets()
+        self.early_stopping.reset(target_cost=np.inf if check_initial_cost else self.best_cost)
 
-        # the measurement loop.
-        self.experiment_function()
+        # the measurement loop, in the same kernel as the hardware initialization
+        self.run_batch()
+
+        # if the candidate was stopped early, its cost is computed from the measurements which were taken
+        if self.early_stopping.stopped_at > 0:
+            self.n_measurements = self.early_stopping.stopped_at
+            self.print_async("stopped after", self.n_measurements, "measurements, since the cost is clearly worse")
 
         self.iteration += 1
         self.set_dataset("iteration", self.iteration, broadcast=True)
 
-        cost = self.get_cost()
+        result = self.get_interleaved_cost(0)
+        self.cost_is_bad = result is None
+        if self.cost_is_bad:
+            self.print_async("no measurements were taken with these parameters, so the point is skipped")
+            return 0.0
+
+        cost, self.cost_uncertainty = result
+        drift = 0.0
+        # references without any measurements this time don't tell us about the drift
+        measured = [(result, record) for result, record in
+                    zip([self.get_interleaved_cost(k + 1) for k in range(len(references))], references)
+                    if result is not None]
+        if len(measured) > 0:
+            drift = float(np.mean([result.cost - np.mean(record['costs']) for result, record in measured]))
+            for result, record in measured:
+                record['costs'].append(result.cost - drift)
+            cost -= drift
+            # the drift is a mean over the references, so its uncertainty adds to that of the cost
+            drift_uncertainty = np.sqrt(sum([result.uncertainty**2 for result, _ in measured]))/len(measured)
+            self.cost_uncertainty = float(np.sqrt(self.cost_uncertainty**2 + drift_uncertainty**2))
+        self.parameter_history.append({'params': list(params), 'costs': [cost]})
+        self.append_to_dataset("cost_drift", drift)
+
         if not check_initial_cost:
             self.append_to_dataset(self.cost_dataset, cost)
             if cost < self.best_cost:
@@ -359,16 +526,20 @@ class GeneralVariableOptimizer(EnvExperiment):
 
         return cost
 
-    # this is fine for atom retention experiments, which is nearly
-    # all experiments
     def get_next_cost_dict_for_mloop(self, params_dict):
 
         # Get parameters from the provided dictionary
         params = params_dict['params']
 
         cost = self.optimization_routine(params)
-        # a proxy for the uncertainty, since the cost is typically -1*(number of atoms detected)
-        uncertainty = 1/np.sqrt(-1*cost) if cost < 0 else 0
+        # from the statistics of the measurements which were taken, see cost_functions and optimization_routine
+        uncertainty = self.cost_uncertainty
+
+        if self.cost_is_bad:
+            return {'cost': cost, 'uncer': uncertainty, 'bad': True}
+
+        self.history.add(**self.history_key, params=params, cost=cost, uncertainty=uncertainty,
+                         snapshot=self.history_snapshot)
 
         cost_dict = {'cost': cost, 'uncer': uncertainty}
         return cost_dict
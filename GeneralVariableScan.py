@@ -19,6 +19,8 @@ import numpy as np
 from numpy import array  # necessary for some override_ExperimentVariable entries
 
 import sys, os
+import time
+from types import MethodType
 
 cwd = os.getcwd() + "\\"
 sys.path.append(cwd)
@@ -70,6 +72,24 @@ class GeneralVariableScan(EnvExperiment):
         # it has an effect depends on experiment_function
         self.setattr_argument("control_experiment", BooleanValue(False), "Control experiment")
 
+        # if True, only the parts of base.prepare affected by the scan variables are redone at each scan step,
+        # and the hardware is only re-initialized if needed. set to False to re-prepare everything each step.
+        self.setattr_argument("incremental_prepare", BooleanValue(True))
+
+        # if True, the scan values are passed to the kernel through an RPC instead of host attributes, so that one
+        # precompiled kernel can be reused for every scan step rather than compiling the experiment function each step.
+        # a precompiled kernel doesn't write attributes back to the host, and starts every call from the state it was
+        # compiled with, so anything the kernel changes doesn't carry over from one scan step to the next: the laser
+        # feedback amplitudes and scheduling, the power curves and their calibration times, which DMA sequences are
+        # recorded, and the counts lists on the host (so the scan's cost or plots can't use them). only use this for
+        # experiment functions which don't rely on any of these.
+        self.setattr_argument("reuse_compiled_kernel", BooleanValue(False))
+
+        # if True, the whole scan runs in one kernel with the scan values preloaded as an array, so there is no
+        # core reset, compilation, or hardware re-initialization between scan steps. only scan variables which are
+        # used directly by the kernel, i.e. nothing that base.prepare derives from them, can be scanned this way.
+        self.setattr_argument("single_kernel_scan", BooleanValue(False))
+
         self.base.set_datasets_from_gui_args()
         print("build - done")
 
@@ -135,6 +155,7 @@ class GeneralVariableScan(EnvExperiment):
 
         try:
             self.experiment_name = self.experiment_function
+            self.experiment_kernel = eval(self.experiment_name) # so the scan step kernel can call it
             self.experiment_function = lambda :eval(self.experiment_name)(self)
         except NameError as e:
             print(f"The function {self.experiment_name} is not defined. Did you forget to import it?")
@@ -144,6 +165,25 @@ class GeneralVariableScan(EnvExperiment):
         self.counts = 0
         self.counts2 = 0
 
+        self.initialize_scan_variable_setter(scan_vars)
+
+        if self.single_kernel_scan:
+            assert self.scan_values_on_kernel, "single_kernel_scan requires numeric scan variables"
+
+            # variables which base.prepare derives other quantities from can't be updated inside the kernel
+            derived_from = set().union(*self.base.dependencies.values())
+            needs_prepare = [var for var in scan_vars if var in derived_from]
+            assert len(needs_prepare) == 0, (f"{needs_prepare} can not be scanned with single_kernel_scan because "
+                                             f"base.prepare must be re-run when they change. "
+                                             f"Set single_kernel_scan to False to scan them.")
+
+            # the full scan grid, flattened. the values for step i start at index i*n_scan_variables
+            self.n_scan_variables = len(scan_vars)
+            self.scan_grid = np.array([[value1, value2][:self.n_scan_variables]
+                                       for value1 in self.scan_sequence1
+                                       for value2 in self.scan_sequence2], dtype=float).flatten()
+            self.n_scan_steps = len(self.scan_sequence1) * len(self.scan_sequence2)
+
         # if there are multiple experiments in the schedule, then there might be something that has updated the datasets
         # e.g., as a result of an optimization scan. We want to make sure that this experiment uses the most up-to-date
         # datasets. However, ARTIQ runs build and prepare while the previous experiment is running, so our base.build
@@ -155,6 +195,113 @@ class GeneralVariableScan(EnvExperiment):
         logging.info("my rid is", my_rid, ", and there are", earlier_experiments, " experiment(s) that I am waiting on to run")
         self.needs_fresh_build = earlier_experiments > 0
 
+    def initialize_scan_variable_setter(self, scan_vars):
+        """
+        Create the kernel method set_scan_variables(values, offset) which sets the scan variables from an array of
+        floats, starting at values[offset].
+
+        We can't setattr on the kernel, so the assignments are generated from the variable names. Casting each value to
+        the type of the current attribute keeps the kernel types the same as when the variable was a host attribute.
+        :param scan_vars: list of the names of the scan variables
+        """
+        # the kernel-side parameter array. scan values are read into this by get_scan_values
+        self.scan_values = np.zeros(max(len(scan_vars), 1))
+
+        # scanning a string variable, for example, can only be done by setting the host attribute and recompiling
+        self.scan_values_on_kernel = len(scan_vars) > 0 and all(
+            isinstance(getattr(self, var), (bool, int, float, np.number)) for var in scan_vars)
+
+        setter_lines = []
+        if self.scan_values_on_kernel:
+            for i, var in enumerate(scan_vars):
+                value = getattr(self, var)
+                if isinstance(value, (bool, np.bool_)):
+                    setter_lines.append(f"self.{var} = values[offset + {i}] != 0.0")
+                elif isinstance(value, (int, np.integer)):
+                    setter_lines.append(f"self.{var} = int(values[offset + {i}])")
+                else:
+                    setter_lines.append(f"self.{var} = values[offset + {i}]")
+        else:
+            setter_lines.append("pass")
+
+        self.set_scan_variables = MethodType(kernel_from_string(["self", "values", "offset"],
+                                                                        "\n".join(setter_lines)), self)
+
+        self.compiled_scan_step = None
+        self.t_kernel_start = 0.0
+
+    def get_scan_values(self) -> TArray(TFloat):
+        """called at the start of scan_step. also marks the time the kernel started for logging the compile time"""
+        self.t_kernel_start = time.time()
+        return self.scan_values
+
+    @kernel
+    def scan_step(self):
+        """
+        one step of the scan. because the scan values are read from get_scan_values rather than embedded in the kernel
+        as attributes, this kernel only needs to be compiled once as long as nothing derived from the scan
+        variables on the host (see BaseExperiment.prepare_incremental) changes.
+        """
+        self.set_scan_variables(self.get_scan_values(), 0)
+        self.experiment_kernel(self)
+
+    def run_scan_step(self, recompile):
+        """
+        run the experiment function for the current scan values, and log the time spent compiling vs running
+
+        :param recompile: if True, the kernel must be compiled again, e.g. because prepare_incremental changed some
+            of the host attributes used by the kernel.
+        """
+        t_compile = 0.0
+        t_start = time.time()
+        self.t_kernel_start = t_start
+        if self.reuse_compiled_kernel and self.scan_values_on_kernel and hasattr(self.core, 'precompile'):
+            if recompile or self.compiled_scan_step is None:
+                # note that attributes are not written back to the host by precompiled kernels
+                self.compiled_scan_step = self.core.precompile(self.scan_step)
+                t_compile = time.time() - t_start
+            t_call = time.time()
+            self.compiled_scan_step()
+        else:
+            t_call = time.time()
+            if self.scan_values_on_kernel:
+                self.scan_step()
+            else:
+                self.experiment_function()
+        t_end = time.time()
+
+        # for the kernels which are compiled when called, the time before get_scan_values is called is the compile time
+        t_compile += max(self.t_kernel_start - t_call, 0.0)
+        t_run = t_end - max(self.t_kernel_start, t_call)
+        logging.info(f"scan step compile time: {t_compile:.3f} s, run time: {t_run:.3f} s")
+        self.append_to_dataset("scan_step_compile_time", t_compile)
+        self.append_to_dataset("scan_step_run_time", t_run)
+
+    @rpc(flags={"async"})
+    def start_scan_step(self, iteration):
+        """the bookkeeping done on the host at the start of each step of the single kernel scan"""
+        self.set_dataset("iteration", iteration, broadcast=True)
+        logging.info(f"current iteration: {self.scan_var_labels} = "
+                     f"{self.scan_grid[iteration*self.n_scan_variables:(iteration + 1)*self.n_scan_variables]}")
+        self.reset_datasets()
+
+    @rpc(flags={"async"})
+    def end_scan_step(self):
+        """write and overwrite the file here so we can quit the experiment early without losing data"""
+        self.write_results({'name': self.experiment_name[:-11] + "_scan_over_" + self.scan_var_filesuffix})
+
+    @kernel
+    def single_kernel_scan_loop(self):
+        """
+        run the experiment function for every point in the scan grid without leaving the kernel.
+        the datasets are updated and the results are written by async RPCs so the loop doesn't wait on the host.
+        """
+        for iteration in range(self.n_scan_steps):
+            self.set_scan_variables(self.scan_grid, iteration*self.n_scan_variables)
+            self.start_scan_step(iteration)
+            self.experiment_kernel(self)
+            self.end_scan_step()
+
     @kernel
     def initialize_hardware(self):
         self.base.initialize_hardware()
@@ -169,10 +316,12 @@ class GeneralVariableScan(EnvExperiment):
         for var,val in self.override_ExperimentVariables_dict.items():
             self.set_dataset(var, val)
 
+        self.set_dataset("scan_step_compile_time", [], broadcast=True)
+        self.set_dataset("scan_step_run_time", [], broadcast=True)
+
         value = 0.0
         for ch_i in range(len(self.laser_stabilizer.all_channels)):
-            self.set_dataset(self.laser_stabilizer.all_channels[ch_i].dB_history_dataset,
-                             [float(self.initial_RF_dB_values[ch_i])], broadcast=True, persist=True)
+            self.laser_stabilizer.all_channels[ch_i].dB_history.reset([float(self.initial_RF_dB_values[ch_i])])
 
     def reset_datasets(self):
         """
@@ -258,6 +407,14 @@ class GeneralVariableScan(EnvExperiment):
 
         self.warm_up()
 
+        if self.single_kernel_scan:
+            # the scan variables only affect the kernel, so we only need to prepare and initialize the hardware once
+            self.initialize_dependent_variables()
+            self.initialize_hardware()
+            self.single_kernel_scan_loop()
+            self.finish_results()
+            return
+
         for variable1_value in self.scan_sequence1:
             # update the variable. setattr can't be called on the kernel, and this is what
             # allows us to update an experiment variable without hardcoding it, i.e.
@@ -265,6 +422,8 @@ class GeneralVariableScan(EnvExperiment):
             # have a kernel decorator, and we have to re-initialize the hardware each
             # iteration.
             setattr(self, self.scan_variable1, variable1_value)
+            self.scan_values[0] = variable1_value
+            changed_variables = [self.scan_variable1]
             logging.info(f"current iteration: {self.scan_variable1_name} = {variable1_value}")
 
             for variable2_value in self.scan_sequence2:
@@ -273,18 +432,32 @@ class GeneralVariableScan(EnvExperiment):
 
                 if self.scan_variable2 != None:
                     setattr(self, self.scan_variable2, variable2_value)
+                    self.scan_values[1] = variable2_value
+                    changed_variables.append(self.scan_variable2)
                     logging.info(f"current iteration: {self.scan_variable2_name} ={variable2_value}")
 
-                self.initialize_dependent_variables()
-                self.initialize_hardware()
+                if iteration == 0 or not self.incremental_prepare:
+                    self.initialize_dependent_variables()
+                    self.initialize_hardware()
+                    recompile = True
+                else:
+                    # only redo what the scan variables affect, e.g. we don't need to re-instantiate the
+                    # laser stabilizer and reset all of the dds channels if we are scanning t_blowaway
+                    if self.base.prepare_incremental(changed_variables):
+                        self.initialize_hardware()
+                    # the compiled kernel is still valid if none of the host-derived quantities changed
+                    recompile = len(set(changed_variables) & set().union(*self.base.dependencies.values())) > 0
+                changed_variables = []
                 self.reset_datasets()
 
                 # the measurement loop.
-                self.experiment_function()
+                self.run_scan_step(recompile)
                 # write and overwrite the file here so we can quit the experiment early without losing data
                 self.write_results({'name': self.experiment_name[:-11] + "_scan_over_" + self.scan_var_filesuffix})
 
                 iteration += 1
 
+        self.finish_results()
+
 
 
@@ -174,4 +174,5 @@ class SingleAtomTemperature(EnvExperiment):
         # set the cooling DP AOM to the MOT settings
 
         # finally, in case the worker refuses to die
-        self.write_results()
\ No newline at end of file
+        self.write_results()
+        self.finish_results()  # and wait until it is on disk
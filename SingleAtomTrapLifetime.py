@@ -176,3 +176,4 @@ class SingleAtomTrapLifetime(EnvExperiment):
         # set the cooling DP AOM to the MOT settings
 
         self.write_results()  # write the h5 file here in case worker refuses to die
+        self.finish_results()  # and wait until it is on disk
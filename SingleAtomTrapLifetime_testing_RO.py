@@ -223,3 +223,4 @@ class SingleAtomTrapLifetime_testin_RO(EnvExperiment):
         # set the cooling DP AOM to the MOT settings
 
         self.write_results()  # write the h5 file here in case worker refuses to die
+        self.finish_results()  # and wait until it is on disk
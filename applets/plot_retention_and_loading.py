@@ -14,9 +14,12 @@ import numpy as np
 import PyQt5  # make sure pyqtgraph imports Qt5
 from PyQt5.QtCore import QTimer
 import pyqtgraph
-from skimage.filters import threshold_otsu
 from artiq.applets.simple import TitleApplet
 
+import os, sys
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from utilities.atom_statistics import retention, otsu_threshold
+
 
 class XYPlot(pyqtgraph.PlotWidget):
     def __init__(self, args):
@@ -61,24 +64,17 @@ class XYPlot(pyqtgraph.PlotWidget):
                     for i in range(iteration):
                         shot1 = counts_shot1[i * measurements:(i + 1) * measurements]
                         shot2 = counts_shot2[i * measurements:(i + 1) * measurements]
-                        atoms_loaded = [x > cutoff for x in shot1]
-                        n_atoms_loaded = sum(atoms_loaded)
-                        loading_fraction = n_atoms_loaded / measurements
 
-                        if loading_fraction > 0.3:  # apparent very low rate loading might be wrongly classified background
-                            cutoff = threshold_otsu(shot1)
-                            atoms_loaded = [x > cutoff for x in shot1]
-                            n_atoms_loaded = sum(atoms_loaded)
-                            loading_fraction = n_atoms_loaded / measurements
+                        # apparent very low rate loading might be wrongly classified background, so the Otsu
+                        # threshold is only used if more than 30% of the shots are above the cutoff
+                        iteration_cutoff = otsu_threshold(shot1, cutoff)
+                        n_atoms_retained, n_atoms_loaded = retention(shot1, shot2, iteration_cutoff, iteration_cutoff)
 
                         n_atoms_loaded_array[i] = n_atoms_loaded
-                        atoms_retained = [x > cutoff and y for x, y in zip(shot2, atoms_loaded)]
-                        loading_fraction = n_atoms_loaded / measurements
-                        loading_rate_array[i] = loading_fraction
-                        retention_fraction = 0 if not n_atoms_loaded > 0 else sum(atoms_retained) / n_atoms_loaded
-                        retention_array[i] = retention_fraction
+                        loading_rate_array[i] = n_atoms_loaded / measurements
+                        retention_array[i] = 0 if not n_atoms_loaded > 0 else n_atoms_retained / n_atoms_loaded
 
-                    error = np.array([1/np.sqrt(n) if n > 0 else 0 for n in n_atoms_loaded_array])
+                    error = np.where(n_atoms_loaded_array > 0, 1/np.sqrt(np.maximum(n_atoms_loaded_array, 1)), 0)
 
                     self.clear()
                     if len(x) == len(retention_array) and len(x) == len(loading_rate_array):
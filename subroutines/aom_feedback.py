@@ -12,6 +12,9 @@ for feedback, and other parameters, are defined in utilities/config/your_node/fe
 is alice, bob, etc. All feedback channel names should follow the convention "dds_description", and the "dds_description"
 must be one of the keys in the DDS_DEFAULTS dictionary in utilities/config/your_node/device_aliases.json.
 THIS IS ASSUMED BY THE CODE IN AOMPowerStabilizer.
+A feedback channel can optionally specify "averages", the number of Sampler measurements to average for that channel,
+e.g. because some detectors give better SNR than others (the I2Vs compared to the fW detector). Channels which
+don't specify it use the averages of the AOMPowerStabilizer.
 
 Intended usage:
 1. Instantiate the servo in the prepare method of the parent artiq experiment (e.g. the BaseExperiment)
@@ -19,6 +22,23 @@ Intended usage:
 the AOM powers, or monitor() to measure each channel and update the monitor datasets but without actually
 feeding back to the measurement.
 3. See the example code block below for a typical use example and some important things to note.
+4. Alternatively, call scheduled_run() before each measurement. If adaptive feedback is enabled, this only runs the
+feedback when a channel is predicted to drift out of tolerance, based on the drift observed between runs. See
+AOMPowerStabilizer.scheduled_run.
+
+Power curves:
+Each FeedbackChannel learns the shape of the detector value vs. dds amplitude curve of its AOM from consecutive
+measurements made during feedback. Because the laser power drifts, only the shape is learned, as the logarithmic
+slope d(log value)/d(amplitude) in bins of amplitude, which doesn't depend on the laser power. This is persisted in
+the dataset "dds_name_power_curve". The first correction of each run integrates the slope to jump to the amplitude
+which should give the set point, and the proportional feedback only refines it. See FeedbackChannel.predict_amplitude.
+
+Multiple set points:
+Channels with more than one set point, e.g. dds_FORT, have all of their set points calibrated in each
+AOMPowerStabilizer run, right after the default set point and while the dds is still on. See
+FeedbackChannel.run_other_setpoints. Each calibration is timestamped, and FeedbackChannel.run(setpoint_index=...),
+e.g. in load_MOT_and_FORT, only sets the dds to the calibrated amplitude if the calibration is more recent than the
+setpoint_lifetime of the AOMPowerStabilizer, instead of running the feedback again in the middle of the shot.
 
 class MyStableExperiment(EnvExperiment):
     ... BaseExperiment setup happens in self.build, including instantiation of an AOMPowerStabilizer
@@ -50,8 +70,6 @@ Preston's notes:
 todo: add an attribute to AOMPowerStabilizers which is a list of AOMs we want to leave on after the feedback is run,
  if any. this list can then be overwritten in prepare at the experiment level, even if we give a default list in
  Base experiment
-todo: make number of measurements to average specific to each feedback channel,
- because some detectors give better SNR (e.g. the I2Vs compared to the fW detector)
 """
 
 from artiq.experiment import *
@@ -68,12 +86,16 @@ sys.path.append(cwd+"\\repository\\qn_artiq_routines")
 
 from utilities.conversions import dB_to_V
 from utilities.helper_functions import print_async
+from utilities.bounded_history import BoundedHistory
+
+# the number of amplitude bins of the power curves
+POWER_CURVE_BINS = 16
 
 
 class FeedbackChannel:
 
     def __init__(self, stabilizer, name, dds_obj, buffer_index, set_points, p, i, frequency, amplitude, dataset,
-                 dB_dataset, t_measure_delay, error_history_length, max_dB, tol=0.01):
+                 dB_dataset, t_measure_delay, error_history_length, max_dB, tol=0.01, averages=1, sampler=None):
         """
         class which defines a DDS feedback channel
 
@@ -92,6 +114,8 @@ class FeedbackChannel:
         't_measure_delay': time to wait after turning on the dds before making a measurement
         'error_history_length->int':, how many errors to store for the integral term
         'max_dB': the maximum dB we can attempt to set for the dds channel
+        'averages': the number of Sampler measurements to average for this channel
+        'sampler': the Sampler which 'buffer_index' refers to, for measuring this channel by itself
         """
         self.stabilizer = stabilizer
         self.name = name
@@ -105,44 +129,166 @@ class FeedbackChannel:
         self.amplitude = amplitude
         self.amplitudes = np.zeros(len(self.set_points)) # we would rather output too no RF than too much
         self.amplitudes[0] = self.amplitude
+        # the timeline (now_mu) when each set point was last calibrated, or 0 if it hasn't been
+        self.t_calibrated_mu = [np.int64(0)] * len(self.set_points)
         self.feedback_sign = 1.0
         self.value = 0.0 # the last value of the measurement
         self.value_normalized = 0.0 # self.value normalized to the set point
         self.dataset = dataset
         self.dB_dataset = dB_dataset # the name of the dataset that stores the dB RF power for the dds
         self.dB_history_dataset = dB_dataset + str("_history")
+        # bounded, decimated histories, so these datasets don't grow forever. see utilities/bounded_history.py
+        self.monitor_history = BoundedHistory(stabilizer.exp, self.dataset)
+        self.dB_history = BoundedHistory(stabilizer.exp, self.dB_history_dataset, persist=True)
         self.t_measure_delay = t_measure_delay
-        self.error_history_arr = np.full(error_history_length,0.0)
-        self.error_buffer = np.full(error_history_length-1,0.0)
-        self.error_history_length = error_history_length
-        self.cumulative_error = 0.0 # will store a sum of the
+        # a circular buffer of the last error_history_length errors. error_index is where the next error goes,
+        # and cumulative_error is the running sum of the buffer, for the integral term
+        self.error_history_length = max(int(error_history_length), 1)
+        self.error_history_arr = np.full(self.error_history_length, 0.0)
+        self.error_index = 0
+        self.cumulative_error = 0.0
         self.max_dB = max_dB
         self.max_ampl = (2 * 50 * 10 ** (self.max_dB / 10 - 3)) ** (1 / 2)
         self.ampl_default = 0.0
         self.tol = tol
+        self.averages = max(int(averages), 1)
+        self.sampler = sampler
+        self.sampler_ch = buffer_index % 8
+        self.measurement = 0.0 # the last measurement from measure_isolated
+
+        # for predicting when this channel will drift out of tolerance. see AOMPowerStabilizer.scheduled_run
+        self.first_measurement = False # whether the next set_value is the first of a stabilizer run
+        self.value_first = 1.0 # value_normalized before the feedback was applied in the last stabilizer run
+        self.value_last_run = 1.0 # value_normalized at the end of the previous stabilizer run
+        self.drift_rate = 0.0 # moving average of |d(value_normalized)/dt| between runs, in 1/s
+
+        # the learned shape of the detector value vs. amplitude curve: a moving average of d(log value)/d(amplitude)
+        # in each amplitude bin from 0 to max_ampl, and how many measurements went into each bin
+        self.power_curve_dataset = self.name + "_power_curve"
+        self.power_curve = np.zeros(POWER_CURVE_BINS)
+        self.power_curve_counts = np.zeros(POWER_CURVE_BINS)
+        self.power_curve_bin_width = self.max_ampl / POWER_CURVE_BINS
+        self.power_curve_smoothing = 0.2 # the weight of the latest slope in the moving average of each bin
+        self.last_amplitude = -1.0 # the amplitude of the previous measurement in this run, or -1.0 if there wasn't one
+        self.last_measured = 0.0
+        self.power_curve_changed = False # whether the power curve has been updated since it was last persisted
+        self.load_power_curve()
+
+        # for the iterations-to-tolerance metric
+        self.n_feedback = 0 # the number of times feedback_to_value has been called in the current run
+        self.iterations_to_tol = -1 # the number of corrections before we were in tolerance, or -1 if we weren't
 
     @rpc(flags={"async"})
     def print(self, x):
         print(x)
 
+    def load_power_curve(self):
+        """load the persisted power curve, if there is one. it is ignored if the number of bins changed."""
+        try:
+            curve = np.asarray(self.stabilizer.exp.get_dataset(self.power_curve_dataset, archive=False), dtype=float)
+            if curve.shape == (2, POWER_CURVE_BINS):
+                self.power_curve = curve[0].copy()
+                self.power_curve_counts = curve[1].copy()
+        except (KeyError, ValueError, TypeError):
+            pass
+
+    @rpc(flags={"async"})
+    def save_power_curve(self, power_curve, counts):
+        """persist the power curve. the curve itself is learned on the kernel, so this only sets the dataset"""
+        self.stabilizer.exp.set_dataset(self.power_curve_dataset, np.array([power_curve, counts]),
+                                        broadcast=True, persist=True)
+
+    @kernel
+    def start_run(self):
+        """reset the per-run bookkeeping. called at the start of each stabilizer run"""
+        self.first_measurement = True
+        self.n_feedback = 0
+        self.iterations_to_tol = -1
+        self.last_amplitude = -1.0
+
+    @portable
+    def update_power_curve(self, amplitude, measured):
+        """
+        update the power curve with the slope between this measurement and the previous one in this run.
+        only measurements within the same run are compared, so that the laser power is the same for both.
+        """
+        if self.last_amplitude >= 0.0 and measured > 0.0 and self.last_measured > 0.0 and \
+                abs(amplitude - self.last_amplitude) > 0.001 * self.power_curve_bin_width:
+            slope = (np.log(measured) - np.log(self.last_measured)) / (amplitude - self.last_amplitude)
+            k = int(0.5 * (amplitude + self.last_amplitude) / self.power_curve_bin_width)
+            # only the rising side of the AOM response is useful for feedback
+            if slope > 0.0 and k >= 0 and k < len(self.power_curve):
+                if self.power_curve_counts[k] == 0.0:
+                    self.power_curve[k] = slope
+                else:
+                    self.power_curve[k] += self.power_curve_smoothing * (slope - self.power_curve[k])
+                self.power_curve_counts[k] += 1.0
+                self.power_curve_changed = True
+        self.last_amplitude = amplitude
+        self.last_measured = measured
+
+    @portable
+    def predict_amplitude(self, amplitude, measured, target) -> TFloat:
+        """
+        predict the amplitude which will give the target detector value, given that we measured 'measured'
+        at 'amplitude', by integrating the slope of the power curve from 'amplitude' until the log of the value
+        has changed by log(target/measured).
+
+        we stop at the first bin without data rather than extrapolating, so the prediction may fall short, which
+        the proportional feedback then makes up.
+        :return: the predicted amplitude, or -1.0 if the power curve has no data at 'amplitude'
+        """
+        if measured <= 0.0 or target <= 0.0:
+            return -1.0
+
+        remaining = np.log(target / measured)
+        x = amplitude
+        predicted = -1.0
+        for i in range(len(self.power_curve)):
+            k = int(x / self.power_curve_bin_width)
+            if k < 0 or k >= len(self.power_curve) or self.power_curve_counts[k] == 0.0:
+                break
+            if remaining > 0.0:
+                edge = (k + 1) * self.power_curve_bin_width
+            else:
+                edge = k * self.power_curve_bin_width
+            change = self.power_curve[k] * (edge - x)
+            if abs(change) >= abs(remaining):
+                predicted = x + remaining / self.power_curve[k]
+                break
+            remaining -= change
+            if remaining > 0.0:
+                x = edge
+            else:
+                x = edge - 0.000001 * self.power_curve_bin_width # just inside the bin below
+            predicted = x
+        return predicted
+
     @kernel
     def set_value(self, value, setpoint_index=0):
         self.value = value
         self.value_normalized = value / self.set_points[setpoint_index]
+        if self.first_measurement:
+            self.value_first = self.value_normalized
+            self.first_measurement = False
 
-    @rpc(flags={'async'})
+    @portable
     def update_error_history(self, error):
         """
-        update the error history array.
+        overwrite the oldest error in the error history with error and update the running sum, cumulative_error.
 
-        this is run off the kernel because the array is not updated correctly on the kernel
-        :param error:
-        :return:
+        this is O(1), except that the sum is recomputed each time the buffer wraps around so rounding errors in
+        the running sum don't accumulate.
+        :param error: the latest error
         """
-        self.error_buffer = self.error_history_arr[-(self.error_history_length - 1):]
-        self.error_history_arr[:-1] = self.error_buffer
-        self.error_history_arr[-1] = error
-        self.cumulative_error = sum(self.error_history_arr)
+        self.cumulative_error += error - self.error_history_arr[self.error_index]
+        self.error_history_arr[self.error_index] = error
+        self.error_index += 1
+        if self.error_index == self.error_history_length:
+            self.error_index = 0
+            self.cumulative_error = 0.0
+            for k in range(self.error_history_length):
+                self.cumulative_error += self.error_history_arr[k]
 
     @kernel
     def feedback(self, buffer, setpoint_index=0) -> TBool:
@@ -153,16 +299,49 @@ class FeedbackChannel:
         """
 
         measured = buffer[self.buffer_index]
-        err = self.set_points[setpoint_index] - measured
 
         if self.name == 'dds_D1_pumping_DP':
             self.stabilizer.exp.print_async(measured, self.buffer_index, self.stabilizer.measurement_array)
 
-        # runs off the kernel, else the error array isn't correctly updated
+        return self.feedback_to_value(measured, setpoint_index)
+
+    @kernel
+    def measure_isolated(self) -> TFloat:
+        """
+        measure only the Sampler channel of this FeedbackChannel, averaging self.averages times, and store the
+        background-subtracted result in self.measurement. this only reads one Sampler, so it is faster than
+        stabilizer.measure(), which reads all of them.
+        """
+        total = 0.0
+        for j in range(self.averages):
+            self.sampler.sample(self.stabilizer.sample_buffer)
+            total += self.stabilizer.sample_buffer[self.sampler_ch]
+            delay(0.1*ms)
+        self.measurement = total / float(self.averages) - self.stabilizer.background_array[self.buffer_index]
+        return self.measurement
+
+    @kernel
+    def feedback_to_value(self, measured, setpoint_index=0) -> TBool:
+        """ feedback to this channel given the measured detector value
+
+        returns True if the power is within tolerance, else False
+        """
+        err = self.set_points[setpoint_index] - measured
+
         self.update_error_history(err)
+        self.update_power_curve(self.amplitudes[setpoint_index], measured)
+        self.n_feedback += 1
 
         ampl = self.amplitudes[setpoint_index] + self.feedback_sign*self.p * err + self.i * self.cumulative_error
 
+        # jump straight to the amplitude predicted by the power curve on the first correction of each run,
+        # then let the proportional feedback refine it
+        if self.n_feedback == 1 and self.stabilizer.use_power_curve:
+            predicted = self.predict_amplitude(self.amplitudes[setpoint_index], measured,
+                                               self.set_points[setpoint_index])
+            if predicted > 0.0:
+                ampl = predicted
+
         self.set_value(measured, setpoint_index)
 
         if abs(1 - measured/self.set_points[setpoint_index]) >= self.tol:
@@ -185,8 +364,60 @@ class FeedbackChannel:
             self.dds_obj.set(frequency=self.frequency,amplitude=self.amplitudes[setpoint_index])
             return False
         else:
+            if self.iterations_to_tol < 0:
+                self.iterations_to_tol = self.n_feedback - 1
             return True
 
+    @kernel
+    def is_fresh(self, setpoint_index) -> TBool:
+        """whether the amplitude for this set point was calibrated within the setpoint_lifetime of the stabilizer"""
+        t_calibrated = self.t_calibrated_mu[setpoint_index]
+        return (self.stabilizer.setpoint_lifetime_mu > 0 and t_calibrated > 0 and
+                now_mu() - t_calibrated < self.stabilizer.setpoint_lifetime_mu)
+
+    @kernel
+    def run_other_setpoints(self, monitor_only=False, record_all_measurements=False):
+        """
+        feedback to each set point other than the default one, in the same pass as the default one.
+
+        this assumes the dds is on and that we just fed back to the default set point, which is timestamped here
+        too if the channel has other set points. the first guess for each set point is predicted with the power curve
+        from the last measurement, so usually only one or two measurements with measure_isolated are needed per set
+        point. the dds is left at the last set point, and value and value_normalized are left as they were for the
+        default set point.
+
+        :param monitor_only: if True, do nothing, since the monitor datasets only track the default set point
+        :param record_all_measurements: see run
+        """
+        if monitor_only or self.stabilizer.dry_run or len(self.set_points) < 2:
+            return
+
+        self.t_calibrated_mu[0] = now_mu()
+        value = self.value
+        value_normalized = self.value_normalized
+
+        for setpoint_index in range(1, len(self.set_points)):
+            if self.stabilizer.use_power_curve and self.last_amplitude >= 0.0:
+                predicted = self.predict_amplitude(self.last_amplitude, self.last_measured,
+                                                   self.set_points[setpoint_index])
+                if predicted > 0.0 and predicted < self.max_ampl:
+                    self.amplitudes[setpoint_index] = predicted
+            self.set_dds_to_defaults(setpoint_index)
+            delay(0.1 * ms)
+
+            for i in range(self.stabilizer.iterations):
+                self.measure_isolated()
+                in_tol = self.feedback_to_value(self.measurement, setpoint_index)
+                if record_all_measurements:
+                    self.monitor_history.append(self.value_normalized)
+                delay(0.1 * ms)
+                if in_tol:
+                    break
+            self.t_calibrated_mu[setpoint_index] = now_mu()
+
+        self.value = value
+        self.value_normalized = value_normalized
+
     @kernel
     def set_dds_to_defaults(self, setpoint_index=0):
         """
@@ -219,6 +450,13 @@ class FeedbackChannel:
         if not self.stabilizer.exp.enable_laser_feedback:
             monitor_only = True
 
+        # the stabilizer calibrated this set point recently enough, so just use that
+        if self.is_fresh(setpoint_index):
+            self.dds_obj.sw.on()
+            self.set_dds_to_defaults(setpoint_index)
+            return
+
+        self.start_run()
         self.dds_obj.sw.on()
         self.set_dds_to_defaults(setpoint_index)
         delay(0.1 * ms)
@@ -235,7 +473,7 @@ class FeedbackChannel:
                                    self.buffer_index], setpoint_index)
 
             if record_all_measurements:
-                self.stabilizer.exp.append_to_dataset(self.dataset, self.value_normalized)
+                self.monitor_history.append(self.value_normalized)
 
             delay(0.1 * ms)
 
@@ -246,18 +484,23 @@ class FeedbackChannel:
 
         # update the datasets with the last values if we have not already done so
         if not record_all_measurements:
-            self.stabilizer.exp.append_to_dataset(self.dataset, self.value_normalized)
+            self.monitor_history.append(self.value_normalized)
 
         delay(0.1 * ms)
 
         if self.stabilizer.update_dds_settings and setpoint_index == 0:
             self.stabilizer.update_dB_dataset()
 
+        if self.n_feedback > 0:
+            self.t_calibrated_mu[setpoint_index] = now_mu()
+
 class AOMPowerStabilizer:
 
     def __init__(self, experiment, dds_names, iterations=10, averages=1, leave_AOMs_on=False,
                  update_dds_settings=True, dry_run=False, open_loop_monitor_names=[],
-                 leave_MOT_AOMs_on=True):
+                 leave_MOT_AOMs_on=True, adaptive=False, max_interval=10.0,
+                 drift_safety_factor=0.5, drift_smoothing=0.3, use_power_curve=True, setpoint_lifetime=0.0,
+                 power_curve_save_period=20, config_dir=None):
         """
         An experiment subsequence for reading a Sampler and adjusting Urukul output power.
 
@@ -267,10 +510,24 @@ class AOMPowerStabilizer:
         this instance of experiment.
         'dds_names': a list of the names of the dds channels to feedback to
         'iterations': integer number of feedback cycles to converge to the setpoints
-        'averages':
+        'averages': the default number of Sampler measurements to average per feedback iteration, for channels
+            which don't specify "averages" in feedback_channels.json
         'leave_AOMs_on':
         'udpate_dds_settings':
         'dry_run':
+        'adaptive': if True, scheduled_run only runs the feedback when a channel is predicted to leave tolerance
+        'max_interval': the longest time in seconds that scheduled_run will go without running the feedback
+        'drift_safety_factor': the fraction of the predicted time until a channel leaves tolerance to wait before
+            running the feedback again
+        'drift_smoothing': the weight of the latest drift rate in the moving average of each channel's drift rate
+        'use_power_curve': if True, the first correction of each run uses the learned power curve of the channel.
+            the power curves are learned either way.
+        'power_curve_save_period': the power curves which have changed are persisted every this many runs, since
+            each one is a set_dataset RPC. at most this many runs of learning are lost when the experiment ends.
+        'setpoint_lifetime': how long in seconds the amplitudes calibrated for the set points of a channel are
+            used by FeedbackChannel.run instead of running the feedback again. 0 to always run the feedback.
+        'config_dir': the directory with feedback_channels.json. if None, the directory of which_node in
+            utilities/config is used. BaseExperiment passes its own, which is utilities/config/sim on the sim node.
         """
 
         # initialized by user
@@ -282,6 +539,14 @@ class AOMPowerStabilizer:
         self.leave_MOT_AOMs_on = leave_MOT_AOMs_on
         self.update_dds_settings = update_dds_settings
         self.dry_run = dry_run
+        self.adaptive = adaptive
+        self.max_interval = max_interval
+        self.drift_safety_factor = drift_safety_factor
+        self.drift_smoothing = drift_smoothing
+        self.use_power_curve = use_power_curve
+        self.power_curve_save_period = max(int(power_curve_save_period), 1)
+        self.runs_since_power_curve_save = 0
+        self.setpoint_lifetime_mu = self.exp.core.seconds_to_mu(setpoint_lifetime)
         self.open_loop_monitor_names = open_loop_monitor_names
         if len(open_loop_monitor_names) > 0:
             assert [x in self.dds_names for x in self.open_loop_monitor_names], \
@@ -293,13 +558,18 @@ class AOMPowerStabilizer:
         self.parallel_channels = []
         self.open_loop_monitor_channels = []
 
-        config_file = os.path.join(cwd, "repository\\qn_artiq_routines\\utilities\\config\\",self.exp.which_node,
-                                   "feedback_channels.json")
+        # the names of the experiment variables used to instantiate the feedback channels. if any of these change,
+        # the stabilizer should be re-instantiated. see BaseExperiment.prepare_incremental
+        self.dependencies = set()
+
+        if config_dir is None:
+            config_dir = os.path.join(cwd, "repository\\qn_artiq_routines\\utilities\\config\\", self.exp.which_node)
+        config_file = os.path.join(config_dir, "feedback_channels.json")
         with open(config_file) as f:
             stabilizer_dict = json.load(f)
 
         # this block instantiates FeedbackChannel objects and groups them by series/parallel feedback flag
-        for i, sampler_name in enumerate(stabilizer_dict):
+        for sampler_name in stabilizer_dict:
 
             # the dds channel names associated with this sampler
             feedback_channels = stabilizer_dict[sampler_name]
@@ -316,12 +586,17 @@ class AOMPowerStabilizer:
                     if ch_name in dds_names:
 
                         ch_params = feedback_channels[ch_name]
+                        self.dependencies.update(ch_params['set_points'])
+                        self.dependencies.update(self.exp.dds_defaults[ch_name].values())
 
+                        # the measurement arrays have 8 entries for each Sampler in sampler_list, which only has the
+                        # Samplers with a channel in dds_names, so this is indexed by the position in sampler_list
+                        # rather than in the json
                         fb_channel = FeedbackChannel(
                                             stabilizer=self,
                                             name=ch_name,
                                             dds_obj=getattr(self.exp, ch_name),
-                                            buffer_index=ch_params['sampler_ch'] + i*8,
+                                            buffer_index=ch_params['sampler_ch'] + (len(self.sampler_list) - 1)*8,
                                             set_points=[getattr(self.exp,sp) for sp in ch_params['set_points']],
                                             p=ch_params['p'],
                                             i=ch_params['i'],
@@ -331,7 +606,9 @@ class AOMPowerStabilizer:
                                             dB_dataset=ch_params['power_dataset'],
                                             t_measure_delay=ch_params['t_measure_delay'],
                                             error_history_length=self.iterations,
-                                            max_dB=ch_params['max_dB']
+                                            max_dB=ch_params['max_dB'],
+                                            averages=ch_params.get('averages', self.averages),
+                                            sampler=self.sampler_list[-1]
                         )
 
                         # make the feedback channel an attribute of the AOMPowerStabilizer instance itself
@@ -358,14 +635,49 @@ class AOMPowerStabilizer:
 
         self.all_channels = self.parallel_channels + self.series_channels
 
+        # preallocated so that measure doesn't allocate any arrays on the kernel. each sample reads all 8 channels
+        # of a Sampler, so a Sampler is sampled as many times as the channel on it with the most averages, and
+        # each channel only accumulates the first ch.averages of those samples.
+        self.sample_buffer = np.zeros(8)
+        self.channel_averages = [1] * (8 * self.num_samplers)
+        for ch in self.all_channels:
+            self.channel_averages[ch.buffer_index] = max(int(ch.averages), 1)
+        self.sampler_averages = [max(self.channel_averages[i*8:(i+1)*8]) for i in range(self.num_samplers)]
+        self.max_averages = max(self.sampler_averages) if self.num_samplers > 0 else 0
+
         # for logging the measured voltages
 
         for ch in self.all_channels:
             try:
-                self.exp.set_dataset(ch.dataset, [self.exp.get_dataset(ch.dataset)[-1]], broadcast=True)
+                ch.monitor_history.reset([self.exp.get_dataset(ch.dataset)[-1]])
             except Exception as e:
                 logging.warning(e)
-                self.exp.set_dataset(ch.dataset, [1.0], broadcast=True)
+                ch.monitor_history.reset([1.0])
+            ch.dB_history.load()
+
+        # the timeline duration of each run(), e.g. for seeing how much time the feedback takes from each shot
+        self.run_duration_history = BoundedHistory(self.exp, "laser_stabilizer_run_duration")
+        self.run_duration_history.reset()
+
+        # the state of scheduled_run, in machine units of the RTIO counter
+        self.t_last_run_mu = np.int64(0)
+        self.t_next_run_mu = np.int64(0)
+        self.n_calls_since_run = 0
+        self.first_scheduled_run = True
+
+        # for comparing the shot rate and the power stability with and without adaptive feedback:
+        # the time until the next scheduled run, the largest deviation of any channel from its set point at the
+        # start of each run (i.e. how far the powers drifted while the feedback was skipped), and the calls to
+        # scheduled_run per second, i.e. the shot rate
+        self.interval_history = BoundedHistory(self.exp, "laser_feedback_interval")
+        self.deviation_history = BoundedHistory(self.exp, "laser_feedback_max_deviation")
+        self.shot_rate_history = BoundedHistory(self.exp, "laser_feedback_shot_rate")
+        for history in [self.interval_history, self.deviation_history, self.shot_rate_history]:
+            history.reset()
+
+        # the mean number of corrections each channel needed to get into tolerance in each run
+        self.iterations_to_tol_history = BoundedHistory(self.exp, "laser_feedback_iterations_to_tolerance")
+        self.iterations_to_tol_history.reset()
 
     @rpc(flags={"async"})
     def print(self, x):
@@ -376,88 +688,48 @@ class AOMPowerStabilizer:
         for ch in self.all_channels:
             dB = 10*(np.log10(ch.amplitude**2/(2*50)) + 3)
             self.exp.set_dataset(ch.dB_dataset, dB, broadcast=True, persist=True)
-            self.exp.append_to_dataset(ch.dB_history_dataset, dB)
+            ch.dB_history.append(dB)
 
     @kernel
-    def measure(self):
+    def sample_averaged(self, result, t_slack):
         """
-        measure all Sampler cards used for feedback
-        # todo: could add option to average for better snr
+        measure all Sampler cards used for feedback, averaging each channel as many times as its FeedbackChannel
+        specifies, and store the averages in result.
+
+        the Samplers are read back-to-back for each round of averaging, followed by a single delay for slack.
+        :param result: an array of length 8*num_samplers to store the averages in
+        :param t_slack: the delay after each round of averaging
         """
+        for k in range(8 * self.num_samplers):
+            result[k] = 0.0
+
+        for j in range(self.max_averages):
+            i = 0
+            for sampler in self.sampler_list:
+                if j < self.sampler_averages[i]:
+                    sampler.sample(self.sample_buffer)
+                    for k in range(8):
+                        if j < self.channel_averages[i*8 + k]:
+                            result[i*8 + k] += self.sample_buffer[k]
+                i += 1
+            delay(t_slack)
+
+        for k in range(8 * self.num_samplers):
+            result[k] /= float(self.channel_averages[k])
 
-        # doesn't properly read sampler1
-        dummy = np.full(8 * self.num_samplers, 0.0)
-        i = 0
-        for sampler in self.sampler_list:
-            measurement_array = np.full(8, 0.0)
-            for j in range(self.averages):
-                sampler.sample(measurement_array)
-                delay(0.1*ms)
-                dummy[i * 8:(i + 1) * 8] += measurement_array
-                delay(0.1 * ms)
-            i += 1
-        dummy /= self.averages
-        self.measurement_array = dummy
-
-        # doesn't properly read sampler1
-        # dummy = np.full(8 * self.num_samplers, 0.0)
-        # i = 0
-        # measurement_array0 = np.full(8, 0.0)
-        # for j in range(self.averages):
-        #     self.sampler_list[i].sample(measurement_array0)
-        #     delay(0.1 * ms)
-        #     dummy[i * 8:(i + 1) * 8] += measurement_array0
-        #     delay(0.1 * ms)
-        # if self.num_samplers > 1:
-        #     i += 1
-        #     measurement_array1 = np.full(8, 0.0)
-        #     for j in range(self.averages):
-        #         self.sampler_list[i].sample(measurement_array1)
-        #         delay(0.1 * ms)
-        #         dummy[i * 8:(i + 1) * 8] += measurement_array1
-        #         delay(0.1 * ms)
-
-        # doesn't properly read sampler1
-        # dummy = np.full(8 * self.num_samplers, 0.0)
-        # i = 0
-        # measurement_array0 = np.full(8, 0.0)
-        # for j in range(self.averages):
-        #     self.exp.sampler0.sample(measurement_array0)
-        #     delay(0.1 * ms)
-        #     dummy[i * 8:(i + 1) * 8] += measurement_array0
-        #     delay(0.1 * ms)
-        # i = 1
-        # measurement_array1 = np.full(8, 0.0)
-        # for j in range(self.averages):
-        #     self.exp.sampler1.sample(measurement_array1)
-        #     delay(0.1 * ms)
-        #     dummy[i * 8:(i + 1) * 8] += measurement_array1
-        #     delay(0.1 * ms)
-        #
-        # dummy /= self.averages
-        # self.measurement_array = dummy
+    @kernel
+    def measure(self):
+        """
+        measure all Sampler cards used for feedback and store the result in self.measurement_array
+        """
+        self.sample_averaged(self.measurement_array, 0.1*ms)
 
     @kernel
     def measure_background(self):
         """
-        measure all Sampler cards used for feedback
-        # todo: could add option to average for better snr
-        """
-
-        dummy_background = np.full(8 * self.num_samplers, 0.0)
-        background_array = np.full(8, 0.0)
-        i = 0
-        for sampler in self.sampler_list:
-            for j in range(self.averages):
-                sampler.sample(background_array)
-                delay(1 * ms)
-                # self.measurement_array[i * 8:(i + 1) * 8] += measurement_array/self.averages # outlives target error
-                dummy_background[i * 8:(i + 1) * 8] += background_array  # outlives target error
-                delay(1 * ms)
-            i += 1
-        # self.measurement_array /= self.averages
-        dummy_background /= self.averages
-        self.background_array = dummy_background
+        measure all Sampler cards used for feedback and store the result in self.background_array
+        """
+        self.sample_averaged(self.background_array, 1*ms)
 
         print_async("self.background_array:")
         print_async(self.background_array)
@@ -475,7 +747,7 @@ class AOMPowerStabilizer:
             self.measure()
             delay(1*ms)
             ch.set_value((self.measurement_array - self.background_array)[ch.buffer_index])
-            self.exp.append_to_dataset(ch.dataset, ch.value_normalized)
+            ch.monitor_history.append(ch.value_normalized)
 
     @kernel
     def monitor(self):
@@ -506,10 +778,14 @@ class AOMPowerStabilizer:
             amplitudes have been changed in an experiment. This happens at the end of SamplerMOTCoilAndBeamBalance.
         """
         self.exp.core.reset()
+        t_start = now_mu()
 
         if not self.exp.enable_laser_feedback:
             monitor_only = True
 
+        for ch in self.all_channels:
+            ch.start_run()
+
         in_tol = False
 
         delay(1*ms)
@@ -552,10 +828,13 @@ class AOMPowerStabilizer:
                         ch.set_value((self.measurement_array - self.background_array)[ch.buffer_index])
 
                     if record_all_measurements:
-                        self.exp.append_to_dataset(ch.dataset, ch.value_normalized)
+                        ch.monitor_history.append(ch.value_normalized)
 
                 delay(0.1 * ms)
 
+            for ch in self.parallel_channels:
+                ch.run_other_setpoints(monitor_only, record_all_measurements)
+
             for ch in self.parallel_channels:
                 ch.dds_obj.sw.off()
             # delay(10 * ms)  # the Femto fW detector is slow
@@ -568,37 +847,57 @@ class AOMPowerStabilizer:
             # delay(1*ms)
 
             # do feedback on the series channels
-            with sequential:
-                for ch in self.series_channels:
-                    ch.dds_obj.sw.on()
+            for ch in self.series_channels:
+                ch.dds_obj.sw.on()
 
-                    delay(ch.t_measure_delay) # allows for detector rise time
-                    for i in range(self.iterations):
-                        self.measure()
-                        delay(0.1 * ms)
+                delay(ch.t_measure_delay) # allows for detector rise time
+                for i in range(self.iterations):
+                    self.measure()
+                    delay(0.1 * ms)
 
-                        if not (self.dry_run or monitor_only):
-                            in_tol = ch.feedback(self.measurement_array - self.background_array)
-                        else:
-                            ch.set_value((self.measurement_array - self.background_array)[ch.buffer_index])
-                        if record_all_measurements:
-                            self.exp.append_to_dataset(ch.dataset, ch.value_normalized)
-                        if in_tol:
-                            break
-
-                    ## trigger for Andor Luca camera for independent verification of the measured signals
-                    if self.exp.Luca_trigger_for_feedback_verification:
-                        self.exp.ttl6.pulse(5 * ms)
-                        delay(60*ms)
-                    delay(1*ms)
-                    ch.dds_obj.sw.off()
+                    if not (self.dry_run or monitor_only):
+                        in_tol = ch.feedback(self.measurement_array - self.background_array)
+                    else:
+                        ch.set_value((self.measurement_array - self.background_array)[ch.buffer_index])
+                    if record_all_measurements:
+                        ch.monitor_history.append(ch.value_normalized)
+                    if in_tol:
+                        break
+
+                ch.run_other_setpoints(monitor_only, record_all_measurements)
+
+                ## trigger for Andor Luca camera for independent verification of the measured signals
+                if self.exp.Luca_trigger_for_feedback_verification:
+                    self.exp.ttl6.pulse(5 * ms)
+                    delay(60*ms)
+                delay(1*ms)
+                ch.dds_obj.sw.off()
 
             # update the datasets with the last values if we have not already done so
             if not record_all_measurements:
                 for ch in self.all_channels:
-                    self.exp.append_to_dataset(ch.dataset, ch.value_normalized)
+                    ch.monitor_history.append(ch.value_normalized)
 
         delay(1*ms)
+        self.set_end_state()
+
+        delay(0.1* ms)
+        if self.update_dds_settings:
+            self.update_dB_dataset()
+
+        self.run_duration_history.append(self.exp.core.mu_to_seconds(now_mu() - t_start))
+        self.update_power_curves()
+
+    @kernel
+    def set_end_state(self):
+        """
+        leave the AOMs the way run does when it finishes, i.e. the feedback channels off unless leave_AOMs_on or
+        leave_MOT_AOMs_on, the cooling DP and the repump RF on, and the pumping repump and FORT modulation off.
+        """
+        for ch in self.all_channels:
+            ch.dds_obj.sw.off()
+        self.exp.dds_pumping_repump.sw.off()
+        self.exp.FORT_mod_switch.off()
         self.exp.dds_cooling_DP.sw.on() # todo: only turn this on if the one of the FeedbackChannels depends on it
         self.exp.ttl_repump_switch.off()  # enable RF to the RP AOM
 
@@ -617,7 +916,114 @@ class AOMPowerStabilizer:
             self.exp.dds_AOM_A6.sw.on()
             delay(0.1*ms)
 
-        delay(0.1* ms)
-        if self.update_dds_settings:
-            self.update_dB_dataset()
+    @kernel
+    def update_power_curves(self):
+        """
+        log the mean iterations to tolerance of the channels we fed back to, and persist the power curves if it is
+        time to. channels which didn't reach tolerance count as having taken all of the iterations.
+        """
+        n_channels = 0
+        total_iterations = 0
+        for ch in self.all_channels:
+            if ch.n_feedback > 0:
+                n_channels += 1
+                if ch.iterations_to_tol >= 0:
+                    total_iterations += ch.iterations_to_tol
+                else:
+                    total_iterations += ch.n_feedback
+        if n_channels > 0:
+            self.iterations_to_tol_history.append(total_iterations / n_channels)
+        self.save_power_curves()
+
+    @kernel
+    def save_power_curves(self, force=False):
+        """
+        persist the power curves which have changed, every power_curve_save_period runs, or now if force is True.
+
+        only the end of AOMPowerStabilizer.run counts towards the period. a curve updated by running a single channel,
+        e.g. the science setpoint of the FORT, is marked as changed and saved along with the others. the experiment
+        functions call this with force=True when they finish, so no updates are dropped at the end of an experiment.
+        """
+        self.runs_since_power_curve_save += 1
+        if not force and self.runs_since_power_curve_save < self.power_curve_save_period:
+            return
+        self.runs_since_power_curve_save = 0
+        for ch in self.all_channels:
+            if ch.power_curve_changed:
+                ch.save_power_curve(ch.power_curve, ch.power_curve_counts)
+                ch.power_curve_changed = False
+
+    @kernel
+    def scheduled_run(self, monitor_only=False):
+        """
+        run the feedback if it is due, else do nothing. call this before each measurement instead of run.
+
+        if self.adaptive is False, this always runs the feedback. otherwise, the time until each channel leaves
+        tolerance is predicted from its margin to the tolerance at the end of the last run and a moving average of
+        how fast it drifted between runs, and the feedback is run again after drift_safety_factor times the
+        shortest of these, but at least every max_interval seconds. if a channel had drifted out of tolerance by
+        the start of a run, its drift rate goes up, so the feedback is run more often.
 
+        when the feedback is skipped, the timeline is still moved past the RTIO counter and the AOMs are left as
+        run would leave them, since the callers expect run's core.reset and end state, e.g. load_MOT_and_FORT
+        writes to the DDSs right after end_measurement.
+
+        :param monitor_only: see run
+        """
+        self.n_calls_since_run += 1
+        t_now = self.exp.core.get_rtio_counter_mu()
+        if self.adaptive and t_now < self.t_next_run_mu:
+            self.exp.core.break_realtime()
+            delay(1*ms)
+            self.set_end_state()
+            delay(1*ms)
+            return
+
+        self.run(monitor_only=monitor_only)
+        self.update_schedule(t_now)
+
+    @kernel
+    def update_schedule(self, t_run_mu: TInt64):
+        """
+        update the drift rate of each channel and schedule the next run
+
+        :param t_run_mu: the RTIO counter when the run that just finished was started
+        """
+        dt = self.exp.core.mu_to_seconds(t_run_mu - self.t_last_run_mu)
+        first_run = self.first_scheduled_run
+
+        max_deviation = 0.0
+        t_out_of_tol = self.max_interval
+        for ch in self.all_channels:
+            max_deviation = max(max_deviation, abs(ch.value_first - 1.0))
+            if not first_run and dt > 0.0:
+                rate = abs(ch.value_first - ch.value_last_run) / dt
+                ch.drift_rate = self.drift_smoothing * rate + (1.0 - self.drift_smoothing) * ch.drift_rate
+            ch.value_last_run = ch.value_normalized
+
+            margin = ch.tol - abs(ch.value_normalized - 1.0)
+            if margin <= 0.0:
+                t_out_of_tol = 0.0
+            elif ch.drift_rate > 0.0:
+                t_out_of_tol = min(t_out_of_tol, margin / ch.drift_rate)
+
+        interval = min(self.drift_safety_factor * t_out_of_tol, self.max_interval)
+        if first_run:
+            interval = 0.0
+
+        shot_rate = 0.0
+        if not first_run and dt > 0.0:
+            shot_rate = float(self.n_calls_since_run) / dt
+        self.log_schedule(interval, max_deviation, shot_rate)
+
+        self.first_scheduled_run = False
+        self.t_last_run_mu = t_run_mu
+        self.t_next_run_mu = t_run_mu + self.exp.core.seconds_to_mu(interval)
+        self.n_calls_since_run = 0
+
+    @rpc(flags={"async"})
+    def log_schedule(self, interval: TFloat, max_deviation: TFloat, shot_rate: TFloat):
+        self.interval_history.append(interval)
+        self.deviation_history.append(max_deviation)
+        if shot_rate > 0:
+            self.shot_rate_history.append(shot_rate)
@@ -1,6 +1,14 @@
 from artiq.experiment import *
-from skimage.filters import threshold_otsu
 import numpy as np
+from collections import namedtuple
+
+import os, sys
+cwd = os.getcwd() + "\\"
+sys.path.append(cwd)
+sys.path.append(cwd+"\\repository\\qn_artiq_routines")
+
+from utilities.atom_statistics import (loading, retention, loading_events, otsu_threshold, fraction_uncertainty,
+                                       threshold_uncertainty)
 
 """
 Functions which can be used for optimization of various experiment variables
@@ -15,11 +23,21 @@ Adding new cost function:
 which is a reference to an experiment. This allows the cost function
 to reference the self.counts we care about without needing to pass in self.counts
 explicitly thus allowing us to keep the interface general.
-3. The cost returned by the function must be a float.
+3. The function should return a CostResult of the cost and its uncertainty, i.e. the standard deviation of
+the cost, which M-LOOP uses to decide how much to trust each point. For costs which are fractions of atoms, use
+fraction_uncertainty. A function which returns only a float still works, but the optimizer will give every cost
+UNKNOWN_COST_UNCERTAINTY.
+4. Count the atoms with the functions in utilities/atom_statistics.py, which work on whole arrays of shots.
 
 See GeneralVariableOptimizer.py to use these functions.
 """
 
+CostResult = namedtuple('CostResult', ['cost', 'uncertainty'])
+
+# the uncertainty the optimizer is given for a cost function which doesn't return one. it is as large as the range
+# of the fractional costs, so M-LOOP doesn't put much weight on any one of these points
+UNKNOWN_COST_UNCERTAINTY = 100.0
+
 
 @kernel
 def template_cost(self) -> TFloat:
@@ -30,27 +48,20 @@ def template_cost(self) -> TFloat:
     return cost
 
 
-def atoms_loaded_in_continuous_MOT_cost(self) -> TFloat:
+def atoms_loaded_in_continuous_MOT_cost(self) -> CostResult:
     """
     the cost function for optimizing number of atoms in the dipole trap
     in a continuously loaded MOT
     :param self: experiment instance
     :param photocounts: sequence containing photon count values for the measurement interval
-    :return: -1 * atoms_loaded, the negated number of atoms loaded
+    :return: CostResult of -1 * atoms_loaded, the negated number of atoms loaded, with its Poisson uncertainty
     """
 
-    atoms_loaded = 0
-    q_last = (self.photocounts[0] > self.single_atom_counts_threshold)
-    for x in self.photocounts[1:]:
-        q = x > self.single_atom_counts_threshold
-        if q != q_last and q_last:
-            atoms_loaded += 1
-        q_last = q
-    atoms_loaded += q_last
-    return -1 * atoms_loaded
+    atoms_loaded = loading_events(self.photocounts, self.single_atom_counts_threshold)
+    return CostResult(-1 * atoms_loaded, np.sqrt(max(atoms_loaded, 1)))
 
 
-def atom_loading_cost(self) -> TFloat:
+def atom_loading_cost(self) -> CostResult:
     """
     the cost function for optimizing atom loading in a pulsed-MOT experiment
 
@@ -60,17 +71,16 @@ def atom_loading_cost(self) -> TFloat:
     this is not for optimizing single atom loading in a steady state MOT
 
     :param self: experiment instance
-    :return: -1*atom_retention, the negated number of atoms detected in the readout
+    :return: CostResult of -100*loading_fraction, the negated percentage of atoms detected in the readout
     """
 
     shot1 = self.counts_list
-    atoms_loaded = [x > self.single_atom_counts_threshold for x in shot1]
-    n_atoms_loaded = sum(atoms_loaded)
-    loading_fraction = n_atoms_loaded/len(shot1)
-    return -100 * loading_fraction
+    n_atoms_loaded, n_shots = loading(shot1, self.single_atom_counts_threshold)
+    loading_fraction = n_atoms_loaded/n_shots
+    return CostResult(-100 * loading_fraction, 100 * fraction_uncertainty(n_atoms_loaded, n_shots))
 
 
-def atom_loading_with_otsu_threshold_cost(self) -> TFloat:
+def atom_loading_with_otsu_threshold_cost(self) -> CostResult:
     """
     the cost function for optimizing atom loading in a pulsed-MOT experiment
 
@@ -80,13 +90,14 @@ def atom_loading_with_otsu_threshold_cost(self) -> TFloat:
     this is not for optimizing single atom loading in a steady state MOT
 
     :param self: experiment instance
-    :return: -1*atom_retention, the negated number of atoms detected in the readout
+    :return: CostResult of -100*loading_fraction, the negated percentage of atoms detected in the readout. the
+        uncertainty includes the shots which are classified differently by the fixed and Otsu thresholds
     """
 
     shot1 = self.counts_list
-    atoms_loaded = [x > self.single_atom_counts_threshold for x in shot1]
-    n_atoms_loaded = sum(atoms_loaded)
-    loading_fraction = n_atoms_loaded/len(shot1)
+    n_atoms_loaded, n_shots = loading(shot1, self.single_atom_counts_threshold)
+    loading_fraction = n_atoms_loaded/n_shots
+    uncertainty = fraction_uncertainty(n_atoms_loaded, n_shots)
 
     # If there are enough atoms loaded according to the threshold, recompute the loading rate with an Otsu threshold.
     # this will typically give a more accurate cut-off in case the histogram cleanness or cut-off changes with the
@@ -94,15 +105,16 @@ def atom_loading_with_otsu_threshold_cost(self) -> TFloat:
     # still return a cut-off even if we load no atoms, and the cut-off would just bisect the background mode. Put
     # another way, it can not tell whether the data is bimodal or not.
     if loading_fraction > 0.3:  # apparent very low rate loading might just be wrongly classified background
-        threshold = threshold_otsu(np.array(self.counts_list))
-        atoms_loaded = [x > threshold for x in shot1]
-        n_atoms_loaded = sum(atoms_loaded)
-        loading_fraction = n_atoms_loaded / len(shot1)
+        threshold = otsu_threshold(shot1, self.single_atom_counts_threshold)
+        n_atoms_loaded, n_shots = loading(shot1, threshold)
+        loading_fraction = n_atoms_loaded / n_shots
+        uncertainty = np.sqrt(fraction_uncertainty(n_atoms_loaded, n_shots)**2 +
+                              threshold_uncertainty(shot1, self.single_atom_counts_threshold, threshold)**2)
 
-    return -100 * loading_fraction
+    return CostResult(-100 * loading_fraction, 100 * uncertainty)
 
 
-def atom_retention_and_loading_cost(self) -> TFloat:
+def atom_retention_and_loading_cost(self) -> CostResult:
     """
     the cost function for optimizing the fraction of atoms loaded and the fraction
     retained in a two-shot experiment.
@@ -111,45 +123,50 @@ def atom_retention_and_loading_cost(self) -> TFloat:
     which is useful for tuning parameters that are relevant before or during the first readout
 
     :param self: experiment instance
-    :return: -100*retention_fraction*loading_fraction/0.6
+    :return: CostResult of -50*(retention_fraction + loading_fraction/0.6), scaled by the Otsu threshold
     """
 
     cost = 1
     shot1 = self.counts_list
     shot2 = self.counts2_list
-    atoms_loaded = [x > self.single_atom_counts_threshold for x in shot1]
-    n_atoms_loaded = sum(atoms_loaded)
-    atoms_retained = [x > self.single_atom_counts2_threshold and y for x, y in zip(shot2, atoms_loaded)]
-    retention_fraction = 0 if not n_atoms_loaded > 0 else sum(atoms_retained) / n_atoms_loaded
-    loading_fraction = n_atoms_loaded/len(shot1)
+    n_atoms_retained, n_atoms_loaded = retention(shot1, shot2, self.single_atom_counts_threshold,
+                                                 self.single_atom_counts2_threshold)
+    n_shots = len(shot1)
+    retention_fraction = 0 if not n_atoms_loaded > 0 else n_atoms_retained / n_atoms_loaded
+    loading_fraction = n_atoms_loaded/n_shots
+    retention_uncertainty = fraction_uncertainty(n_atoms_retained, n_atoms_loaded)
+    loading_uncertainty = fraction_uncertainty(n_atoms_loaded, n_shots)
 
     if loading_fraction > 0.3:  # apparent very low rate loading might just be wrongly classified background
-        threshold = threshold_otsu(np.array(self.counts_list))
-        atoms_loaded = [x > threshold for x in shot1]
-        n_atoms_loaded = sum(atoms_loaded)
-        loading_fraction = n_atoms_loaded / len(shot1)
-        retention_fraction = 0 if not n_atoms_loaded > 0 else sum(atoms_retained) / n_atoms_loaded
+        threshold = otsu_threshold(shot1, self.single_atom_counts_threshold)
+        n_atoms_loaded, n_shots = loading(shot1, threshold)
+        loading_fraction = n_atoms_loaded / n_shots
+        retention_fraction = 0 if not n_atoms_loaded > 0 else n_atoms_retained / n_atoms_loaded
+        retention_uncertainty = fraction_uncertainty(n_atoms_retained, n_atoms_loaded)
+        loading_uncertainty = np.sqrt(fraction_uncertainty(n_atoms_loaded, n_shots)**2 +
+                                      threshold_uncertainty(shot1, self.single_atom_counts_threshold, threshold)**2)
         cost *= threshold/500
 
+    uncertainty = 50 * cost * np.sqrt(retention_uncertainty**2 + (loading_uncertainty / 0.6)**2)
+
     # 0.6 is probably the best loading rate we can hope for.
     cost *= -50 * (retention_fraction + loading_fraction / 0.6)
-    return cost
+    return CostResult(cost, uncertainty)
 
 
-def atom_retention_cost(self) -> TFloat:
+def atom_retention_cost(self) -> CostResult:
     """
     the cost function for optimizing the fraction of atoms retained in a two-shot experiment.
 
     :param self: experiment instance
-    :return: -100*retention_fraction, the negated percentage of atoms detected in the readout
+    :return: CostResult of -100*retention_fraction, the negated percentage of atoms detected in the readout
     """
 
     shot1 = self.counts_list
     shot2 = self.counts2_list
-    atoms_loaded = [x > self.single_atom_counts_threshold for x in shot1]
-    n_atoms_loaded = sum(atoms_loaded)
-    atoms_retained = [x > self.single_atom_counts2_threshold and y for x, y in zip(shot2, atoms_loaded)]
-    retention_fraction = 0 if not n_atoms_loaded > 0 else sum(atoms_retained) / n_atoms_loaded
+    n_atoms_retained, n_atoms_loaded = retention(shot1, shot2, self.single_atom_counts_threshold,
+                                                 self.single_atom_counts2_threshold)
+    retention_fraction = 0 if not n_atoms_loaded > 0 else n_atoms_retained / n_atoms_loaded
     loading_fraction = n_atoms_loaded/len(shot1)
 
     # # recompute the retention and loading with an Otsu threshold.
@@ -158,28 +175,70 @@ def atom_retention_cost(self) -> TFloat:
     # # still return a cut-off even if we load no atoms, and the cut-off would just bisect the background mode. Put
     # # another way, it can not tell whether the data is bimodal or not.
     # if loading_fraction > 0.3:  # apparent very low rate loading might just be wrongly classified background
-    #     threshold = threshold_otsu(np.array(self.counts_list))
+    #     threshold = otsu_threshold(shot1, self.single_atom_counts_threshold)
     #     atoms_loaded = [x > threshold for x in shot1]
     #     n_atoms_loaded = sum(atoms_loaded)
     #     atoms_retained = [x > self.single_atom_counts2_threshold and y for x, y in zip(shot2, atoms_loaded)]
     #     retention_fraction = 0 if not n_atoms_loaded > 0 else sum(atoms_retained) / n_atoms_loaded
 
-    return -100 * retention_fraction
+    return CostResult(-100 * retention_fraction, 100 * fraction_uncertainty(n_atoms_retained, n_atoms_loaded))
 
 
-def atom_blowaway_cost(self) -> TFloat:
+def atom_blowaway_cost(self) -> CostResult:
     """
     the cost function for minimizing the fraction of atoms retained in a two-shot experiment.
 
     :param self: experiment instance
-    :return: 100*(retention_fraction-1)
+    :return: CostResult of 100*(retention_fraction-1)
     """
 
     shot1 = self.counts_list
     shot2 = self.counts2_list
-    atoms_loaded = [x > self.single_atom_counts_threshold for x in shot1]
-    n_atoms_loaded = sum(atoms_loaded)
-    atoms_retained = [x > self.single_atom_counts2_threshold and y for x, y in zip(shot2, atoms_loaded)]
-    retention_fraction = 0 if not n_atoms_loaded > 0 else sum(atoms_retained) / n_atoms_loaded
+    n_atoms_retained, n_atoms_loaded = retention(shot1, shot2, self.single_atom_counts_threshold,
+                                                 self.single_atom_counts2_threshold)
+    retention_fraction = 0 if not n_atoms_loaded > 0 else n_atoms_retained / n_atoms_loaded
+
+    return CostResult(100*(retention_fraction - 1), 100 * fraction_uncertainty(n_atoms_retained, n_atoms_loaded))
+
 
-    return 100*(retention_fraction - 1)
+def atom_loading_successes(self, counts_list, counts2_list):
+    """
+    the number of atoms loaded and the number of loading attempts, for early stopping. see atom_loading_cost
+
+    :param self: experiment instance
+    :return: (n_atoms_loaded, n_measurements)
+    """
+    return loading(counts_list, self.single_atom_counts_threshold)
+
+
+def atom_retention_successes(self, counts_list, counts2_list):
+    """
+    the number of atoms retained and the number loaded, for early stopping. see atom_retention_cost
+
+    :param self: experiment instance
+    :return: (n_atoms_retained, n_atoms_loaded)
+    """
+    return retention(counts_list, counts2_list, self.single_atom_counts_threshold,
+                     self.single_atom_counts2_threshold)
+
+
+def atom_blowaway_successes(self, counts_list, counts2_list):
+    """
+    the number of atoms lost and the number loaded, for early stopping. see atom_blowaway_cost
+
+    :param self: experiment instance
+    :return: (n_atoms_lost, n_atoms_loaded)
+    """
+    n_atoms_retained, n_atoms_loaded = atom_retention_successes(self, counts_list, counts2_list)
+    return n_atoms_loaded - n_atoms_retained, n_atoms_loaded
+
+
+# the cost functions which are -100 times a binomial fraction, and the functions which count the successes and
+# trials of that fraction. the Otsu threshold version is counted with the fixed threshold, which is close enough to
+# decide whether to stop. see utilities/early_stopping.py
+BINOMIAL_COSTS = {
+    'atom_loading_cost': atom_loading_successes,
+    'atom_loading_with_otsu_threshold_cost': atom_loading_successes,
+    'atom_retention_cost': atom_retention_successes,
+    'atom_blowaway_cost': atom_blowaway_successes
+}
@@ -38,81 +38,82 @@ def load_MOT_and_FORT(self):
     :return:
     """
 
-    self.dds_FORT.sw.on()
+    with self.rtio_profiler.MOT_loading:
+        self.dds_FORT.sw.on()
 
-    if not self.FORT_on_at_MOT_start:
-        self.dds_FORT.sw.off()
-    else:
-        self.dds_FORT.set(frequency=self.f_FORT, amplitude=self.stabilizer_FORT.amplitude)
+        if not self.FORT_on_at_MOT_start:
+            self.dds_FORT.sw.off()
+        else:
+            self.dds_FORT.set(frequency=self.f_FORT, amplitude=self.stabilizer_FORT.amplitude)
 
-    # set the cooling DP AOM to the MOT settings
-    self.dds_cooling_DP.set(frequency=self.f_cooling_DP_MOT, amplitude=self.ampl_cooling_DP_MOT)
+        # set the cooling DP AOM to the MOT settings
+        self.dds_cooling_DP.set(frequency=self.f_cooling_DP_MOT, amplitude=self.ampl_cooling_DP_MOT)
 
-    # self.ttl7.pulse(self.t_exp_trigger)  # in case we want to look at signals on an oscilloscope
+        # self.ttl7.pulse(self.t_exp_trigger)  # in case we want to look at signals on an oscilloscope
 
-    self.dds_cooling_DP.sw.on()
+        self.dds_cooling_DP.sw.on()
 
-    delay(1*ms)
+        delay(1*ms)
 
-    self.dds_AOM_A1.sw.on()
-    self.dds_AOM_A2.sw.on()
-    self.dds_AOM_A3.sw.on()
-    self.dds_AOM_A4.sw.on()
-    self.dds_AOM_A5.sw.on()
-    self.dds_AOM_A6.sw.on()
+        self.dds_AOM_A1.sw.on()
+        self.dds_AOM_A2.sw.on()
+        self.dds_AOM_A3.sw.on()
+        self.dds_AOM_A4.sw.on()
+        self.dds_AOM_A5.sw.on()
+        self.dds_AOM_A6.sw.on()
 
-    delay(1*ms) # if this delay is not here, the following line setting the dac doesn't execute
+        delay(1*ms) # if this delay is not here, the following line setting the dac doesn't execute
 
-    # Turn on the MOT coils and cooling light
-    self.zotino0.set_dac(
-        [self.AZ_bottom_volts_MOT, self.AZ_top_volts_MOT, self.AX_volts_MOT, self.AY_volts_MOT],
-        channels=self.coil_channels)
+        # Turn on the MOT coils and cooling light
+        self.zotino0.set_dac(
+            [self.AZ_bottom_volts_MOT, self.AZ_top_volts_MOT, self.AX_volts_MOT, self.AY_volts_MOT],
+            channels=self.coil_channels)
 
-    self.ttl_UV.pulse(self.t_UV_pulse)
+        self.ttl_UV.pulse(self.t_UV_pulse)
 
-    # wait for the MOT to load
-    delay(self.t_MOT_loading - self.t_MOT_phase2)
+        # wait for the MOT to load
+        delay(self.t_MOT_loading - self.t_MOT_phase2)
 
-    if self.t_MOT_phase2 > 0:
+        if self.t_MOT_phase2 > 0:
 
-        self.zotino0.set_dac(
-            [self.AZ_bottom_volts_MOT_phase2, self.AZ_top_volts_MOT_phase2, self.AX_volts_MOT_phase2,
-             self.AY_volts_MOT_phase2],
-            channels=self.coil_channels)
+            self.zotino0.set_dac(
+                [self.AZ_bottom_volts_MOT_phase2, self.AZ_top_volts_MOT_phase2, self.AX_volts_MOT_phase2,
+                 self.AY_volts_MOT_phase2],
+                channels=self.coil_channels)
 
-        self.dds_cooling_DP.set(frequency=self.f_cooling_DP_MOT_phase2,
-                                amplitude=self.ampl_cooling_DP_MOT) # todo: make a variable for phase 2
-        delay(self.t_MOT_phase2)
+            self.dds_cooling_DP.set(frequency=self.f_cooling_DP_MOT_phase2,
+                                    amplitude=self.ampl_cooling_DP_MOT) # todo: make a variable for phase 2
+            delay(self.t_MOT_phase2)
 
-    # turn on the dipole trap and wait to load atoms
-    self.dds_FORT.set(frequency=self.f_FORT, amplitude=self.stabilizer_FORT.amplitude)
+        # turn on the dipole trap and wait to load atoms
+        self.dds_FORT.set(frequency=self.f_FORT, amplitude=self.stabilizer_FORT.amplitude)
 
-    if not self.FORT_on_at_MOT_start:
-        delay_mu(self.t_FORT_loading_mu)
+        if not self.FORT_on_at_MOT_start:
+            delay_mu(self.t_FORT_loading_mu)
 
-    self.stabilizer_FORT.run(setpoint_index=1) # the science setpoint
+        self.stabilizer_FORT.run(setpoint_index=1) # the science setpoint
 
-    self.dds_cooling_DP.sw.off()
-    delay(self.t_MOT_dissipation)  # should wait several ms for the MOT to dissipate
-    self.ttl_SPCM_gate.off()
-    t_gate_end = self.ttl_SPCM0.gate_rising(self.t_SPCM_first_shot)
-    self.counts_FORT_science = self.ttl_SPCM0.count(t_gate_end)
-    delay(1*ms)
-    self.dds_cooling_DP.sw.on()
+        self.dds_cooling_DP.sw.off()
+        delay(self.t_MOT_dissipation)  # should wait several ms for the MOT to dissipate
+        self.ttl_SPCM_gate.off()
+        t_gate_end = self.ttl_SPCM0.gate_rising(self.t_SPCM_first_shot)
+        self.counts_FORT_science = self.ttl_SPCM0.count(t_gate_end)
+        delay(1*ms)
+        self.dds_cooling_DP.sw.on()
 
-    if self.do_PGC_in_MOT and self.t_PGC_in_MOT > 0:
+        if self.do_PGC_in_MOT and self.t_PGC_in_MOT > 0:
 
-        self.dds_FORT.set(frequency=self.f_FORT,
-                          amplitude=self.stabilizer_FORT.amplitudes[1])
+            self.dds_FORT.set(frequency=self.f_FORT,
+                              amplitude=self.stabilizer_FORT.amplitudes[1])
 
-        self.zotino0.set_dac([self.AZ_bottom_volts_PGC, self.AZ_top_volts_PGC, self.AX_volts_PGC, self.AY_volts_PGC],
-                             channels=self.coil_channels)
+            self.zotino0.set_dac([self.AZ_bottom_volts_PGC, self.AZ_top_volts_PGC, self.AX_volts_PGC, self.AY_volts_PGC],
+                                 channels=self.coil_channels)
 
-        self.dds_cooling_DP.set(frequency=self.f_cooling_DP_PGC,
-                                amplitude=self.ampl_cooling_DP_MOT*self.p_cooling_DP_PGC)
-        delay(self.t_PGC_in_MOT)
+            self.dds_cooling_DP.set(frequency=self.f_cooling_DP_PGC,
+                                    amplitude=self.ampl_cooling_DP_MOT*self.p_cooling_DP_PGC)
+            delay(self.t_PGC_in_MOT)
 
-    self.dds_cooling_DP.sw.off()
+        self.dds_cooling_DP.sw.off()
 
 @kernel
 def load_MOT_and_FORT_for_Luca_scattering_measurement(self):
@@ -238,105 +239,107 @@ def load_MOT_and_FORT_for_Luca_scattering_measurement(self):
     self.dds_cooling_DP.sw.off()
 
 @kernel
-def first_shot(self):
+def first_shot_sequence(self):
     """
-    non-chopped first atom readout
-
-    warning: assumes the fiber AOMs are already on, which is usually the case
-    :return:
+    the events of first_shot, which are played back from DMA. see DMA_SEQUENCES
     """
+    self.ttl_repump_switch.off()
+    self.dds_cooling_DP.sw.on()
     if self.which_node != 'alice':  # edge counters only enabled on Alice gateware so far
-        self.ttl_repump_switch.off()
-        self.dds_cooling_DP.sw.on()
-        t_gate_end = self.ttl_SPCM0.gate_rising(self.t_SPCM_first_shot)
-        self.counts = self.ttl_SPCM0.count(t_gate_end)
-        delay(0.1 * ms)
-        self.dds_cooling_DP.sw.off()
+        self.ttl_SPCM0.gate_rising(self.t_SPCM_first_shot)
     else:
-        self.ttl_repump_switch.off()
-        self.dds_cooling_DP.sw.on()
-        t_gate_end = self.ttl_SPCM0_counter.gate_rising(self.t_SPCM_first_shot)
-        self.counts = self.ttl_SPCM0_counter.fetch_count()
-        delay(0.1 * ms)
-        self.dds_cooling_DP.sw.off()
+        self.ttl_SPCM0_counter.gate_rising(self.t_SPCM_first_shot)
+    delay(0.1 * ms)
+    self.dds_cooling_DP.sw.off()
 
 @kernel
-def second_shot(self):
+def first_shot(self):
     """
-    non-chopped second atom readout
+    non-chopped first atom readout
+
+    the gating and the cooling light are played back from DMA, so the CPU only has to read the counts.
 
     warning: assumes the fiber AOMs are already on, which is usually the case
     :return:
     """
+    with self.rtio_profiler.first_shot:
+        t_gate_end = now_mu() + self.core.seconds_to_mu(self.t_SPCM_first_shot)
+        self.dma_sequences.first_shot.playback()
+        if self.which_node != 'alice':  # edge counters only enabled on Alice gateware so far
+            self.counts = self.ttl_SPCM0.count(t_gate_end)
+        else:
+            self.counts = self.ttl_SPCM0_counter.fetch_count()
+
+@kernel
+def second_shot_sequence(self):
+    """
+    the events of second_shot, which are played back from DMA. see DMA_SEQUENCES
+    """
+    self.ttl_repump_switch.off()
+    self.dds_cooling_DP.sw.on()
     if self.which_node != 'alice':  # edge counters only enabled on Alice gateware so far
-        self.ttl_repump_switch.off()
-        self.dds_cooling_DP.sw.on()
-        t_gate_end = self.ttl_SPCM0.gate_rising(self.t_SPCM_second_shot)
-        self.counts2 = self.ttl_SPCM0.count(t_gate_end)
-        delay(0.1 * ms)
-        self.dds_cooling_DP.sw.off()
+        self.ttl_SPCM0.gate_rising(self.t_SPCM_second_shot)
     else:
-        self.ttl_repump_switch.off()
-        self.dds_cooling_DP.sw.on()
-        t_gate_end = self.ttl_SPCM0_counter.gate_rising(self.t_SPCM_second_shot)
-        self.counts2 = self.ttl_SPCM0_counter.fetch_count()
-        delay(0.1 * ms)
-        self.dds_cooling_DP.sw.off()
+        self.ttl_SPCM0_counter.gate_rising(self.t_SPCM_second_shot)
+    delay(0.1 * ms)
+    self.dds_cooling_DP.sw.off()
 
 @kernel
-def record_chopped_blow_away(self):
+def second_shot(self):
     """
+    non-chopped second atom readout
 
-    :param self:
+    the gating and the cooling light are played back from DMA, so the CPU only has to read the counts.
+
+    warning: assumes the fiber AOMs are already on, which is usually the case
     :return:
     """
+    with self.rtio_profiler.second_shot:
+        t_gate_end = now_mu() + self.core.seconds_to_mu(self.t_SPCM_second_shot)
+        self.dma_sequences.second_shot.playback()
+        if self.which_node != 'alice':  # edge counters only enabled on Alice gateware so far
+            self.counts2 = self.ttl_SPCM0.count(t_gate_end)
+        else:
+            self.counts2 = self.ttl_SPCM0_counter.fetch_count()
 
-    # todo: change OP -> BA
-
+@kernel
+def chopped_blow_away_cycles(self) -> TInt32:
+    """the number of chop cycles in the blowaway"""
     n_chop_cycles = int(self.t_blowaway/self.t_BA_chop_period + 0.5)
     # self.print_async("blowaway cycles:", n_chop_cycles)
 
     assert n_chop_cycles >= 1, "t_blowaway should be > t_BA_chop_period"
+    return n_chop_cycles
 
-    BA_pulse = self.t_BA_chop_period * 0.35
-    FORT_pulse = self.t_BA_chop_period - BA_pulse
+@kernel
+def chopped_blow_away_sequence(self, n_cycles: TInt32):
+    """
+    n_cycles cycles of the chopped blowaway, which are played back from DMA. see DMA_SEQUENCES
 
+    the FORT is off for the first 35% of each cycle. the blowaway light is left on the whole time, since the cooling
+    AOM seems incredibly slow, so it is switched in chopped_blow_away.
 
-    self.core.reset()
+    :param self:
+    :param n_cycles: the number of chop cycles to emit, starting at now_mu
+    :return:
+    """
 
-    with self.core_dma.record("chopped_blow_away"):
+    BA_pulse = self.t_BA_chop_period * 0.35
 
-        start = now_mu()
-        period_mu = self.core.seconds_to_mu(self.t_BA_chop_period)
-        BA_pulse_length_mu = self.core.seconds_to_mu(BA_pulse)
-        BA_on_mu = self.core.seconds_to_mu(FORT_pulse)
-        FORT_pulse_length_mu = self.core.seconds_to_mu(FORT_pulse)
-        FORT_on_mu = self.core.seconds_to_mu(BA_pulse)
+    start = now_mu()
+    period_mu = self.core.seconds_to_mu(self.t_BA_chop_period)
+    BA_pulse_length_mu = self.core.seconds_to_mu(BA_pulse)
 
+    for i in range(n_cycles):
+        at_mu(start+i*period_mu)
         self.dds_FORT.sw.off()
         delay_mu(BA_pulse_length_mu)
-
-        if not self.blowaway_light_off:
-            self.dds_cooling_DP.sw.on()
-        else:
-            self.dds_cooling_DP.sw.off()
-
-        for i in range(n_chop_cycles):
-            at_mu(start+i*period_mu+FORT_on_mu)
-            self.dds_FORT.sw.on()
-            delay_mu(FORT_pulse_length_mu)
-            self.dds_FORT.sw.off()
-            at_mu(start+i*period_mu+BA_on_mu)
-            # self.dds_cooling_DP.sw.on() # the cooling AOM seems incredibly slow so I'm just leaving it on the whole time
-            delay_mu(BA_pulse_length_mu)
-            # self.dds_cooling_DP.sw.off()
         self.dds_FORT.sw.on()
+    at_mu(start+n_cycles*period_mu)
 
 @kernel
 def chopped_blow_away(self):
 
-    ba_dma_handle = self.core_dma.get_handle("chopped_blow_away")
-
     self.ttl_repump_switch.on()  # turns off the RP AOM
 
     # set coils for blowaway
@@ -369,7 +372,7 @@ def chopped_blow_away(self):
             self.dds_AOM_A6.sw.on()
             self.dds_cooling_DP.sw.on()
 
-    self.core_dma.playback_handle(ba_dma_handle)
+    self.dma_sequences.chopped_blow_away.playback()
 
     # reset AOM RF powers
     self.dds_cooling_DP.sw.off()
@@ -388,77 +391,85 @@ def chopped_blow_away(self):
     self.ttl_repump_switch.off()  # turns on the RP AOM
 
 @kernel
-def record_chopped_optical_pumping(self):
+def chopped_optical_pumping_cycles(self) -> TInt32:
+    """the number of chop cycles in the optical pumping"""
+    n_chop_cycles = int(self.t_pumping/self.t_OP_chop_period + 0.5)
+    assert n_chop_cycles >= 1, "t_pumping should be > t_OP_chop_period"
+    return n_chop_cycles
+
+@kernel
+def chopped_depumping_cycles(self) -> TInt32:
+    """the number of chop cycles in the depumping after the optical pumping"""
+    return int(self.t_depumping/self.t_OP_chop_period)
+
+@kernel
+def chopped_pumping_cycles(self, n_cycles: TInt32, D1_on: TBool):
     """
+    n_cycles cycles of the FORT chopped out of phase with the D1 pumping light, starting at now_mu.
 
     :param self:
+    :param n_cycles: the number of chop cycles
+    :param D1_on: whether to pulse the D1 pumping light, or only chop the FORT
     :return:
     """
 
-    n_chop_cycles = int(self.t_pumping/self.t_OP_chop_period + 0.5)
-    assert n_chop_cycles >= 1, "t_pumping should be > t_OP_chop_period"
-
     # todo: use duty cycle ExperimentVariables
     OP_pulse = self.t_OP_chop_period * self.duty_cycle_OP
-    FORT_pulse = self.t_OP_chop_period * self.duty_cycle_FORT
 
-    n_depump_chop_cycles = int(self.t_depumping /self.t_OP_chop_period)
+    # hardcoded for offsets for now, but this gives decent separation between the FORT and OP
+    # pulses
+    start = now_mu()
+    period_mu = self.core.seconds_to_mu(self.t_OP_chop_period)
 
-    self.core.reset()
+    OP_pulse_length_mu = self.core.seconds_to_mu(OP_pulse)
+    FORT_on_mu = self.core.seconds_to_mu(0.0)
+    OP_on_mu = self.core.seconds_to_mu(self.t_OP_chop_offset)
 
-    with self.core_dma.record("chopped_optical_pumping"):
-
-        # hardcoded for offsets for now, but this gives decent separation between the FORT and OP
-        # pulses
-        start = now_mu()
-        period_mu = self.core.seconds_to_mu(self.t_OP_chop_period)
-
-        OP_pulse_length_mu = self.core.seconds_to_mu(OP_pulse)
-        FORT_pulse_length_mu = self.core.seconds_to_mu(FORT_pulse)
-        FORT_on_mu = self.core.seconds_to_mu(0.0)
-        OP_on_mu = self.core.seconds_to_mu(self.t_OP_chop_offset)
-
-        if not (self.pumping_light_off or self.D1_off_in_OP_phase):
-            for i in range(n_chop_cycles):
-                at_mu(start+i*period_mu+FORT_on_mu)
-                self.dds_FORT.sw.off()
-                delay_mu(OP_pulse_length_mu)
-                self.dds_FORT.sw.on()
-                at_mu(start+i*period_mu+OP_on_mu)
-                self.dds_D1_pumping_DP.sw.on()
-                delay_mu(OP_pulse_length_mu)
-                self.dds_D1_pumping_DP.sw.off()
-        else:
-            for i in range(n_chop_cycles):
-                at_mu(start + i * period_mu + FORT_on_mu)
-                self.dds_FORT.sw.off()
-                delay_mu(OP_pulse_length_mu)
-                self.dds_FORT.sw.on()
+    for i in range(n_cycles):
+        at_mu(start+i*period_mu+FORT_on_mu)
+        self.dds_FORT.sw.off()
+        delay_mu(OP_pulse_length_mu)
+        self.dds_FORT.sw.on()
+        if D1_on:
+            at_mu(start+i*period_mu+OP_on_mu)
+            self.dds_D1_pumping_DP.sw.on()
+            delay_mu(OP_pulse_length_mu)
+            self.dds_D1_pumping_DP.sw.off()
 
-        if n_depump_chop_cycles > 0:
+@kernel
+def chopped_optical_pumping_sequence(self, n_cycles: TInt32):
+    """
+    n_cycles cycles of the chopped optical pumping, which are played back from DMA. see DMA_SEQUENCES
+    """
+    chopped_pumping_cycles(self, n_cycles, not (self.pumping_light_off or self.D1_off_in_OP_phase))
 
-            # turn off the pumping repump
-            self.dds_AOM_A5.sw.off()
-            self.dds_AOM_A6.sw.off()
-            self.dds_pumping_repump.sw.off()
-            start = now_mu() + self.core.seconds_to_mu(0.5 * us)
-
-            if not (self.pumping_light_off or self.D1_off_in_depump_phase):
-                for i in range(n_depump_chop_cycles):
-                    at_mu(start + i * period_mu + FORT_on_mu)
-                    self.dds_FORT.sw.off()
-                    delay_mu(OP_pulse_length_mu)
-                    self.dds_FORT.sw.on()
-                    at_mu(start + i * period_mu + OP_on_mu)
-                    self.dds_D1_pumping_DP.sw.on()
-                    delay_mu(OP_pulse_length_mu)
-                    self.dds_D1_pumping_DP.sw.off()
-            else:
-                for i in range(n_depump_chop_cycles):
-                    at_mu(start + i * period_mu + FORT_on_mu)
-                    self.dds_FORT.sw.off()
-                    delay_mu(OP_pulse_length_mu)
-                    self.dds_FORT.sw.on()
+@kernel
+def chopped_depumping_sequence(self, n_cycles: TInt32):
+    """
+    n_cycles cycles of the chopped depumping, which are played back from DMA. see DMA_SEQUENCES
+    """
+    chopped_pumping_cycles(self, n_cycles, not (self.pumping_light_off or self.D1_off_in_depump_phase))
+
+@kernel
+def chopped_optical_pumping_pulses(self):
+    """
+    play back the chopped optical pumping, followed by the chopped depumping if t_depumping is at least one chop
+    period.
+
+    :param self:
+    :return:
+    """
+    self.dma_sequences.chopped_optical_pumping.playback()
+
+    if chopped_depumping_cycles(self) > 0:
+
+        # turn off the pumping repump
+        self.dds_AOM_A5.sw.off()
+        self.dds_AOM_A6.sw.off()
+        self.dds_pumping_repump.sw.off()
+        delay(0.5 * us)
+
+        self.dma_sequences.chopped_depumping.playback()
 
 @kernel
 def chopped_optical_pumping(self):
@@ -468,7 +479,6 @@ def chopped_optical_pumping(self):
     :return:
     """
 
-    op_dma_handle = self.core_dma.get_handle("chopped_optical_pumping")
     if self.t_depumping + self.t_pumping > 3*ms:
         delay(2000 * us)  # we need extra slack
     self.ttl_repump_switch.on()  # turns off the MOT RP AOM
@@ -495,7 +505,7 @@ def chopped_optical_pumping(self):
 
         delay(1*us)
 
-        self.core_dma.playback_handle(op_dma_handle)
+        chopped_optical_pumping_pulses(self)
         delay(self.t_depumping)
 
         self.dds_D1_pumping_DP.sw.off()
@@ -513,7 +523,11 @@ def chopped_optical_pumping(self):
     self.dds_cooling_DP.sw.off()
 
 @kernel
-def measure_FORT_MM_fiber(self):
+def measure_FORT_MM_fiber(self) -> TFloat:
+    """
+    measure the FORT power after the MM fiber
+    :return: the averaged sampler voltage
+    """
     measurement_buf = np.array([0.0]*8)
     measurement = 0.0
     avgs = 50
@@ -522,7 +536,39 @@ def measure_FORT_MM_fiber(self):
         measurement += measurement_buf[self.FORT_MM_sampler_ch]
         delay(0.1*ms)
     measurement /= avgs
-    self.append_to_dataset("FORT_MM_science_volts", measurement)
+    return measurement
+
+@rpc(flags={"async"})
+def update_shot_datasets(self, n_shots, measurement, counts, counts2, counts_FORT_science, FORT_MM_volts, advance):
+    """
+    append a batch of per-shot results to the datasets. this runs on the host so the kernel doesn't have to wait.
+    the arguments after measurement are the shot buffers, of which the first n_shots entries are valid.
+    """
+    for i in range(n_shots):
+        if not self.no_first_shot:
+            self.append_to_dataset('photocounts_current_iteration', counts[i])
+        self.append_to_dataset('photocounts2_current_iteration', counts2[i])
+        self.append_to_dataset("photocounts_FORT_science", counts_FORT_science[i])
+        self.append_to_dataset("FORT_MM_science_volts", FORT_MM_volts[i])
+        if advance[i]:
+            if not self.no_first_shot:
+                self.append_to_dataset('photocounts', counts[i])
+            self.append_to_dataset('photocounts2', counts2[i])
+    self.set_dataset(self.measurements_progress, 100*measurement/self.n_measurements, broadcast=True)
+
+@kernel
+def flush_shot_buffer(self):
+    """
+    send the buffered per-shot results to the datasets in one async RPC. end_measurement calls this every
+    self.shot_buffer_size shots and at the end of the measurement loop, so it only needs to be called elsewhere
+    if an experiment leaves the measurement loop early.
+    """
+    if self.shot_buffer_index > 0:
+        update_shot_datasets(self, self.shot_buffer_index, self.measurement,
+                             self.shot_buffer_counts, self.shot_buffer_counts2,
+                             self.shot_buffer_counts_FORT_science, self.shot_buffer_FORT_MM_volts,
+                             self.shot_buffer_advance)
+        self.shot_buffer_index = 0
 
 
 # @rpc #(flags={'async'})
@@ -577,43 +623,55 @@ def measure_FORT_MM_fiber(self):
 def end_measurement(self):
     """
     End the measurement by setting datasets and deciding whether to increment the measuement index
+
+    The per-shot results are stored in the shot buffers and sent to the datasets by flush_shot_buffer,
+    which is called every self.shot_buffer_size shots (n_shots_per_dataset_flush) and after the last measurement.
+    The RTIO profile of the shot is flushed here too, see utilities/rtio_profiler.py.
     :param self:
     :return measurement: TInt32, the measurement index
     """
 
-    pass
-
-    # update the datasets
-    if not self.no_first_shot:
-        self.append_to_dataset('photocounts_current_iteration', self.counts)
-        self.counts_list[self.measurement] = self.counts
-
-    # update the datasets
-    self.set_dataset(self.measurements_progress, 100*self.measurement/self.n_measurements, broadcast=True)
-    self.append_to_dataset('photocounts2_current_iteration', self.counts2)
-    self.counts2_list[self.measurement] = self.counts2
-
-    self.append_to_dataset("photocounts_FORT_science", self.counts_FORT_science)
-    measure_FORT_MM_fiber(self)
-
-    advance = 1
-    if self.__class__.__name__ != 'ExperimentCycler':
-        if self.require_atom_loading_to_advance:
-            if not self.counts/self.t_SPCM_first_shot > self.single_atom_counts_per_s:
-                advance *= 0
-        if self.require_D1_lock_to_advance:
-            self.ttl_D1_lock_monitor.sample_input()
-            delay(0.1 * ms)
-            laser_locked = int(1 - self.ttl_D1_lock_monitor.sample_get())
-            advance *= laser_locked
-            if not laser_locked:
-                logging.warning("D1 laser not locked")
-
-    if advance:
-        self.measurement += 1
+    with self.rtio_profiler.end_measurement:
         if not self.no_first_shot:
-            self.append_to_dataset('photocounts', self.counts)
-        self.append_to_dataset('photocounts2', self.counts2)
+            self.counts_list[self.measurement] = self.counts
+        self.counts2_list[self.measurement] = self.counts2
+
+        i = self.shot_buffer_index
+        self.shot_buffer_counts[i] = self.counts
+        self.shot_buffer_counts2[i] = self.counts2
+        self.shot_buffer_counts_FORT_science[i] = self.counts_FORT_science
+        self.shot_buffer_FORT_MM_volts[i] = measure_FORT_MM_fiber(self)
+
+        advance = 1
+        if self.__class__.__name__ != 'ExperimentCycler':
+            if self.require_atom_loading_to_advance:
+                if not self.counts/self.t_SPCM_first_shot > self.single_atom_counts_per_s:
+                    advance *= 0
+            if self.require_D1_lock_to_advance:
+                self.ttl_D1_lock_monitor.sample_input()
+                delay(0.1 * ms)
+                laser_locked = int(1 - self.ttl_D1_lock_monitor.sample_get())
+                advance *= laser_locked
+                if not laser_locked:
+                    logging.warning("D1 laser not locked")
+
+        # if we are interleaving parameter sets, e.g. in GeneralVariableOptimizer, switch to the next one
+        self.interleaver.next_shot(self.measurement)
+
+        if advance:
+            self.measurement += 1
+
+        # end the measurement loop if the result is already clearly worse than the target, e.g. the best cost in
+        # GeneralVariableOptimizer. the cost is then computed from the measurements so far
+        if self.early_stopping.check(self.counts_list, self.counts2_list, self.measurement):
+            self.measurement = self.n_measurements
+
+        self.shot_buffer_advance[i] = advance
+        self.shot_buffer_index += 1
+        if self.shot_buffer_index >= self.shot_buffer_size or self.measurement >= self.n_measurements:
+            flush_shot_buffer(self)
+
+    self.rtio_profiler.flush()
 
 @rpc(flags={"async"})
 def set_RigolDG1022Z(frequency: TFloat, vpp: TFloat, vdc: TFloat):
@@ -658,6 +716,132 @@ def set_RigolDG1022Z(frequency: TFloat, vpp: TFloat, vdc: TFloat):
     assert actual_vdc == vdc, "Oops! The device V_DC is not set to the requested value!"
     print(f"Vdc: {actual_vdc} V")
 
+@kernel
+def readout_setup_sequence(self):
+    """
+    the coil and cooling DP AOM settings for the atom readout, which are played back from DMA. see DMA_SEQUENCES.
+    the FORT is not set here, since its amplitude comes from the laser feedback.
+    """
+    self.zotino0.set_dac(
+        [self.AZ_bottom_volts_RO, self.AZ_top_volts_RO, self.AX_volts_RO, self.AY_volts_RO],
+        channels=self.coil_channels)
+    self.dds_cooling_DP.set(frequency=self.f_cooling_DP_RO,
+                            amplitude=self.ampl_cooling_DP_MOT * self.p_cooling_DP_RO)
+
+# the time from the start of excitation_pulses_sequence to the first pulse, which accounts for various latencies
+EXCITATION_MU_OFFSET = 800
+
+@kernel
+def excitation_pulses_sequence(self):
+    """
+    the excitation pulse train and SPCM gating for single_photon_experiment, which are played back from DMA.
+    see DMA_SEQUENCES
+    """
+    now = now_mu()
+
+    at_mu(now+10)
+    self.ttl_repump_switch.off()  # repump AOM is on for excitation
+    mu_offset = EXCITATION_MU_OFFSET # accounts for various latencies
+    at_mu(now + mu_offset - 200) # make sure stuff is off, no more Raman photons from FORT
+    # self.ttl_repump_switch.off()  # repump AOM is on for excitation
+    at_mu(now + mu_offset+100+self.gate_start_offset_mu) # allow for repump rise time and FORT after-pulsing
+    self.ttl_SPCM0.gate_rising(self.n_excitation_attempts * (self.t_excitation_pulse + 100 * ns))
+    pulses_over_mu = 0
+    for attempt in range(self.n_excitation_attempts):
+        at_mu(now + mu_offset + 201 + int(attempt * (self.t_excitation_pulse / ns + 100))
+              + self.gate_start_offset_mu)
+        self.dds_excitation.sw.pulse(self.t_excitation_pulse)
+        at_mu(now + mu_offset + 741 + int(attempt * (self.t_excitation_pulse / ns + 100) -
+                                          0.1*self.t_excitation_pulse / ns) +self.gate_start_offset_mu)
+        # fast switch to gate SPCM output - why am I using a switch instead of the gate input on the SPCM?
+        self.ttl_SPCM_gate.off()
+        delay(0.2*self.t_excitation_pulse+100*ns + self.gate_switch_offset)
+        self.ttl_SPCM_gate.on()
+
+        pulses_over_mu = now_mu()
+    self.ttl_repump_switch.on()
+    at_mu(pulses_over_mu - 200) # fudge factor
+    self.ttl_SPCM_gate.on() # TTL high turns switch off, i.e. signal blocked
+    self.dds_FORT.sw.on()
+
+@kernel
+def read_excitation_clicks(self, up_to_mu: TInt64, n_cycles_started: TInt32):
+    """
+    read the SPCM click timestamps up to up_to_mu and bin them by excitation cycle and attempt in
+    self.excitation_cycle_counts and self.excitation_attempt_counts.
+
+    the clicks come in order, so each one is in the last cycle which started before it, continuing from the cycle
+    of the previous click. the attempt is the SPCM switch window the click falls in, see excitation_pulses_sequence.
+    clicks outside of the windows, if any get through, are only counted for the cycle.
+
+    :param self:
+    :param up_to_mu: waits until the RTIO counter reaches this, unless there is a click before it
+    :param n_cycles_started: the number of cycles whose start times are in self.excitation_cycle_start_mu
+    :return:
+    """
+    attempt_period = self.t_excitation_pulse / ns + 100
+    window_start_mu = EXCITATION_MU_OFFSET + 741 + self.gate_start_offset_mu - int(0.1 * self.t_excitation_pulse / ns)
+
+    t_click = self.ttl_SPCM0.timestamp_mu(up_to_mu)
+    while t_click >= 0:
+        while (self.excitation_cycle_index < n_cycles_started - 1 and
+               self.excitation_cycle_start_mu[self.excitation_cycle_index + 1] <= t_click):
+            self.excitation_cycle_index += 1
+        self.excitation_cycle_counts[self.excitation_cycle_index] += 1
+
+        dt = t_click - self.excitation_cycle_start_mu[self.excitation_cycle_index] - window_start_mu
+        if dt >= 0:
+            attempt = int(dt / attempt_period)
+            if attempt < self.n_excitation_attempts:
+                self.excitation_attempt_counts[attempt] += 1
+
+        t_click = self.ttl_SPCM0.timestamp_mu(up_to_mu)
+
+@rpc(flags={"async"})
+def update_excitation_datasets(self, cycle_counts, attempt_counts):
+    """
+    append the clicks in each excitation cycle and in each excitation attempt of one measurement to the
+    excitation_counts and excitation_attempt_counts datasets.
+    """
+    for val in cycle_counts:
+        self.append_to_dataset('excitation_counts', val)
+    for val in attempt_counts:
+        self.append_to_dataset('excitation_attempt_counts', val)
+
+@kernel
+def excitation_pulses_events(self) -> TInt32:
+    """the number of RTIO events in excitation_pulses_sequence"""
+    return 6 + 4 * self.n_excitation_attempts
+
+# the parts of a shot which only depend on the ExperimentVariables, and so can be recorded once and played back
+# from DMA every shot. see utilities/dma_registry.py for what the entries mean. the numbers of events are upper
+# bounds, e.g. for the zotino and urukul SPI transfers.
+DMA_SEQUENCES = {
+    "first_shot": dict(emit=first_shot_sequence, dependencies=['t_SPCM_first_shot'], events=5),
+    "second_shot": dict(emit=second_shot_sequence, dependencies=['t_SPCM_second_shot'], events=5),
+    "readout_setup": dict(emit=readout_setup_sequence,
+                          dependencies=['AZ_bottom_volts_RO', 'AZ_top_volts_RO', 'AX_volts_RO', 'AY_volts_RO',
+                                        'f_cooling_DP_RO', 'ampl_cooling_DP_MOT', 'p_cooling_DP_RO'],
+                          events=24),
+    "chopped_optical_pumping": dict(emit=chopped_optical_pumping_sequence,
+                                    dependencies=['t_pumping', 't_OP_chop_offset', 'duty_cycle_OP',
+                                                  'pumping_light_off', 'D1_off_in_OP_phase'],
+                                    condition='t_pumping', events=4, cycles=chopped_optical_pumping_cycles,
+                                    period='t_OP_chop_period'),
+    "chopped_depumping": dict(emit=chopped_depumping_sequence,
+                              dependencies=['t_depumping', 't_OP_chop_offset', 'duty_cycle_OP',
+                                            'pumping_light_off', 'D1_off_in_depump_phase'],
+                              condition='t_depumping', events=4, cycles=chopped_depumping_cycles,
+                              period='t_OP_chop_period'),
+    "chopped_blow_away": dict(emit=chopped_blow_away_sequence, dependencies=['t_blowaway'],
+                              condition='t_blowaway', events=2, cycles=chopped_blow_away_cycles,
+                              period='t_BA_chop_period'),
+    "excitation_pulses": dict(emit=excitation_pulses_sequence,
+                              dependencies=['n_excitation_attempts', 't_excitation_pulse', 'gate_start_offset_mu',
+                                            'gate_switch_offset'],
+                              condition='n_excitation_attempts', events=excitation_pulses_events)
+}
+
 ###############################################################################
 # 2. EXPERIMENT FUNCTIONS
 # These are the experiments we run, and the name of each should end with
@@ -680,6 +864,7 @@ def MOT_loading_experiment(self):
     for measurement in range(self.n_measurements):
         self.laser_stabilizer.run()  # this tunes the MOT and FORT AOMs
         load_MOT_and_FORT(self)
+    self.laser_stabilizer.save_power_curves(True)  # persist the power curves updated since the last save
 
 @kernel
 def atom_loading_experiment(self):
@@ -696,7 +881,6 @@ def atom_loading_experiment(self):
 
     self.counts = 0
     self.counts2 = 0
-    rtio_log("2nd_shot_block", 0)
 
     self.require_D1_lock_to_advance = False # override experiment variable
 
@@ -704,22 +888,19 @@ def atom_loading_experiment(self):
                      [0.0],
                      broadcast=True)
 
+    self.dma_sequences.update()
+
     self.measurement = 0
     while self.measurement < self.n_measurements:
 
         if self.enable_laser_feedback:
-            self.laser_stabilizer.run()  # this tunes the MOT and FORT AOMs
+            self.laser_stabilizer.scheduled_run()  # this tunes the MOT and FORT AOMs
 
         load_MOT_and_FORT(self)
 
         delay(0.1*ms)
-        self.zotino0.set_dac(
-            [self.AZ_bottom_volts_RO, self.AZ_top_volts_RO, self.AX_volts_RO, self.AY_volts_RO],
-            channels=self.coil_channels)
-
-        # set the cooling DP AOM to the readout settings
-        self.dds_cooling_DP.set(frequency=self.f_cooling_DP_RO,
-                                amplitude=self.ampl_cooling_DP_MOT*self.p_cooling_DP_RO)
+        # the coils and cooling DP AOM readout settings
+        self.dma_sequences.readout_setup.playback()
 
         if not self.no_first_shot:
             first_shot(self)
@@ -733,13 +914,12 @@ def atom_loading_experiment(self):
         self.ttl_SPCM_gate.pulse(self.t_delay_between_shots) # blocks the SPCM
         self.dds_cooling_DP.sw.on()
 
-        rtio_log("2nd_shot_block",1)
         second_shot(self)
-        rtio_log("2nd_shot_block", 0)
 
         end_measurement(self)
 
     self.dds_FORT.sw.off()
+    self.laser_stabilizer.save_power_curves(True)  # persist the power curves updated since the last save
 
 @kernel
 def trap_frequency_experiment(self):
@@ -769,30 +949,27 @@ def trap_frequency_experiment(self):
                      [0.0],
                      broadcast=True)
 
+    self.dma_sequences.update()
+
     self.measurement = 0
     while self.measurement < self.n_measurements:
 
         #TODO: just set the rigol frequency using pyvisa
 
         if self.enable_laser_feedback:
-            self.laser_stabilizer.run()  # this tunes the MOT and FORT AOMs
+            self.laser_stabilizer.scheduled_run()  # this tunes the MOT and FORT AOMs
 
         load_MOT_and_FORT(self)
 
         delay(0.1*ms)
-        self.zotino0.set_dac(
-            [self.AZ_bottom_volts_RO, self.AZ_top_volts_RO, self.AX_volts_RO, self.AY_volts_RO],
-            channels=self.coil_channels)
+        # the coils and cooling DP AOM readout settings
+        self.dma_sequences.readout_setup.playback()
 
         # set the FORT AOM to the science setting. this is only valid if we have run
         # feedback to reach the corresponding setpoint first, which in this case, happened in load_MOT_and_FORT
         self.dds_FORT.set(frequency=self.f_FORT,
                                 amplitude=self.stabilizer_FORT.amplitudes[1])
 
-        # set the cooling DP AOM to the readout settings
-        self.dds_cooling_DP.set(frequency=self.f_cooling_DP_RO,
-                                amplitude=self.ampl_cooling_DP_MOT*self.p_cooling_DP_RO)
-
         if not self.no_first_shot:
             first_shot(self)
 
@@ -810,6 +987,7 @@ def trap_frequency_experiment(self):
         end_measurement(self)
 
     self.dds_FORT.sw.off()
+    self.laser_stabilizer.save_power_curves(True)  # persist the power curves updated since the last save
 
 @kernel
 def microwave_Rabi_experiment(self):
@@ -834,12 +1012,9 @@ def microwave_Rabi_experiment(self):
                      [0.0],
                      broadcast=True)
 
-    if self.t_pumping > 0.0:
-        record_chopped_optical_pumping(self)
-        delay(100*ms)
-    if self.t_blowaway > 0.0:
-        record_chopped_blow_away(self)
-        delay(100*ms)
+    # record the chopped optical pumping and blow away, etc.
+    self.dma_sequences.update()
+    delay(100*ms)
 
     delay(10 * ms)
     self.dds_microwaves.set(frequency=self.f_microwaves_dds, amplitude=dB_to_V(self.p_microwaves))
@@ -851,7 +1026,7 @@ def microwave_Rabi_experiment(self):
     while self.measurement < self.n_measurements:
 
         if self.enable_laser_feedback:
-            self.laser_stabilizer.run()  # this tunes the MOT and FORT AOMs
+            self.laser_stabilizer.scheduled_run()  # this tunes the MOT and FORT AOMs
 
             # bug -- microwave dds is off after AOM feedback; not clear why yet. for now, just turn it back on
             self.dds_microwaves.sw.on()
@@ -859,18 +1034,13 @@ def microwave_Rabi_experiment(self):
         load_MOT_and_FORT(self)
 
         delay(0.1 * ms)
-        self.zotino0.set_dac(
-            [self.AZ_bottom_volts_RO, self.AZ_top_volts_RO, self.AX_volts_RO, self.AY_volts_RO],
-            channels=self.coil_channels)
+        # the coils and cooling DP AOM readout settings
+        self.dma_sequences.readout_setup.playback()
 
         # set the FORT AOM to the readout settings
         self.dds_FORT.set(frequency=self.f_FORT,
                           amplitude=self.stabilizer_FORT.amplitudes[1])
 
-        # set the cooling DP AOM to the readout settings
-        self.dds_cooling_DP.set(frequency=self.f_cooling_DP_RO,
-                                amplitude=self.ampl_cooling_DP_MOT * self.p_cooling_DP_RO)
-
         if not self.no_first_shot:
             first_shot(self)
         delay(1 * ms) # leave the repump on so atoms are left in F=2
@@ -938,6 +1108,7 @@ def microwave_Rabi_experiment(self):
 
     self.dds_FORT.sw.off()
     self.dds_microwaves.sw.off()
+    self.laser_stabilizer.save_power_curves(True)  # persist the power curves updated since the last save
 
 @kernel
 def single_photon_experiment(self):
@@ -950,41 +1121,37 @@ def single_photon_experiment(self):
     # overwritten below but initialized here so they are always initialized
     self.counts = 0
     self.counts2 = 0
-    excitation_counts = 0
-    excitation_counts_array = [0]
-    rtio_log("2nd_shot_block", 0) # todo: delete. for debugging.
 
     self.set_dataset(self.count_rate_dataset,
                      [0.0],
                      broadcast=True)
 
-    record_chopped_optical_pumping(self)
+    # record the chopped optical pumping and excitation pulses, etc.
+    self.dma_sequences.update()
     delay(100*ms)
-    op_dma_handle = self.core_dma.get_handle("chopped_optical_pumping")
 
     self.measurement = 0
     while self.measurement < self.n_measurements:
 
-        excitation_counts_array = [0] * self.n_excitation_cycles
+        for i in range(self.n_excitation_cycles):
+            self.excitation_cycle_counts[i] = 0
+        for i in range(self.n_excitation_attempts):
+            self.excitation_attempt_counts[i] = 0
+        self.excitation_cycle_index = 0
 
         if self.enable_laser_feedback:
-            self.laser_stabilizer.run()  # this tunes the MOT and FORT AOMs
+            self.laser_stabilizer.scheduled_run()  # this tunes the MOT and FORT AOMs
         delay(10*ms)
         load_MOT_and_FORT(self)
 
         delay(0.1 * ms)
-        self.zotino0.set_dac(
-            [self.AZ_bottom_volts_RO, self.AZ_top_volts_RO, self.AX_volts_RO, self.AY_volts_RO],
-            channels=self.coil_channels)
+        # the coils and cooling DP AOM readout settings
+        self.dma_sequences.readout_setup.playback()
 
         # set the FORT AOM to the readout settings
         self.dds_FORT.set(frequency=self.f_FORT,
                           amplitude=self.stabilizer_FORT.amplitudes[1])
 
-        # set the cooling DP AOM to the readout settings
-        self.dds_cooling_DP.set(frequency=self.f_cooling_DP_RO,
-                                amplitude=self.ampl_cooling_DP_MOT * self.p_cooling_DP_RO)
-
         if not self.no_first_shot:
             first_shot(self)
         delay(1 * ms)
@@ -1001,17 +1168,18 @@ def single_photon_experiment(self):
         # lower level optical pumping and excitation sequence to optimize for speed
         ########################################################
 
-        excitation_counts = 0
         self.ttl_SPCM_gate.on()  # blocks the SPCM output - this is related to the atom readouts undercounting
-        loop_start_mu = now_mu()
 
         self.zotino0.set_dac(
             [self.AZ_bottom_volts_OP, self.AZ_top_volts_OP, self.AX_volts_OP, self.AY_volts_OP],
             channels=self.coil_channels)
         delay(0.4 * ms)  # coil relaxation time
 
-        self.ttl_SPCM0._set_sensitivity(1)
-        for excitaton_cycle in range(2): #self.n_excitation_cycles):
+        # the SPCM is gated during the excitation pulses in the DMA sequence, and the click timestamps are read
+        # every n_excitation_cycles_per_readout cycles. each block of cycles is read after the next one has been
+        # queued, so waiting for the clicks doesn't use up the slack.
+        t_previous_block_end = np.int64(-1)
+        for excitation_cycle in range(self.n_excitation_cycles):
 
             delay(0.5*ms)
 
@@ -1021,82 +1189,51 @@ def single_photon_experiment(self):
 
             if self.t_pumping > 0.0:
 
-                # make sure the fiber AOMs are on for delivery of the pumping repump
-                if not self.pumping_light_off:
-                    self.dds_pumping_repump.sw.on()
+                with self.rtio_profiler.optical_pumping:
+                    # make sure the fiber AOMs are on for delivery of the pumping repump
+                    if not self.pumping_light_off:
+                        self.dds_pumping_repump.sw.on()
 
-                self.dds_AOM_A1.sw.on()
-                self.dds_AOM_A2.sw.on()
-                self.dds_AOM_A3.sw.on()
-                self.dds_AOM_A4.sw.on()
-                self.dds_AOM_A5.sw.on()
-                self.dds_AOM_A6.sw.on()
+                    self.dds_AOM_A1.sw.on()
+                    self.dds_AOM_A2.sw.on()
+                    self.dds_AOM_A3.sw.on()
+                    self.dds_AOM_A4.sw.on()
+                    self.dds_AOM_A5.sw.on()
+                    self.dds_AOM_A6.sw.on()
 
-                with sequential:
+                    with sequential:
 
-                    delay(1 * us)
+                        delay(1 * us)
 
-                    self.core_dma.playback_handle(op_dma_handle)
-                    # delay(self.t_depumping)
+                        chopped_optical_pumping_pulses(self)
+                        # delay(self.t_depumping)
 
-                    self.dds_D1_pumping_DP.sw.off()
-                    self.dds_pumping_repump.sw.off() # turn the repump back on
+                        self.dds_D1_pumping_DP.sw.off()
+                        self.dds_pumping_repump.sw.off() # turn the repump back on
 
-                delay(2 * us)
-                self.dds_AOM_A1.sw.off()
-                self.dds_AOM_A2.sw.off()
-                self.dds_AOM_A3.sw.off()
-                self.dds_AOM_A4.sw.off()
-                self.dds_AOM_A5.sw.off()
-                self.dds_AOM_A6.sw.off()
+                    delay(2 * us)
+                    self.dds_AOM_A1.sw.off()
+                    self.dds_AOM_A2.sw.off()
+                    self.dds_AOM_A3.sw.off()
+                    self.dds_AOM_A4.sw.off()
+                    self.dds_AOM_A5.sw.off()
+                    self.dds_AOM_A6.sw.off()
 
             ############################
             # excitation phase - excite F=1,m=0 -> F'=0,m'=0, detect photon
             ############################
 
-            now = now_mu()
-
-            at_mu(now+10)
-            self.ttl_repump_switch.off()  # repump AOM is on for excitation
-            mu_offset = 800 # accounts for various latencies
-            at_mu(now + mu_offset - 200) # make sure stuff is off, no more Raman photons from FORT
-            # self.ttl_repump_switch.off()  # repump AOM is on for excitation
-            at_mu(now + mu_offset+100+self.gate_start_offset_mu) # allow for repump rise time and FORT after-pulsing
-            t_collect = now_mu()
-            t_gate_end = self.ttl_SPCM0.gate_rising(self.n_excitation_attempts * (self.t_excitation_pulse + 100 * ns))
-            t_excite = now_mu()
-            pulses_over_mu = 0
-            for attempt in range(self.n_excitation_attempts):
-                at_mu(now + mu_offset + 201 + int(attempt * (self.t_excitation_pulse / ns + 100))
-                      + self.gate_start_offset_mu)
-                self.dds_excitation.sw.pulse(self.t_excitation_pulse)
-                at_mu(now + mu_offset + 741 + int(attempt * (self.t_excitation_pulse / ns + 100) -
-                                                  0.1*self.t_excitation_pulse / ns) +self.gate_start_offset_mu)
-                # fast switch to gate SPCM output - why am I using a switch instead of the gate input on the SPCM?
-                self.ttl_SPCM_gate.off()
-                delay(0.2*self.t_excitation_pulse+100*ns + self.gate_switch_offset)
-                self.ttl_SPCM_gate.on()
-
-                pulses_over_mu = now_mu()
-            self.ttl_repump_switch.on()
-            at_mu(pulses_over_mu - 200) # fudge factor
-            self.ttl_SPCM_gate.on() # TTL high turns switch off, i.e. signal blocked
-            self.dds_FORT.sw.on()
+            with self.rtio_profiler.excitation:
+                self.excitation_cycle_start_mu[excitation_cycle] = now_mu()
+                self.dma_sequences.excitation_pulses.playback()
 
-            # todo: terrible way of doing this. set the sensitivity of the gate at the beginning of the loop.
-            #  it will only register events when the SPCM switch lets events through.
-            # excitation_counts = self.ttl_SPCM0.count(
-            #     t_gate_end)  # this is the number of clicks we got over n_excitation attempts
-            # excitation_counts_array[excitaton_cycle] = excitation_counts
-            # delay(0.1*ms) # ttl count consumes all the RTIO slack.
-        #     loop_over_mu = now_mu()
-
-            # todo: delete
-            # self.print_async("bottom of excitation loop",now_mu() - loop_start_mu)
-        # delay(1 * ms)
-        # # self.ttl_SPCM_gate.on()  # blocks the SPCM
-        self.ttl_SPCM0._set_sensitivity(0)
-        excitation_counts = self.ttl_SPCM0.count(now_mu())
+            if (excitation_cycle + 1) % self.n_excitation_cycles_per_readout == 0:
+                if t_previous_block_end >= 0:
+                    read_excitation_clicks(self, t_previous_block_end, excitation_cycle + 1)
+                t_previous_block_end = now_mu()
+
+        # the clicks of the last blocks
+        read_excitation_clicks(self, now_mu(), self.n_excitation_cycles)
 
         delay(1*ms)
 
@@ -1108,15 +1245,8 @@ def single_photon_experiment(self):
         self.dds_AOM_A5.sw.on()
         self.dds_AOM_A6.sw.on()
 
-        # todo: delete
-        # self.core.wait_until_mu(loop_over_mu+1000)
-        # at_mu(loop_over_mu+1000)
-        # self.print_async("out of the loop",now_mu() - loop_start_mu)
-
         delay(1*ms)
 
-        rtio_log("2nd_shot_block",1)
-        # self.print_async("second readout",now_mu() - loop_start_mu) # todo: delete
         with sequential:
 
             self.ttl_SPCM_gate.off() # enables the SPCM
@@ -1130,15 +1260,14 @@ def single_photon_experiment(self):
 
 
             second_shot(self)
-        rtio_log("2nd_shot_block",0)
 
         end_measurement(self)
-        for val in excitation_counts_array:
-            self.append_to_dataset('excitation_counts', val)
+        update_excitation_datasets(self, self.excitation_cycle_counts, self.excitation_attempt_counts)
 
         delay(10*ms)
 
     self.dds_FORT.sw.off()
+    self.laser_stabilizer.save_power_curves(True)  # persist the power curves updated since the last save
 
 ###############################################################################
 # 3. DIAGNOSTIC FUNCTIONS
@@ -1201,6 +1330,8 @@ def FORT_monitoring_with_Luca_experiment(self):
                      [0.0],
                      broadcast=True)
 
+    self.dma_sequences.update()
+
     delay(100*ms)
     now = now_mu()
     for i in range(self.warm_up_shots):
@@ -1214,7 +1345,7 @@ def FORT_monitoring_with_Luca_experiment(self):
     while self.measurement < self.n_measurements:
 
         if self.enable_laser_feedback:
-            self.laser_stabilizer.run(monitor_only=self.no_feedback)  # this tunes the MOT and FORT AOMs
+            self.laser_stabilizer.scheduled_run(monitor_only=self.no_feedback)  # this tunes the MOT and FORT AOMs
 
         load_MOT_and_FORT_for_Luca_scattering_measurement(self)
 
@@ -1265,6 +1396,7 @@ def FORT_monitoring_with_Luca_experiment(self):
         self.append_to_dataset("APD_FORT_volts_science", self.APD_FORT_volts_science)
 
     self.dds_FORT.sw.off()
+    self.laser_stabilizer.save_power_curves(True)  # persist the power curves updated since the last save
 
 @kernel
 def atom_loading_and_waveplate_rotation_experiment(self):
@@ -1289,6 +1421,8 @@ def atom_loading_and_waveplate_rotation_experiment(self):
                      [0.0],
                      broadcast=True)
 
+    self.dma_sequences.update()
+
     self.measurement = 0
     while self.measurement < self.n_measurements:
 
@@ -1297,7 +1431,7 @@ def atom_loading_and_waveplate_rotation_experiment(self):
         delay(10*ms)
 
         if self.enable_laser_feedback:
-            self.laser_stabilizer.run()  # this tunes the MOT and FORT AOMs
+            self.laser_stabilizer.scheduled_run()  # this tunes the MOT and FORT AOMs
 
         load_MOT_and_FORT(self)
 
@@ -1340,4 +1474,5 @@ def atom_loading_and_waveplate_rotation_experiment(self):
 
         end_measurement(self)
 
-    self.dds_FORT.sw.off()
\ No newline at end of file
+    self.dds_FORT.sw.off()
+    self.laser_stabilizer.save_power_curves(True)  # persist the power curves updated since the last save
\ No newline at end of file
@@ -0,0 +1,91 @@
+"""
+For measuring the time per feedback iteration of the AOMPowerStabilizer, i.e. one call to measure() plus the
+delay in the feedback loops, both in timeline (machine units advanced) and wall clock time, and the timeline
+duration of run().
+
+The stabilizer is instantiated from the feedback_channels.json of the node, so the numbers depend on how many
+Samplers are used and the averages of each channel. The dds channels aren't turned on.
+"""
+
+from artiq.experiment import *
+import numpy as np
+import time
+
+import sys, os
+# get the current working directory
+cwd = os.getcwd() + "\\"
+sys.path.append(cwd)
+sys.path.append(cwd+"\\repository\\qn_artiq_routines")
+
+from utilities.BaseExperiment import BaseExperiment
+from subroutines.aom_feedback import AOMPowerStabilizer
+
+
+class AOMFeedbackMeasureBenchmark(EnvExperiment):
+
+    def build(self):
+        self.base = BaseExperiment(experiment=self)
+        self.base.build()
+
+        self.setattr_argument("feedback_dds_list",
+                              StringValue(
+                                  "['dds_AOM_A1', 'dds_AOM_A2', 'dds_AOM_A3', 'dds_AOM_A4','dds_AOM_A5',"
+                                  "'dds_AOM_A6','dds_FORT','dds_D1_pumping_DP']"))
+        self.setattr_argument("averages", NumberValue(4, type='int', ndecimals=0, scale=1, step=1))
+        self.setattr_argument("n_iterations", NumberValue(1000, type='int', ndecimals=0, scale=1, step=1))
+        self.setattr_argument("n_runs", NumberValue(20, type='int', ndecimals=0, scale=1, step=1))
+
+        self.base.set_datasets_from_gui_args()
+
+    def prepare(self):
+        self.base.prepare()
+
+        self.laser_stabilizer = AOMPowerStabilizer(experiment=self,
+                                                   dds_names=eval(self.feedback_dds_list),
+                                                   iterations=self.aom_feedback_iterations,
+                                                   averages=self.averages,
+                                                   update_dds_settings=False,
+                                                   dry_run=True)
+        self.t_mu_per_iteration = 0
+
+    def mark_start(self):
+        """called from the kernel so that the compile time isn't included"""
+        self.t_start = time.time()
+
+    @kernel
+    def measure_loop(self):
+        self.core.reset()
+        self.mark_start()
+        self.core.break_realtime()
+        t0 = now_mu()
+        for i in range(self.n_iterations):
+            self.laser_stabilizer.measure()
+            delay(0.1*ms) # the delay after measure in the feedback loops
+        self.t_mu_per_iteration = (now_mu() - t0) // self.n_iterations
+        self.core.wait_until_mu(now_mu())
+
+    @kernel
+    def run_loop(self):
+        for i in range(self.n_runs):
+            self.laser_stabilizer.run()
+        self.core.wait_until_mu(now_mu())
+
+    def run(self):
+        self.base.initialize_hardware()
+
+        self.laser_stabilizer.run_duration_history.reset()
+        self.run_loop()
+        t_run = np.mean(self.laser_stabilizer.run_duration_history.values())
+        print(f"{t_run*1e3:.2f} ms per run()")
+        self.set_dataset("t_run", t_run)
+
+        self.measure_loop()
+        t_wall = (time.time() - self.t_start)/self.n_iterations
+
+        t_timeline = self.core.mu_to_seconds(self.t_mu_per_iteration)
+        print(f"{self.laser_stabilizer.num_samplers} Samplers, averages per Sampler "
+              f"{self.laser_stabilizer.sampler_averages}")
+        print(f"timeline per feedback iteration: {t_timeline*1e6:.1f} us, wall clock: {t_wall*1e6:.1f} us")
+
+        self.set_dataset("t_feedback_iteration_timeline", t_timeline)
+        self.set_dataset("t_feedback_iteration_wall", t_wall)
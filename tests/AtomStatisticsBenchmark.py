@@ -0,0 +1,102 @@
+"""
+For comparing the time it takes to count atoms with the list comprehensions which the cost functions used to have,
+and with the numpy functions in utilities/atom_statistics.py.
+
+Synthetic two-readout counts are generated with a bimodal distribution like our single atom histograms, and both
+implementations are checked to give the same numbers. No hardware is needed.
+"""
+
+from artiq.experiment import *
+import numpy as np
+import time
+
+from skimage.filters import threshold_otsu
+
+import sys, os
+# get the current working directory
+current_working_directory = os.getcwd()
+cwd = os.getcwd() + "\\"
+sys.path.append(cwd)
+sys.path.append(cwd+"\\repository\\qn_artiq_routines")
+
+from utilities.atom_statistics import loading, retention, loading_events, otsu_threshold
+
+
+def loading_with_lists(counts, threshold):
+    atoms_loaded = [x > threshold for x in counts]
+    return sum(atoms_loaded), len(counts)
+
+
+def retention_with_lists(counts, counts2, threshold, threshold2):
+    atoms_loaded = [x > threshold for x in counts]
+    atoms_retained = [x > threshold2 and y for x, y in zip(counts2, atoms_loaded)]
+    return sum(atoms_retained), sum(atoms_loaded)
+
+
+def loading_events_with_lists(counts, threshold):
+    atoms_loaded = 0
+    q_last = (counts[0] > threshold)
+    for x in counts[1:]:
+        q = x > threshold
+        if q != q_last and q_last:
+            atoms_loaded += 1
+        q_last = q
+    atoms_loaded += q_last
+    return atoms_loaded
+
+
+def otsu_threshold_with_lists(counts, threshold):
+    n_atoms_loaded, n_shots = loading_with_lists(counts, threshold)
+    if n_atoms_loaded / n_shots > 0.3:
+        return threshold_otsu(np.array(counts))
+    return threshold
+
+
+class AtomStatisticsBenchmark(EnvExperiment):
+
+    def build(self):
+        self.setattr_argument("n_shots", NumberValue(5000, ndecimals=0, step=1))
+        self.setattr_argument("n_repeats", NumberValue(20, ndecimals=0, step=1))
+        self.setattr_argument("loading_fraction", NumberValue(0.5))
+        self.setattr_argument("retention_fraction", NumberValue(0.8))
+
+    def prepare(self):
+        self.n_shots = int(self.n_shots)
+        self.n_repeats = int(self.n_repeats)
+        self.threshold = 15
+
+        # lists of python ints, like the counts lists written back from the kernel
+        np.random.seed(0)
+        loaded = np.random.rand(self.n_shots) < self.loading_fraction
+        retained = loaded & (np.random.rand(self.n_shots) < self.retention_fraction)
+        self.counts = list(np.where(loaded, np.random.poisson(40, self.n_shots),
+                                    np.random.poisson(3, self.n_shots)).tolist())
+        self.counts2 = list(np.where(retained, np.random.poisson(40, self.n_shots),
+                                     np.random.poisson(3, self.n_shots)).tolist())
+
+    def time_per_call(self, function, *args):
+        t0 = time.time()
+        for i in range(self.n_repeats):
+            result = function(*args)
+        return (time.time() - t0)/self.n_repeats, result
+
+    def run(self):
+        comparisons = {
+            "loading": (loading_with_lists, loading, (self.counts, self.threshold)),
+            "retention": (retention_with_lists, retention, (self.counts, self.counts2, self.threshold,
+                                                            self.threshold)),
+            "loading_events": (loading_events_with_lists, loading_events, (self.counts, self.threshold)),
+            "otsu_threshold": (otsu_threshold_with_lists, otsu_threshold, (self.counts, self.threshold))
+        }
+
+        print(f"{self.n_shots} shots")
+        for name, (with_lists, with_numpy, args) in comparisons.items():
+            t_lists, result_lists = self.time_per_call(with_lists, *args)
+            t_numpy, result_numpy = self.time_per_call(with_numpy, *args)
+            assert np.all(np.array(result_lists) == np.array(result_numpy)), \
+                f"{name}: {result_lists} with lists, but {result_numpy} with numpy"
+
+            print(f"{name}: {t_lists*1e3:.3f} ms with lists, {t_numpy*1e3:.3f} ms with numpy "
+                  f"({t_lists/t_numpy:.1f}x)")
+            self.set_dataset(f"t_{name}_lists", t_lists)
+            self.set_dataset(f"t_{name}_numpy", t_numpy)
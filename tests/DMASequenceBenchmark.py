@@ -0,0 +1,82 @@
+"""
+Measures how much CPU time the DMA sequences in subroutines/experiment_functions.py save per shot, by timing
+emitting each sequence directly from the kernel against playing back its recording. The times are RTIO counter
+differences, i.e. how much slack each one uses up.
+
+The sequences which are disabled by the ExperimentVariables, e.g. chopped_blow_away when t_blowaway is 0, are skipped.
+"""
+
+from artiq.experiment import *
+import numpy as np
+
+import sys, os
+# get the current working directory
+cwd = os.getcwd() + "\\"
+sys.path.append(cwd)
+sys.path.append(cwd+"\\repository\\qn_artiq_routines")
+
+from utilities.BaseExperiment import BaseExperiment
+
+
+class DMASequenceBenchmark(EnvExperiment):
+
+    def build(self):
+        self.base = BaseExperiment(experiment=self)
+        self.base.build()
+
+        self.setattr_argument("n_iterations", NumberValue(100, type='int', ndecimals=0, scale=1, step=1))
+
+        self.base.set_datasets_from_gui_args()
+
+    def prepare(self):
+        self.base.prepare()
+
+        n = len(self.dma_sequences.names)
+        self.emit_mu = np.zeros(n, dtype=np.int64)
+        self.playback_mu = np.zeros(n, dtype=np.int64)
+
+    @kernel
+    def benchmark(self):
+        self.core.reset()
+        self.dma_sequences.update()
+
+        for i in range(len(self.dma_sequences.names)):
+            if not self.dma_sequences.enabled(i):
+                continue
+
+            for j in range(self.n_iterations):
+                self.core.break_realtime()
+                delay(1*ms)
+                t0 = self.core.get_rtio_counter_mu()
+                self.dma_sequences.emit(i, self.dma_sequences.cycles(i))
+                self.emit_mu[i] += self.core.get_rtio_counter_mu() - t0
+
+            # what DMASequence.playback does, including checking whether the sequence needs to be recorded again
+            for j in range(self.n_iterations):
+                self.core.break_realtime()
+                delay(1*ms)
+                t0 = self.core.get_rtio_counter_mu()
+                if self.dma_sequences.is_stale(i):
+                    self.dma_sequences.record(i)
+                self.dma_sequences.playback(i)
+                self.playback_mu[i] += self.core.get_rtio_counter_mu() - t0
+
+            self.core.wait_until_mu(now_mu())
+
+    def run(self):
+        self.base.initialize_hardware()
+        self.benchmark()
+
+        total_saved = 0.0
+        for i, name in enumerate(self.dma_sequences.names):
+            if self.playback_mu[i] == 0:
+                print(f"{name}: disabled, skipped")
+                continue
+            emit_us = self.core.mu_to_seconds(self.emit_mu[i])/self.n_iterations*1e6
+            playback_us = self.core.mu_to_seconds(self.playback_mu[i])/self.n_iterations*1e6
+            total_saved += emit_us - playback_us
+            print(f"{name}: emitting {emit_us:.1f} us, playback {playback_us:.1f} us, "
+                  f"saved {emit_us - playback_us:.1f} us per shot")
+            self.set_dataset(f"dma_benchmark_{name}_emit_us", emit_us)
+            self.set_dataset(f"dma_benchmark_{name}_playback_us", playback_us)
+        print(f"total saved: {total_saved:.1f} us per shot")
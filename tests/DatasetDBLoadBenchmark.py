@@ -0,0 +1,83 @@
+"""
+For comparing the time it takes to read the dataset database with the old eval-based parsing in BaseExperiment.build
+and the cached loader in utilities/dataset_db.py.
+
+A synthetic dataset_db is written to a temporary directory with ~150 variables plus a number of long list-valued
+history datasets, like the ones that accumulate in our persistent dataset_db.pyon. No hardware is needed.
+"""
+
+from artiq.experiment import *
+import numpy as np
+import tempfile
+import time
+
+from sipyco import pyon
+
+import sys, os
+# get the current working directory
+current_working_directory = os.getcwd()
+cwd = os.getcwd() + "\\"
+sys.path.append(cwd)
+sys.path.append(cwd+"\\repository\\qn_artiq_routines")
+
+from utilities.dataset_db import load_variables_snapshot, clear_cache
+
+
+class DatasetDBLoadBenchmark(EnvExperiment):
+
+    def build(self):
+        self.setattr_argument("n_variables", NumberValue(150, ndecimals=0, step=1))
+        self.setattr_argument("n_history_datasets", NumberValue(20, ndecimals=0, step=1))
+        self.setattr_argument("history_length", NumberValue(50000, ndecimals=0, step=1))
+        self.setattr_argument("n_builds", NumberValue(10, ndecimals=0, step=1))
+
+    def prepare(self):
+        np.random.seed(0)
+        datasets = {}
+        for i in range(self.n_variables):
+            datasets[f"variable_{i}"] = float(np.random.rand())
+        datasets["a_flag"] = True
+        datasets["which_node"] = "alice"
+        for i in range(self.n_history_datasets):
+            datasets[f"p_AOM_{i}_history"] = list(np.random.rand(self.history_length) - 10)
+
+        self.tmp_dir = tempfile.mkdtemp()
+        self.db_file = os.path.join(self.tmp_dir, "dataset_db.pyon")
+        pyon.store_file(self.db_file, datasets)
+
+    def eval_parse(self):
+        """the parsing previously done in BaseExperiment.build"""
+        with open(self.db_file) as f:
+            datasets_str = f.read()
+        datasets_str = datasets_str.replace("true", "True")
+        datasets_str = datasets_str.replace("false", "False")
+        return eval(datasets_str).keys()
+
+    def run(self):
+        print(f"dataset_db size: {os.path.getsize(self.db_file)/1e6:.2f} MB")
+
+        t0 = time.time()
+        for i in range(self.n_builds):
+            self.eval_parse()
+        t_eval = (time.time() - t0)/self.n_builds
+
+        clear_cache()
+        t0 = time.time()
+        load_variables_snapshot(self.db_file)
+        t_first = time.time() - t0
+
+        t0 = time.time()
+        for i in range(self.n_builds):
+            load_variables_snapshot(self.db_file)
+        t_cached = (time.time() - t0)/self.n_builds
+
+        print(f"eval per build: {t_eval*1e3:.1f} ms")
+        print(f"pyon loader, first build: {t_first*1e3:.1f} ms")
+        print(f"pyon loader, subsequent builds: {t_cached*1e3:.3f} ms")
+
+        self.set_dataset("t_build_eval", t_eval)
+        self.set_dataset("t_build_loader_first", t_first)
+        self.set_dataset("t_build_loader_cached", t_cached)
+
+        os.remove(self.db_file)
+        os.rmdir(self.tmp_dir)
@@ -0,0 +1,67 @@
+"""
+Checks the circular error history of FeedbackChannel, which is updated on the kernel, against the numpy
+implementation it replaced, which was run on the host by an RPC every feedback iteration.
+
+This runs entirely on the host, since update_error_history is portable. No hardware is needed.
+"""
+
+from artiq.experiment import *
+import numpy as np
+
+import sys, os
+# get the current working directory
+cwd = os.getcwd() + "\\"
+sys.path.append(cwd)
+sys.path.append(cwd+"\\repository\\qn_artiq_routines")
+
+from subroutines.aom_feedback import FeedbackChannel
+
+
+class NumpyErrorHistory:
+    """the previous error history implementation, for comparison"""
+
+    def __init__(self, error_history_length):
+        self.error_history_arr = np.full(error_history_length, 0.0)
+        self.error_history_length = error_history_length
+        self.cumulative_error = 0.0
+
+    def update_error_history(self, error):
+        self.error_buffer = self.error_history_arr[-(self.error_history_length - 1):]
+        self.error_history_arr[:-1] = self.error_buffer
+        self.error_history_arr[-1] = error
+        self.cumulative_error = sum(self.error_history_arr)
+
+
+class FeedbackErrorHistoryTest(EnvExperiment):
+
+    def build(self):
+        self.setattr_argument("error_history_lengths", StringValue("[2, 4, 10, 25]"))
+        self.setattr_argument("n_updates", NumberValue(10000, type='int', ndecimals=0, scale=1, step=1))
+        self.setattr_argument("tolerance", NumberValue(1e-9))
+
+        # FeedbackChannel only needs its stabilizer for the experiment which owns its datasets
+        self.exp = self
+
+    def run(self):
+        np.random.seed(0)
+        for n in eval(self.error_history_lengths):
+            ch = FeedbackChannel(stabilizer=self, name="dds_test", dds_obj=None, buffer_index=0,
+                                 set_points=[1.0], p=0.1, i=0.0, frequency=0.0, amplitude=0.0,
+                                 dataset="test_monitor", dB_dataset="p_test", t_measure_delay=0.0,
+                                 error_history_length=n, max_dB=-3)
+            reference = NumpyErrorHistory(n)
+
+            max_diff = 0.0
+            for err in np.random.randn(self.n_updates):
+                ch.update_error_history(err)
+                reference.update_error_history(err)
+                max_diff = max(max_diff, abs(ch.cumulative_error - reference.cumulative_error))
+
+            # the circular buffer holds the same errors, just rotated
+            assert sorted(ch.error_history_arr) == sorted(reference.error_history_arr), \
+                f"error histories differ for error_history_length={n}"
+            assert max_diff < self.tolerance, \
+                f"cumulative_error differs by {max_diff} for error_history_length={n}"
+            print(f"error_history_length={n}: max difference in cumulative_error {max_diff:.2e}")
+
+        print("FeedbackErrorHistoryTest passed")
@@ -0,0 +1,75 @@
+"""
+For comparing the time and the number of bytes written by write_results when rewriting the whole h5 file each
+scan step vs. with the incremental writer in utilities/h5_writer.py, and the time that write_results blocks the
+experiment when the incremental writer runs in the background thread.
+
+This fakes a scan with n_steps steps of n_shots shots each, appending to the photocount datasets the same way
+end_measurement does, and calls write_results after each step like GeneralVariableScan. No hardware is needed.
+"""
+
+from artiq.experiment import *
+import numpy as np
+import time
+
+import sys, os
+# get the current working directory
+cwd = os.getcwd() + "\\"
+sys.path.append(cwd)
+sys.path.append(cwd+"\\repository\\qn_artiq_routines")
+
+from utilities.write_h5 import write_results, close_writers, wait_for_writes, _writers
+
+
+class H5WriterBenchmark(EnvExperiment):
+
+    def build(self):
+        self.setattr_device("scheduler")
+        self.setattr_argument("n_steps", NumberValue(100, ndecimals=0, step=1))
+        self.setattr_argument("n_shots", NumberValue(500, ndecimals=0, step=1))
+
+    def fake_scan(self, incremental, background):
+        """
+        :return: (time spent in write_results, bytes written)
+        """
+        name = ("background" if background else "incremental") if incremental else "full_rewrite"
+        filename = "{:09}-{}_{}.h5".format(self.scheduler.rid, self.__class__.__name__, name)
+
+        for ds in ["photocounts", "photocounts2", "photocounts_FORT_science", "FORT_MM_science_volts"]:
+            self.set_dataset(ds, [0], broadcast=True)
+
+        t_write = 0.0
+        bytes_written = 0
+        for step in range(self.n_steps):
+            self.set_dataset("iteration", step, broadcast=True)
+            self.set_dataset("photocounts_current_iteration", [0], broadcast=True)
+            self.set_dataset("photocounts2_current_iteration", [0], broadcast=True)
+            for shot in range(self.n_shots):
+                counts = int(np.random.poisson(20))
+                self.append_to_dataset("photocounts", counts)
+                self.append_to_dataset("photocounts2", counts)
+                self.append_to_dataset("photocounts_current_iteration", counts)
+                self.append_to_dataset("photocounts2_current_iteration", counts)
+                self.append_to_dataset("photocounts_FORT_science", counts)
+                self.append_to_dataset("FORT_MM_science_volts", 0.1)
+
+            t0 = time.time()
+            write_results(self, name=name, incremental=incremental, background=background)
+            t_write += time.time() - t0
+
+            if not incremental:
+                bytes_written += os.path.getsize(filename)
+
+        wait_for_writes()
+        if incremental:
+            bytes_written = _writers[filename].bytes_written
+        close_writers()
+
+        return t_write, bytes_written
+
+    def run(self):
+        for incremental, background in [(False, False), (True, False), (True, True)]:
+            t_write, bytes_written = self.fake_scan(incremental, background)
+            print(f"incremental={incremental}, background={background}: {t_write:.2f} s in write_results, "
+                  f"{bytes_written/1e6:.1f} MB written")
+            self.set_dataset(f"t_write_incremental_{incremental}_background_{background}", t_write)
+            self.set_dataset(f"bytes_written_incremental_{incremental}_background_{background}", bytes_written)
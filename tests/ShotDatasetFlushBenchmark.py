@@ -0,0 +1,76 @@
+"""
+For comparing the shot rate of the measurement loop for different values of n_shots_per_dataset_flush, i.e. how
+often end_measurement sends the buffered per-shot results to the datasets.
+
+n_shots_per_dataset_flush = 1 sends one async RPC per shot, which is the closest to the old behavior of several
+synchronous dataset RPCs per shot. Each shot here is just end_measurement with fake counts, so the difference
+in shots per second is due to the dataset updates and the FORT MM fiber measurement.
+"""
+
+from artiq.experiment import *
+import numpy as np
+import time
+
+import sys, os
+# get the current working directory
+cwd = os.getcwd() + "\\"
+sys.path.append(cwd)
+sys.path.append(cwd+"\\repository\\qn_artiq_routines")
+
+from utilities.BaseExperiment import BaseExperiment
+from subroutines.experiment_functions import end_measurement
+
+
+class ShotDatasetFlushBenchmark(EnvExperiment):
+
+    def build(self):
+        self.base = BaseExperiment(experiment=self)
+        self.base.build()
+
+        self.setattr_argument("n_measurements", NumberValue(200, ndecimals=0, step=1))
+        self.setattr_argument("flush_sizes", StringValue("[1, 10, 50]"))
+
+        self.base.set_datasets_from_gui_args()
+
+    def prepare(self):
+        self.flush_sizes = eval(self.flush_sizes)
+        self.base.prepare()
+
+        # don't wait on the atom or the D1 laser in this test
+        self.require_atom_loading_to_advance = False
+        self.require_D1_lock_to_advance = False
+        self.no_first_shot = False
+
+    def mark_start(self):
+        """called from the kernel so that the compile time isn't included in the shot rate"""
+        self.t_start = time.time()
+
+    @kernel
+    def measurement_loop(self):
+        self.mark_start()
+        self.core.reset()
+        self.measurement = 0
+        while self.measurement < self.n_measurements:
+            self.counts = self.measurement
+            self.counts2 = self.measurement
+            delay(1*ms)
+            end_measurement(self)
+        self.core.wait_until_mu(now_mu())
+
+    def run(self):
+        self.base.initialize_hardware()
+
+        shots_per_s = []
+        for n_shots in self.flush_sizes:
+            self.n_shots_per_dataset_flush = n_shots
+            self.base.initialize_shot_buffers()
+            self.base.initialize_datasets()
+
+            self.measurement_loop()
+            t_loop = time.time() - self.t_start
+
+            shots_per_s.append(self.n_measurements/t_loop)
+            print(f"n_shots_per_dataset_flush = {n_shots}: {shots_per_s[-1]:.1f} shots/s")
+
+        self.set_dataset("flush_sizes", self.flush_sizes)
+        self.set_dataset("shots_per_s", shots_per_s)
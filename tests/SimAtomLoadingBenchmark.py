@@ -0,0 +1,57 @@
+"""
+Runs atom_loading_experiment on the simulated devices in utilities/sim_devices.py, and reports the host time spent
+in the kernel, the RPCs it made, and the simulated RTIO time. No hardware is needed, e.g.
+
+artiq_run tests/SimAtomLoadingBenchmark.py
+
+The simulated node and its model are configured in utilities/config/sim. The host time is much longer than it
+would be on the core device, since the kernel runs as Python and RPC profiling slows it down further, so compare
+it between versions of the code rather than with the hardware.
+"""
+
+from artiq.experiment import *
+import numpy as np
+
+import sys, os
+# get the current working directory
+cwd = os.getcwd() + "\\"
+sys.path.append(cwd)
+sys.path.append(cwd+"\\repository\\qn_artiq_routines")
+
+from utilities.BaseExperiment import BaseExperiment
+from subroutines.experiment_functions import atom_loading_experiment
+
+
+class SimAtomLoadingBenchmark(EnvExperiment):
+
+    def build(self):
+        self.base = BaseExperiment(experiment=self, node="sim")
+        self.base.build()
+
+        self.setattr_argument("n_measurements_sim", NumberValue(200, type='int', ndecimals=0, scale=1, step=1))
+        self.setattr_argument("enable_laser_feedback_sim", BooleanValue(True))
+
+        self.base.set_datasets_from_gui_args()
+
+    def prepare(self):
+        self.n_measurements = self.n_measurements_sim
+        self.enable_laser_feedback = self.enable_laser_feedback_sim
+        self.base.prepare()
+
+    def run(self):
+        self.base.initialize_hardware()
+        self.core.reset_stats()
+
+        atom_loading_experiment(self)
+
+        print(self.core.report())
+        stats = self.core.stats
+        print(f"per measurement: {stats['host_time']/self.n_measurements*1e3:.2f} ms on the host, "
+              f"{stats['rtio_time']/self.n_measurements*1e3:.2f} ms simulated RTIO time")
+
+        counts2 = np.array(self.counts2_list)
+        print(f"second shot: mean {counts2.mean():.1f} counts, "
+              f"{np.mean(counts2/self.t_SPCM_second_shot > self.single_atom_counts_per_s)*100:.0f}% above threshold")
+
+        for name in ['host_time', 'rtio_time', 'rtio_events', 'rpcs', 'async_rpcs', 'rpc_time']:
+            self.set_dataset(f"sim_{name}", stats[name])
@@ -49,9 +49,16 @@ sys.path.append(cwd)
 sys.path.append(cwd+"\\repository\\qn_artiq_routines")
 
 from subroutines.aom_feedback import AOMPowerStabilizer
+from subroutines.experiment_functions import DMA_SEQUENCES
 from ExperimentVariables import setattr_variables
 from utilities.DeviceAliases import DeviceAliases
-from utilities.write_h5 import write_results
+from utilities import sim_devices
+from utilities.rtio_profiler import RTIOProfiler
+from utilities.dma_registry import DMASequenceRegistry
+from utilities.parameter_interleaver import ParameterInterleaver
+from utilities.early_stopping import EarlyStopping
+from utilities.write_h5 import write_results, close_writers
+from utilities.dataset_db import load_variables_snapshot
 from utilities.conversions import dB_to_V
 from K10CR1.KinesisMotorWrapper import KinesisMotorWrapper
 
@@ -62,23 +69,33 @@ cwd = os.getcwd() # must be called here. if called in class, returns the results
 
 class BaseExperiment:
 
-    def __init__(self, experiment: EnvExperiment):
+    def __init__(self, experiment: EnvExperiment, node=None):
         """
         Instantiate BaseExperiment in your build method, with experiment=self
         :param experiment: an instance of an ARTIQ Experiment.
+        :param node: the node to run on. if None (default), which_node from the datasets is used. "sim" runs on
+            the simulated devices in utilities/sim_devices.py, with the config in utilities/config/sim
         """
-        self.node = experiment.get_dataset("which_node")
+        self.node = experiment.get_dataset("which_node") if node is None else node
         self.experiment = experiment
 
-        devices_file = os.path.join(cwd, "repository\\qn_artiq_routines\\utilities\\config\\",
-                                    self.node,
-                                    "device_aliases.json")
+        self.config_dir = os.path.join(cwd, "repository\\qn_artiq_routines\\utilities\\config\\", self.node)
+        devices_file = os.path.join(self.config_dir, "device_aliases.json")
+
+        # the sim node mimics the hardware of another node, so from here on it takes that node's branches
+        self.simulated = self.node == "sim"
+        if self.simulated:
+            with open(os.path.join(self.config_dir, "simulation.json")) as f:
+                self.node = json.load(f)["gateware"]
 
         with open(devices_file) as f:
             devices_dict = json.load(f)
             self.experiment.alias_map = devices_dict["ALIAS_MAP"]
             self.experiment.dds_defaults = devices_dict["DDS_DEFAULTS"]
 
+        # times which are converted to machine units in prepare, e.g. t_MOT_loading -> t_MOT_loading_mu
+        self.times_to_convert = ['t_MOT_loading', 't_FORT_loading', 't_SPCM_exposure']
+
     def build(self):
         """
         Put this in your experiment's build method
@@ -93,20 +110,22 @@ class BaseExperiment:
         :return:
         """
 
-        with open(os.path.join(cwd,'dataset_db.pyon')) as f:
-            datasets_str = f.read()
+        # parsed once and cached until the file changes, so calling build again (e.g. in GeneralVariableScan) is cheap
+        variables_snapshot = load_variables_snapshot(os.path.join(cwd,'dataset_db.pyon'))
 
-        # when the pyon file is saved python True and False are converted to lowercase...
-        datasets_str = datasets_str.replace("true", "True")
-        datasets_str = datasets_str.replace("false", "False")
-        datasets_dict = eval(datasets_str)
-
-        # these are the names of all of the datasets, which we're going to use to create attributes of the same name
-        self.experiment.variables = datasets_dict.keys()
+        # these are the names of all of the datasets, which we're going to use to create attributes of the same name.
+        # list-valued datasets are not included in the snapshot.
+        self.experiment.variables = variables_snapshot.keys()
 
         # we don't want to try to add long lists as experiment attributes. this can result in timeout exceptions.
         exclude_keywords = ['history']# for autogenerated datasets so we don't have to remember to add variables later
+        # the values are got from the master rather than the snapshot, since the snapshot is only as new as the last
+        # time the master saved dataset_db.pyon
         setattr_variables(self.experiment, exclude_list=[], exclude_keywords=exclude_keywords)
+        if self.simulated:
+            # the gateware the sim node mimics, so that the experiment functions take its branches. the sim feedback
+            # channels are passed to the AOMPowerStabilizer with config_dir
+            self.experiment.which_node = self.node
 
         self.experiment.counts = 0
         self.experiment.counts2 = 0
@@ -129,8 +148,7 @@ class BaseExperiment:
                                 *[f"ttl{i}_counter" for i in range(4)],  # ttl card 0 edge counters
                                 *[f"ttl{i}_counter" for i in range(8, 12)]]  # ttl card 1 edge counters
 
-            for dev in devices_no_alias:
-                self.experiment.setattr_device(dev)
+            self.setattr_devices(devices_no_alias)
 
             # devices can also be nicknamed here:
             # todo: do this in the device_db
@@ -168,24 +186,6 @@ class BaseExperiment:
             self.experiment.scan_sequence1_dataset = "scan_sequence1"
             self.experiment.scan_sequence2_dataset = "scan_sequence2"
 
-            """
-            Note that the amplitudes below can be used for setting the urukul channels, but are kernel invariants.
-            If you are running the laser_stabilizer in your experiment, and you want to set one of the dds channels we
-            feedback to (i.e. it is in one of the dds_feedback_lists in ExperimentVariables), then you should use the
-            amplitude attribute of the feedback channel. See subroutines/aom_feedback.py for more details.
-            """
-
-            # converts RF power in dBm to amplitudes in V
-            self.experiment.ampl_FORT_loading = dB_to_V(self.experiment.p_FORT_loading) # used only for old experiments
-            self.experiment.ampl_cooling_DP_MOT = dB_to_V(self.experiment.p_cooling_DP_MOT)
-
-            # RF powers defined as fractions of the defaults - warning: the AOM response isn't linear like this
-            self.experiment.ampl_FORT_RO = self.experiment.ampl_FORT_loading * self.experiment.p_FORT_RO
-            self.experiment.ampl_FORT_PGC = self.experiment.ampl_FORT_loading * self.experiment.p_FORT_PGC
-            self.experiment.ampl_FORT_blowaway = self.experiment.ampl_FORT_loading * self.experiment.p_FORT_blowaway
-            self.experiment.ampl_FORT_OP = self.experiment.ampl_FORT_loading * self.experiment.p_FORT_OP
-            self.experiment.ampl_cooling_DP_RO = self.experiment.ampl_cooling_DP_MOT * self.experiment.p_cooling_DP_RO
-            self.experiment.ampl_cooling_DP_PGC = self.experiment.ampl_cooling_DP_MOT * self.experiment.p_cooling_DP_PGC
 
         elif self.node == "bob":
             # devices without nicknames. core should come first
@@ -198,8 +198,7 @@ class BaseExperiment:
                                 "sampler1", # for reading in volts in the coil tune experiment
                                 "sampler2",
                                 *[f"ttl{i}" for i in range(16)]] # todo: add edge_counters when gateware upgraded
-            for dev in devices_no_alias:
-                self.experiment.setattr_device(dev)
+            self.setattr_devices(devices_no_alias)
 
             # devices can also be nicknamed here:
             # todo: do this in the device_db
@@ -232,35 +231,6 @@ class BaseExperiment:
             self.experiment.scan_sequence1_dataset = "scan_sequence1"
             self.experiment.scan_sequence2_dataset = "scan_sequence2"
 
-            """
-            Note that the amplitudes below can be used for setting the urukul channels, but are kernel invariants.
-            If you are running the laser_stabilizer in your experiment, and you want to set one of the dds channels we
-            feedback to (i.e. it is in one of the dds_feedback_lists in ExperimentVariables), then you should use the
-            amplitude attribute of the feedback channel. See subroutines/aom_feedback.py for more details.
-            """
-
-            # converts RF power in dBm to amplitudes in V
-            self.experiment.ampl_FORT_loading = dB_to_V(self.experiment.p_FORT_loading)
-            self.experiment.ampl_cooling_DP_MOT = dB_to_V(self.experiment.p_cooling_DP_MOT)
-            self.experiment.ampl_D1_pumping_DP = dB_to_V(self.experiment.p_D1_pumping_DP)
-            self.experiment.ampl_pumping_repump = dB_to_V(self.experiment.p_pumping_repump)
-            self.experiment.ampl_D1_pumping_DP = dB_to_V(self.experiment.p_D1_pumping_DP)
-            self.experiment.ampl_excitation = dB_to_V(self.experiment.p_excitation)
-            self.experiment.ampl_microwaves = dB_to_V(self.experiment.p_microwaves)
-            self.experiment.ampl_AOM_A1 = dB_to_V(self.experiment.p_AOM_A1)
-            self.experiment.ampl_AOM_A2 = dB_to_V(self.experiment.p_AOM_A2)
-            self.experiment.ampl_AOM_A3 = dB_to_V(self.experiment.p_AOM_A3)
-            self.experiment.ampl_AOM_A4 = dB_to_V(self.experiment.p_AOM_A4)
-            self.experiment.ampl_AOM_A5 = dB_to_V(self.experiment.p_AOM_A5)
-            self.experiment.ampl_AOM_A6 = dB_to_V(self.experiment.p_AOM_A6)
-
-            # RF powers defined as fractions of the defaults, e.g. the ones we tune during the AOM feedback.
-            self.experiment.ampl_FORT_RO = self.experiment.ampl_FORT_loading * self.experiment.p_FORT_RO
-            self.experiment.ampl_FORT_PGC = self.experiment.ampl_FORT_loading * self.experiment.p_FORT_PGC
-            self.experiment.ampl_FORT_blowaway = self.experiment.ampl_FORT_loading * self.experiment.p_FORT_blowaway
-            self.experiment.ampl_FORT_OP = self.experiment.ampl_FORT_loading * self.experiment.p_FORT_OP
-            self.experiment.ampl_cooling_DP_RO = self.experiment.ampl_cooling_DP_MOT * self.experiment.p_cooling_DP_RO
-            self.experiment.ampl_cooling_DP_PGC = self.experiment.ampl_cooling_DP_MOT * self.experiment.p_cooling_DP_PGC
 
         elif self.node == "two_nodes":
             # devices without nicknames. core should come first
@@ -273,8 +243,7 @@ class BaseExperiment:
                                 "sampler1", # for reading in volts in the coil tune experiment
                                 "sampler2",
                                 *[f"ttl{i}" for i in range(16)]]
-            for dev in devices_no_alias:
-                self.experiment.setattr_device(dev)
+            self.setattr_devices(devices_no_alias)
 
             # devices can also be nicknamed here:
             self.experiment.ttl_microwave_switch = self.experiment.ttl4
@@ -305,38 +274,11 @@ class BaseExperiment:
             self.experiment.scan_sequence1_dataset = "scan_sequence1"
             self.experiment.scan_sequence2_dataset = "scan_sequence2"
 
-            """
-            Note that the amplitudes below can be used for setting the urukul channels, but are kernel invariants.
-            If you are running the laser_stabilizer in your experiment, and you want to set one of the dds channels we
-            feedback to (i.e. it is in one of the dds_feedback_lists in ExperimentVariables), then you should use the
-            amplitude attribute of the feedback channel. See subroutines/aom_feedback.py for more details.
-            """
-
-            # converts RF power in dBm to amplitudes in V
-            self.experiment.ampl_FORT_loading = dB_to_V(self.experiment.p_FORT_loading)
-            self.experiment.ampl_cooling_DP_MOT = dB_to_V(self.experiment.p_cooling_DP_MOT)
-            self.experiment.ampl_D1_pumping_DP = dB_to_V(self.experiment.p_D1_pumping_DP)
-            self.experiment.ampl_pumping_repump = dB_to_V(self.experiment.p_pumping_repump)
-            self.experiment.ampl_D1_pumping_DP = dB_to_V(self.experiment.p_D1_pumping_DP)
-            self.experiment.ampl_excitation = dB_to_V(self.experiment.p_excitation)
-            self.experiment.ampl_microwaves = dB_to_V(self.experiment.p_microwaves)
-            self.experiment.ampl_AOM_A1 = dB_to_V(self.experiment.p_AOM_A1)
-            self.experiment.ampl_AOM_A2 = dB_to_V(self.experiment.p_AOM_A2)
-            self.experiment.ampl_AOM_A3 = dB_to_V(self.experiment.p_AOM_A3)
-            self.experiment.ampl_AOM_A4 = dB_to_V(self.experiment.p_AOM_A4)
-            self.experiment.ampl_AOM_A5 = dB_to_V(self.experiment.p_AOM_A5)
-            self.experiment.ampl_AOM_A6 = dB_to_V(self.experiment.p_AOM_A6)
-
-            # RF powers defined as fractions of the defaults, e.g. the ones we tune during the AOM feedback.
-            self.experiment.ampl_FORT_RO = self.experiment.ampl_FORT_loading * self.experiment.p_FORT_RO
-            self.experiment.ampl_FORT_PGC = self.experiment.ampl_FORT_loading * self.experiment.p_FORT_PGC
-            self.experiment.ampl_FORT_blowaway = self.experiment.ampl_FORT_loading * self.experiment.p_FORT_blowaway
-            self.experiment.ampl_FORT_OP = self.experiment.ampl_FORT_loading * self.experiment.p_FORT_OP
-            self.experiment.ampl_cooling_DP_RO = self.experiment.ampl_cooling_DP_MOT * self.experiment.p_cooling_DP_RO
-            self.experiment.ampl_cooling_DP_PGC = self.experiment.ampl_cooling_DP_MOT * self.experiment.p_cooling_DP_PGC
         else:
             raise KeyError
 
+        self.compute_amplitudes()
+
         # functions
         @rpc(flags={"async"})
         def print_async(*x):
@@ -351,6 +293,10 @@ class BaseExperiment:
 
         self.experiment.write_results = write_results_wrapper
 
+        # write_results writes in the background by default, so call this at the end of run to make sure
+        # everything is on disk
+        self.experiment.finish_results = close_writers
+
         # THIS MUST COME LAST IN BASE.BUILD
         # get a list of all attributes of experiment up to this point. if base.build is called in your experiment
         # before any GUI arguments are defined, then this can be used to grab those later by taking a difference
@@ -358,6 +304,18 @@ class BaseExperiment:
         logging.debug("base build - done")
 
 
+    def setattr_devices(self, device_names):
+        """
+        setattr the devices, or on the sim node, set simulated devices in their place. the Urukul channels
+        are simulated here too, since DeviceAliases only setattrs the ones which have an alias.
+        """
+        if self.simulated:
+            urukul_channels = [f"urukul{card}_ch{channel}" for card in range(3) for channel in range(4)]
+            sim_devices.attach(self.experiment, device_names + urukul_channels, self.config_dir)
+        else:
+            for dev in device_names:
+                self.experiment.setattr_device(dev)
+
     def set_datasets_from_gui_args(self):
         """
         This should be called at the end of your experiment's build method to archive the GUI arguments.
@@ -399,221 +357,279 @@ class BaseExperiment:
         # exclude_keywords = ['history']  # for autogenerated datasets so we don't have to remember to add variables later
         # setattr_variables(self.experiment, exclude_list=[], exclude_keywords=exclude_keywords)
 
-        if self.node == "alice":
-            # initialize named channels.
-            self.experiment.named_devices = DeviceAliases(
-                experiment=self.experiment,
-                device_aliases=[
-                    'dds_FORT',
-                    'dds_D1_pumping_DP',
-                    'dds_cooling_DP',
-                    'dds_pumping_repump',
-                    'dds_excitation',
-                    'dds_microwaves',
-                    *[f'dds_AOM_A{i + 1}' for i in range(6)]  # the fiber AOMs
-                ]
-            )
-
-            # this is an attribute of of the experiment in case we want to access it elsewhere
-            self.experiment.all_dds_channels = [getattr(self.experiment, f'urukul{card}_ch{channel}')
-                                                for card in range(3) for channel in range(4)]
-
-            # convert times to machine units
-            seconds_to_mu = self.experiment.core.seconds_to_mu
-            self.experiment.t_MOT_loading_mu = seconds_to_mu(self.experiment.t_MOT_loading)
-            self.experiment.t_FORT_loading_mu = seconds_to_mu(self.experiment.t_FORT_loading)
-            self.experiment.t_SPCM_exposure_mu = seconds_to_mu(self.experiment.t_SPCM_exposure)
-
-            # mainly for cost functions
-            try:
-                self.experiment.counts_list = [0] * self.experiment.n_measurements
-                self.experiment.counts2_list = [0] * self.experiment.n_measurements
-            except:
-                # if this fails, your experiment probably didn't need it
-                self.experiment.print_async("experiment does not have variable n_measurements")
-                # logging.warn("experiment does not have variable n_measurements")
-
-            slow_feedback_dds_list = eval(self.experiment.slow_feedback_dds_list)
-            fast_feedback_dds_list = eval(self.experiment.fast_feedback_dds_list)
-
-            # could implement this but it isn't needed right now
-            # self.experiment.slow_laser_stabilizer = AOMPowerStabilizer(experiment=self.experiment,
-            #                                                       dds_names=slow_feedback_dds_list,
-            #                                                       iterations=self.experiment.aom_feedback_iterations,
-            #                                                       averages=self.experiment.aom_feedback_averages,
-            #                                                       leave_AOMs_on=True)
-
-            # feedback channels which are fast enough to include on every atom loading attempt.
-            # this excludes things which use fW detectors which have slow rise time.
-            self.experiment.laser_stabilizer = AOMPowerStabilizer(experiment=self.experiment,
-                                                                  dds_names=fast_feedback_dds_list,
-                                                                  iterations=self.experiment.aom_feedback_iterations,
-                                                                  averages=self.experiment.aom_feedback_averages,
-                                                                  leave_AOMs_on=False,
-                                                                  leave_MOT_AOMs_on=True)
-
-            self.experiment.set_dataset("feedbackchannels",
-                             [ch.dB_dataset for ch in self.experiment.laser_stabilizer.all_channels],
-                             broadcast=True, persist=True)
-
-            self.experiment.initial_RF_dB_values = np.zeros(len(fast_feedback_dds_list))
-            for ch_i, ch in enumerate(self.experiment.laser_stabilizer.all_channels):
-                self.experiment.initial_RF_dB_values[ch_i] = self.experiment.get_dataset(ch.dB_dataset, archive=False)
-                try:
-                    # self.experiment.get_dataset(self.experiment.laser_stabilizer.all_channels[ch_i].dB_history_dataset,
-                    #                             archive=False)
-                    self.experiment.append_to_dataset(
-                        self.experiment.laser_stabilizer.all_channels[ch_i].dB_history_dataset,
-                        float(self.experiment.initial_RF_dB_values[ch_i]))
-
-                except KeyError:
-                    self.experiment.set_dataset(self.experiment.laser_stabilizer.all_channels[ch_i].dB_history_dataset,
-                                     [float(self.experiment.initial_RF_dB_values[ch_i])], broadcast=True)
-        elif self.node == "bob":
-            # initialize named channels.
-            self.experiment.named_devices = DeviceAliases(
-                experiment=self.experiment,
-                device_aliases=[
-                    'dds_FORT',
-                    'dds_D1_pumping_DP',
-                    'dds_cooling_DP',
-                    'dds_pumping_repump',
-                    'dds_excitation',
-                    'dds_microwaves',
-                    *[f'dds_AOM_A{i + 1}' for i in range(6)]  # the fiber AOMs
-                ]
-            )
-
-            # this is an attribute of of the experiment in case we want to access it elsewhere
-            self.experiment.all_dds_channels = [getattr(self.experiment, f'urukul{card}_ch{channel}')
-                                                for card in range(3) for channel in range(4)]
-
-            # convert times to machine units
-            seconds_to_mu = self.experiment.core.seconds_to_mu
-            self.experiment.t_MOT_loading_mu = seconds_to_mu(self.experiment.t_MOT_loading)
-            self.experiment.t_FORT_loading_mu = seconds_to_mu(self.experiment.t_FORT_loading)
-            self.experiment.t_SPCM_exposure_mu = seconds_to_mu(self.experiment.t_SPCM_exposure)
-
-            # mainly for cost functions
-            try:
-                self.experiment.counts_list = [0] * self.experiment.n_measurements
-                self.experiment.counts2_list = [0] * self.experiment.n_measurements
-            except:
-                # if this fails, your experiment probably didn't need it
-                self.experiment.print_async("experiment does not have variable n_measurements")
-                # logging.warn("experiment does not have variable n_measurements")
-
-            slow_feedback_dds_list = eval(self.experiment.slow_feedback_dds_list)
-            fast_feedback_dds_list = eval(self.experiment.fast_feedback_dds_list)
-
-            # could implement this but it isn't needed right now
-            # self.experiment.slow_laser_stabilizer = AOMPowerStabilizer(experiment=self.experiment,
-            #                                                       dds_names=slow_feedback_dds_list,
-            #                                                       iterations=self.experiment.aom_feedback_iterations,
-            #                                                       averages=self.experiment.aom_feedback_averages,
-            #                                                       leave_AOMs_on=True)
-
-            # feedback channels which are fast enough to include on every atom loading attempt.
-            # this excludes things which use fW detectors which have slow rise time.
-            self.experiment.laser_stabilizer = AOMPowerStabilizer(experiment=self.experiment,
-                                                                  dds_names=fast_feedback_dds_list,
-                                                                  iterations=self.experiment.aom_feedback_iterations,
-                                                                  averages=self.experiment.aom_feedback_averages,
-                                                                  leave_AOMs_on=False,
-                                                                  leave_MOT_AOMs_on=True)
-
-            self.experiment.set_dataset("feedbackchannels",
-                                        [ch.dB_dataset for ch in self.experiment.laser_stabilizer.all_channels],
-                                        broadcast=True, persist=True)
-
-            self.experiment.initial_RF_dB_values = np.zeros(len(fast_feedback_dds_list))
-            for ch_i, ch in enumerate(self.experiment.laser_stabilizer.all_channels):
-                self.experiment.initial_RF_dB_values[ch_i] = self.experiment.get_dataset(ch.dB_dataset, archive=False)
-                try:
-                    # self.experiment.get_dataset(self.experiment.laser_stabilizer.all_channels[ch_i].dB_history_dataset,
-                    #                             archive=False)
-                    self.experiment.append_to_dataset(
-                        self.experiment.laser_stabilizer.all_channels[ch_i].dB_history_dataset,
-                        float(self.experiment.initial_RF_dB_values[ch_i]))
-
-                except KeyError:
-                    self.experiment.set_dataset(self.experiment.laser_stabilizer.all_channels[ch_i].dB_history_dataset,
-                                                [float(self.experiment.initial_RF_dB_values[ch_i])], broadcast=True)
-        elif self.node == "two_nodes":
-            # initialize named channels.
-            self.experiment.named_devices = DeviceAliases(
-                experiment=self.experiment,
-                device_aliases=[
-                    'dds_FORT',
-                    'dds_D1_pumping_DP',
-                    'dds_cooling_DP',
-                    'dds_pumping_repump',
-                    'dds_excitation',
-                    'dds_microwaves',
-                    *[f'dds_AOM_A{i + 1}' for i in range(6)]  # the fiber AOMs
-                ]
-            )
-
-            # this is an attribute of of the experiment in case we want to access it elsewhere
-            self.experiment.all_dds_channels = [getattr(self.experiment, f'urukul{card}_ch{channel}')
-                                                for card in range(3) for channel in range(4)]
-
-            # convert times to machine units
-            seconds_to_mu = self.experiment.core.seconds_to_mu
-            self.experiment.t_MOT_loading_mu = seconds_to_mu(self.experiment.t_MOT_loading)
-            self.experiment.t_FORT_loading_mu = seconds_to_mu(self.experiment.t_FORT_loading)
-            self.experiment.t_SPCM_exposure_mu = seconds_to_mu(self.experiment.t_SPCM_exposure)
-
-            # mainly for cost functions
-            try:
-                self.experiment.counts_list = [0] * self.experiment.n_measurements
-                self.experiment.counts2_list = [0] * self.experiment.n_measurements
-            except:
-                # if this fails, your experiment probably didn't need it
-                self.experiment.print_async("experiment does not have variable n_measurements")
-                # logging.warn("experiment does not have variable n_measurements")
-
-            slow_feedback_dds_list = eval(self.experiment.slow_feedback_dds_list)
-            fast_feedback_dds_list = eval(self.experiment.fast_feedback_dds_list)
-
-            # could implement this but it isn't needed right now
-            # self.experiment.slow_laser_stabilizer = AOMPowerStabilizer(experiment=self.experiment,
-            #                                                       dds_names=slow_feedback_dds_list,
-            #                                                       iterations=self.experiment.aom_feedback_iterations,
-            #                                                       averages=self.experiment.aom_feedback_averages,
-            #                                                       leave_AOMs_on=True)
-
-            # feedback channels which are fast enough to include on every atom loading attempt.
-            # this excludes things which use fW detectors which have slow rise time.
-            self.experiment.laser_stabilizer = AOMPowerStabilizer(experiment=self.experiment,
-                                                                  dds_names=fast_feedback_dds_list,
-                                                                  iterations=self.experiment.aom_feedback_iterations,
-                                                                  averages=self.experiment.aom_feedback_averages,
-                                                                  leave_AOMs_on=False,
-                                                                  leave_MOT_AOMs_on=True)
-
-            self.experiment.set_dataset("feedbackchannels",
-                                        [ch.dB_dataset for ch in self.experiment.laser_stabilizer.all_channels],
-                                        broadcast=True, persist=True)
-
-            self.experiment.initial_RF_dB_values = np.zeros(len(fast_feedback_dds_list))
-            for ch_i, ch in enumerate(self.experiment.laser_stabilizer.all_channels):
-                self.experiment.initial_RF_dB_values[ch_i] = self.experiment.get_dataset(ch.dB_dataset, archive=False)
-                try:
-                    # self.experiment.get_dataset(self.experiment.laser_stabilizer.all_channels[ch_i].dB_history_dataset,
-                    #                             archive=False)
-                    self.experiment.append_to_dataset(
-                        self.experiment.laser_stabilizer.all_channels[ch_i].dB_history_dataset,
-                        float(self.experiment.initial_RF_dB_values[ch_i]))
-
-                except KeyError:
-                    self.experiment.set_dataset(self.experiment.laser_stabilizer.all_channels[ch_i].dB_history_dataset,
-                                                [float(self.experiment.initial_RF_dB_values[ch_i])], broadcast=True)
-        else:
+        if self.node not in ["alice", "bob", "two_nodes"]:
             raise KeyError
 
+        self.initialize_named_devices()
+        self.compute_amplitudes()
+        self.convert_times_to_mu()
+        self.initialize_counts_lists()
+        self.initialize_shot_buffers()
+        self.initialize_excitation_buffers()
+        self.initialize_laser_stabilizer()
+        self.initialize_rtio_profiler()
+        self.initialize_dma_sequences()
+        self.initialize_interleaver()
+        self.initialize_early_stopping()
+
+        # which variables each of the things initialized above depend on, so that prepare_incremental can
+        # redo only the parts affected by a change, e.g. from one step of a GeneralVariableScan to the next
+        self.dependencies = {
+            'named_devices': set(name for dds in self.experiment.named_devices.dds_names_aliases
+                                 for name in self.experiment.dds_defaults[dds[0]].values()),
+            'amplitudes': self.amplitude_dependencies(),
+            'times_mu': set(self.times_to_convert),
+            'counts_lists': {'n_measurements'},
+            'shot_buffers': {'n_shots_per_dataset_flush'},
+            'excitation_buffers': {'n_excitation_cycles', 'n_excitation_attempts', 'n_excitation_cycles_per_readout'},
+            'laser_stabilizer': self.laser_stabilizer_dependencies(),
+            'rtio_profiler': {'enable_rtio_profiler'}
+        }
+
+        if self.simulated:
+            # e.g. the laser stabilizer, so its kernels can also be called from the host
+            self.experiment.core.embed(self.experiment)
+
         logging.debug("base prepare - done")
 
+    def prepare_incremental(self, changed_variables) -> bool:
+        """
+        Redo only the parts of prepare which depend on the variables that have changed since the last call to
+        prepare or prepare_incremental.
+
+        This is much faster than calling prepare again when, e.g., only t_blowaway changed from one step of a
+        GeneralVariableScan to the next, since we don't have to re-instantiate the AOMPowerStabilizer and its
+        FeedbackChannels. Variables which are not in any of the sets in self.dependencies are used directly by the
+        kernel, so setting the attribute is all that is needed for them.
+
+        :param changed_variables: iterable of the names of the variables which have changed
+        :return: True if the hardware needs to be re-initialized with initialize_hardware, else False
+        """
+
+        # prepare has not been called yet, so everything needs to be initialized
+        if not hasattr(self, 'dependencies'):
+            self.prepare()
+            return True
+
+        changed = set(changed_variables)
+        needs_hardware_init = False
+
+        if changed & self.dependencies['named_devices']:
+            # the DDS defaults are programmed in initialize_hardware
+            self.initialize_named_devices()
+            needs_hardware_init = True
+        if changed & self.dependencies['amplitudes']:
+            self.compute_amplitudes()
+        if changed & self.dependencies['times_mu']:
+            self.convert_times_to_mu()
+        if changed & self.dependencies['counts_lists']:
+            self.initialize_counts_lists()
+        if changed & self.dependencies['shot_buffers']:
+            self.initialize_shot_buffers()
+        if changed & self.dependencies['excitation_buffers']:
+            self.initialize_excitation_buffers()
+        if changed & self.dependencies['laser_stabilizer']:
+            self.initialize_laser_stabilizer()
+            # the feedback channels may have changed, e.g. if we scanned fast_feedback_dds_list
+            self.dependencies['laser_stabilizer'] = self.laser_stabilizer_dependencies()
+        if changed & self.dependencies['rtio_profiler']:
+            self.initialize_rtio_profiler()
+
+        logging.debug(f"base prepare_incremental - done. changed: {changed}, hardware init: {needs_hardware_init}")
+        return needs_hardware_init
+
+    def initialize_named_devices(self):
+        """
+        initialize named channels, e.g. dds_FORT, and the default settings for the dds channels
+        """
+        self.experiment.named_devices = DeviceAliases(
+            experiment=self.experiment,
+            device_aliases=[
+                'dds_FORT',
+                'dds_D1_pumping_DP',
+                'dds_cooling_DP',
+                'dds_pumping_repump',
+                'dds_excitation',
+                'dds_microwaves',
+                *[f'dds_AOM_A{i + 1}' for i in range(6)]  # the fiber AOMs
+            ]
+        )
+
+        # this is an attribute of of the experiment in case we want to access it elsewhere
+        self.experiment.all_dds_channels = [getattr(self.experiment, f'urukul{card}_ch{channel}')
+                                            for card in range(3) for channel in range(4)]
+
+    def amplitude_definitions(self):
+        """
+        the DDS amplitudes which are computed from the RF powers defined in ExperimentVariables
+
+        :return: (absolute, fractional), where absolute is a list of (amplitude name, power in dBm name) and
+            fractional is a list of (amplitude name, reference amplitude name, fraction name)
+        """
+        absolute = [('ampl_FORT_loading', 'p_FORT_loading'),
+                    ('ampl_cooling_DP_MOT', 'p_cooling_DP_MOT')]
+        if self.node != "alice":
+            absolute += [('ampl_D1_pumping_DP', 'p_D1_pumping_DP'),
+                         ('ampl_pumping_repump', 'p_pumping_repump'),
+                         ('ampl_excitation', 'p_excitation'),
+                         ('ampl_microwaves', 'p_microwaves'),
+                         *[(f'ampl_AOM_A{i + 1}', f'p_AOM_A{i + 1}') for i in range(6)]]
+
+        # RF powers defined as fractions of the defaults - warning: the AOM response isn't linear like this
+        fractional = [('ampl_FORT_RO', 'ampl_FORT_loading', 'p_FORT_RO'),
+                      ('ampl_FORT_PGC', 'ampl_FORT_loading', 'p_FORT_PGC'),
+                      ('ampl_FORT_blowaway', 'ampl_FORT_loading', 'p_FORT_blowaway'),
+                      ('ampl_FORT_OP', 'ampl_FORT_loading', 'p_FORT_OP'),
+                      ('ampl_cooling_DP_RO', 'ampl_cooling_DP_MOT', 'p_cooling_DP_RO'),
+                      ('ampl_cooling_DP_PGC', 'ampl_cooling_DP_MOT', 'p_cooling_DP_PGC')]
+
+        return absolute, fractional
+
+    def amplitude_dependencies(self):
+        """the names of the variables used in compute_amplitudes"""
+        absolute, fractional = self.amplitude_definitions()
+        return set(p for _, p in absolute) | set(p for _, _, p in fractional)
+
+    def compute_amplitudes(self):
+        """
+        converts RF powers in dBm to amplitudes in V
+
+        Note that the amplitudes below can be used for setting the urukul channels, but are kernel invariants.
+        If you are running the laser_stabilizer in your experiment, and you want to set one of the dds channels we
+        feedback to (i.e. it is in one of the dds_feedback_lists in ExperimentVariables), then you should use the
+        amplitude attribute of the feedback channel. See subroutines/aom_feedback.py for more details.
+        """
+        absolute, fractional = self.amplitude_definitions()
+        for ampl_name, p_name in absolute:
+            setattr(self.experiment, ampl_name, dB_to_V(getattr(self.experiment, p_name)))
+        for ampl_name, ref_name, p_name in fractional:
+            setattr(self.experiment, ampl_name,
+                    getattr(self.experiment, ref_name) * getattr(self.experiment, p_name))
+
+    def convert_times_to_mu(self):
+        """convert times to machine units"""
+        seconds_to_mu = self.experiment.core.seconds_to_mu
+        for name in self.times_to_convert:
+            setattr(self.experiment, name + '_mu', seconds_to_mu(getattr(self.experiment, name)))
+
+    def initialize_counts_lists(self):
+        """mainly for cost functions"""
+        try:
+            self.experiment.counts_list = [0] * self.experiment.n_measurements
+            self.experiment.counts2_list = [0] * self.experiment.n_measurements
+        except:
+            # if this fails, your experiment probably didn't need it
+            self.experiment.print_async("experiment does not have variable n_measurements")
+            # logging.warn("experiment does not have variable n_measurements")
+
+    def initialize_shot_buffers(self):
+        """
+        kernel-side buffers for the per-shot results which end_measurement sends to the datasets in batches.
+        see flush_shot_buffer in subroutines/experiment_functions.py
+        """
+        n = max(int(self.experiment.n_shots_per_dataset_flush), 1)
+        self.experiment.shot_buffer_size = n
+        self.experiment.shot_buffer_index = 0
+        self.experiment.shot_buffer_counts = [0] * n
+        self.experiment.shot_buffer_counts2 = [0] * n
+        self.experiment.shot_buffer_counts_FORT_science = [0] * n
+        self.experiment.shot_buffer_FORT_MM_volts = [0.0] * n
+        self.experiment.shot_buffer_advance = [0] * n
+
+    def initialize_excitation_buffers(self):
+        """
+        kernel-side buffers for binning the SPCM clicks in single_photon_experiment by excitation cycle and attempt.
+        see read_excitation_clicks in subroutines/experiment_functions.py
+        """
+        n_cycles = max(int(self.experiment.n_excitation_cycles), 1)
+        n_attempts = max(int(self.experiment.n_excitation_attempts), 1)
+        self.experiment.excitation_cycle_start_mu = np.zeros(n_cycles, dtype=np.int64)
+        self.experiment.excitation_cycle_counts = [0] * n_cycles
+        self.experiment.excitation_attempt_counts = [0] * n_attempts
+        self.experiment.excitation_cycle_index = 0
+        # the clicks are read out every this many cycles, so it can't be 0
+        self.experiment.n_excitation_cycles_per_readout = max(int(self.experiment.n_excitation_cycles_per_readout), 1)
+
+    def initialize_rtio_profiler(self):
+        """
+        the profiler for the phases of a shot in subroutines/experiment_functions.py. see utilities/rtio_profiler.py
+        """
+        self.experiment.rtio_profiler = RTIOProfiler(self.experiment,
+                                                     phases=["MOT_loading", "first_shot", "optical_pumping",
+                                                             "excitation", "second_shot", "end_measurement"],
+                                                     enabled=self.experiment.enable_rtio_profiler)
+
+    def initialize_dma_sequences(self):
+        """
+        the DMA sequences for the parts of a shot which only depend on the ExperimentVariables. they are recorded
+        on the kernel, and again whenever a variable they depend on changes. see utilities/dma_registry.py
+        """
+        self.experiment.dma_sequences = DMASequenceRegistry(self.experiment, DMA_SEQUENCES)
+
+    def initialize_interleaver(self):
+        """
+        a disabled ParameterInterleaver, since end_measurement calls it. experiments which interleave parameter sets,
+        e.g. GeneralVariableOptimizer, replace it. see utilities/parameter_interleaver.py
+        """
+        self.experiment.interleaver = ParameterInterleaver(self.experiment, variables=[])
+
+    def initialize_early_stopping(self):
+        """
+        a disabled EarlyStopping, since end_measurement calls it. experiments which stop the measurement loop
+        early, e.g. GeneralVariableOptimizer, replace it. see utilities/early_stopping.py
+        """
+        self.experiment.early_stopping = EarlyStopping(self.experiment)
+
+    def laser_stabilizer_dependencies(self):
+        """the names of the variables used to instantiate the laser_stabilizer and its feedback channels"""
+        return self.experiment.laser_stabilizer.dependencies | {'aom_feedback_iterations', 'aom_feedback_averages',
+                                                                'aom_feedback_adaptive', 'aom_feedback_max_interval',
+                                                                'aom_feedback_drift_safety_factor',
+                                                                'aom_feedback_use_power_curve',
+                                                                'aom_feedback_setpoint_lifetime',
+                                                                'slow_feedback_dds_list', 'fast_feedback_dds_list'}
+
+    def initialize_laser_stabilizer(self):
+        """
+        instantiate the AOMPowerStabilizer and record the initial dds powers of its feedback channels
+        """
+        slow_feedback_dds_list = eval(self.experiment.slow_feedback_dds_list)
+        fast_feedback_dds_list = eval(self.experiment.fast_feedback_dds_list)
+
+        # could implement this but it isn't needed right now
+        # self.experiment.slow_laser_stabilizer = AOMPowerStabilizer(experiment=self.experiment,
+        #                                                       dds_names=slow_feedback_dds_list,
+        #                                                       iterations=self.experiment.aom_feedback_iterations,
+        #                                                       averages=self.experiment.aom_feedback_averages,
+        #                                                       leave_AOMs_on=True)
+
+        # feedback channels which are fast enough to include on every atom loading attempt.
+        # this excludes things which use fW detectors which have slow rise time.
+        self.experiment.laser_stabilizer = AOMPowerStabilizer(experiment=self.experiment,
+                                                              dds_names=fast_feedback_dds_list,
+                                                              iterations=self.experiment.aom_feedback_iterations,
+                                                              averages=self.experiment.aom_feedback_averages,
+                                                              leave_AOMs_on=False,
+                                                              leave_MOT_AOMs_on=True,
+                                                              adaptive=self.experiment.aom_feedback_adaptive,
+                                                              max_interval=self.experiment.aom_feedback_max_interval,
+                                                              drift_safety_factor=
+                                                              self.experiment.aom_feedback_drift_safety_factor,
+                                                              use_power_curve=
+                                                              self.experiment.aom_feedback_use_power_curve,
+                                                              setpoint_lifetime=
+                                                              self.experiment.aom_feedback_setpoint_lifetime,
+                                                              config_dir=self.config_dir)
+
+        self.experiment.set_dataset("feedbackchannels",
+                                    [ch.dB_dataset for ch in self.experiment.laser_stabilizer.all_channels],
+                                    broadcast=True, persist=True)
+
+        self.experiment.initial_RF_dB_values = np.zeros(len(fast_feedback_dds_list))
+        for ch_i, ch in enumerate(self.experiment.laser_stabilizer.all_channels):
+            self.experiment.initial_RF_dB_values[ch_i] = self.experiment.get_dataset(ch.dB_dataset, archive=False)
+            ch.dB_history.append(float(self.experiment.initial_RF_dB_values[ch_i]))
+
     def initialize_datasets(self):
         """
         Initialize datasets which are common to many experiments
@@ -627,6 +643,7 @@ class BaseExperiment:
         self.experiment.set_dataset("photocounts_FORT_science", [0.0], broadcast=True)
         self.experiment.set_dataset("FORT_MM_science_volts", [0.0], broadcast=True)
         self.experiment.set_dataset("excitation_counts", [0], broadcast=True)
+        self.experiment.set_dataset("excitation_attempt_counts", [0], broadcast=True)
 
     @kernel
     def initialize_hardware(self, turn_off_dds_channels=True, turn_off_zotinos=True):
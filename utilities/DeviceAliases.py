@@ -25,8 +25,9 @@ class DeviceAliases:
 
                     # setattr for the device, using the device name from device_db.py.
                     # not self.experiment because we are adding the device to the
-                    # experiment we passed by reference.
-                    experiment.setattr_device(dev_name)
+                    # experiment we passed by reference. the simulated devices are already set by BaseExperiment.
+                    if not hasattr(experiment, dev_name):
+                        experiment.setattr_device(dev_name)
 
                     # make an attribute named alias which points to the device object, e.g.
                     # dev_ref = gettattr(experiment, "urukul0_ch0")
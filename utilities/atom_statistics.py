@@ -0,0 +1,108 @@
+"""
+Single atom statistics from the readout photocounts, computed with numpy on whole arrays of shots.
+
+The cost functions and the applets used to classify the shots one at a time in list comprehensions, which gets slow
+for optimizer runs with thousands of shots and for applets which redo it every time a dataset changes. These
+functions take lists or arrays of counts and return the same numbers as the old loops. See
+tests/AtomStatisticsBenchmark.py for a comparison.
+
+intended usage:
+----
+from utilities.atom_statistics import loading, retention, otsu_threshold
+
+threshold = otsu_threshold(self.counts_list, self.single_atom_counts_threshold)
+n_atoms_loaded, n_shots = loading(self.counts_list, threshold)
+n_atoms_retained, n_atoms_loaded = retention(self.counts_list, self.counts2_list, threshold,
+                                             self.single_atom_counts2_threshold)
+----
+"""
+
+import numpy as np
+from skimage.filters import threshold_otsu
+
+
+def atoms_present(counts, threshold) -> np.ndarray:
+    """a boolean array of whether each shot has an atom, i.e. its counts are above the threshold"""
+    return np.asarray(counts) > threshold
+
+
+def loading(counts, threshold):
+    """
+    :param counts: the first readout counts of each shot
+    :param threshold: the atom counts threshold
+    :return: (n_atoms_loaded, n_shots)
+    """
+    return int(np.count_nonzero(atoms_present(counts, threshold))), len(counts)
+
+
+def retention(counts, counts2, threshold, threshold2):
+    """
+    :param counts: the first readout counts of each shot
+    :param counts2: the second readout counts of each shot
+    :param threshold: the atom counts threshold for the first readout
+    :param threshold2: the atom counts threshold for the second readout
+    :return: (n_atoms_retained, n_atoms_loaded), where an atom is retained if it is in both readouts
+    """
+    loaded = atoms_present(counts, threshold)
+    n = min(len(loaded), len(counts2))
+    retained = loaded[:n] & atoms_present(counts2[:n], threshold2)
+    return int(np.count_nonzero(retained)), int(np.count_nonzero(loaded))
+
+
+def loading_events(counts, threshold) -> int:
+    """
+    the number of atoms which were loaded into a continuously loaded trap, i.e. the number of runs of consecutive
+    shots with the counts above the threshold
+
+    :param counts: the counts of each exposure, in order
+    :param threshold: the atom counts threshold
+    :return: the number of atoms loaded
+    """
+    present = atoms_present(counts, threshold)
+    if len(present) == 0:
+        return 0
+    # each atom starts with a rising edge, unless it was already there in the first exposure
+    return int(np.count_nonzero(present[1:] & ~present[:-1]) + present[0])
+
+
+def otsu_threshold(counts, threshold, min_fraction=0.3):
+    """
+    the Otsu threshold of the counts, if the fraction of them above threshold is greater than min_fraction, and
+    threshold otherwise.
+
+    Otsu's method will always find a cut-off, even if no atoms were loaded, in which case it would bisect the
+    background mode, so it is only used when there are clearly counts from atoms.
+
+    :param counts: the readout counts of each shot
+    :param threshold: the fixed atom counts threshold
+    :param min_fraction: the least fraction of counts above threshold for the Otsu threshold to be used
+    :return: the threshold to use
+    """
+    counts = np.asarray(counts)
+    if len(counts) > 0 and np.count_nonzero(counts > threshold) / len(counts) > min_fraction:
+        return threshold_otsu(counts)
+    return threshold
+
+
+def fraction_uncertainty(k, n):
+    """
+    the standard deviation of the fraction of successes, e.g. atoms retained, after k successes in n trials.
+
+    this is the standard deviation of the Beta(k+1, n-k+1) posterior for a uniform prior, which unlike
+    sqrt(p(1-p)/n) isn't 0 when all or none of the trials succeed, or when there are no trials.
+    """
+    p = (k + 1) / (n + 2)
+    return np.sqrt(p * (1 - p) / (n + 3))
+
+
+def threshold_uncertainty(counts, threshold, otsu_cutoff):
+    """
+    the uncertainty in the fraction of counts above a threshold from the choice of threshold.
+
+    the shots with counts between the fixed threshold and the Otsu threshold could be classified either way,
+    so half of them, as a fraction of all of the shots, is taken as the uncertainty.
+    """
+    counts = np.asarray(counts)
+    low, high = min(threshold, otsu_cutoff), max(threshold, otsu_cutoff)
+    n_between = np.count_nonzero((counts > low) & (counts <= high))
+    return 0.5 * n_between / max(len(counts), 1)
@@ -0,0 +1,137 @@
+"""
+A dataset which keeps a bounded history of values, e.g. the dB_history and monitor datasets of the
+FeedbackChannels in subroutines/aom_feedback.py.
+
+Appending to a dataset with append_to_dataset for a whole day of running ExperimentCycler results in very long
+lists, which get broadcast to every applet and make dataset_db.pyon slow to save and load. A BoundedHistory keeps
+the most recent n_recent values at full resolution in the dataset 'name', and once there are more than that,
+the oldest values are decimated in blocks of block_size values to (min, mean, max), which are kept in the dataset
+'name_decimated', up to max_blocks blocks, which is stored as a numpy array since pyon encodes that much more
+compactly than a list. 'name' is a list, so that each new value can be sent to the master with append_to_dataset,
+and the whole dataset is only rewritten when a block is decimated, i.e. once every block_size appends.
+
+Because 'name' is still a 1D array of the latest values, applets which plot it don't need to change.
+
+intended usage:
+----
+self.dB_history = BoundedHistory(experiment, "p_FORT_loading_history", persist=True)
+
+@kernel
+def run(self):
+    ...
+    self.dB_history.append(dB) # an async RPC, so this doesn't block the kernel
+----
+"""
+
+from artiq.experiment import *
+import logging
+import numpy as np
+
+
+class BoundedHistory:
+
+    def __init__(self, experiment, dataset, n_recent=1000, block_size=100, max_blocks=1000, persist=False,
+                 broadcast=True):
+        """
+        :param experiment: the experiment which owns the datasets
+        :param dataset: the name of the dataset for the recent values. the decimated values are stored in
+            dataset + "_decimated" as an array with shape (number of blocks, 3) of the (min, mean, max) of each block.
+        :param n_recent: the number of values to keep at full resolution
+        :param block_size: the number of values to decimate into each (min, mean, max) block
+        :param max_blocks: the maximum number of decimated blocks to keep
+        :param persist: whether the datasets should persist, like the dB history datasets
+        :param broadcast: whether the datasets should be broadcast to the applets
+        """
+        self.exp = experiment
+        self.dataset = dataset
+        self.decimated_dataset = dataset + "_decimated"
+        self.n_recent = n_recent
+        self.block_size = block_size
+        self.max_blocks = max_blocks
+        self.persist = persist
+        self.broadcast = broadcast
+
+        # the recent values. this has room for block_size values beyond n_recent, so we only decimate once
+        # every block_size appends
+        self.recent = np.zeros(n_recent + block_size)
+        self.n = 0
+        self.decimated = np.zeros((0, 3))
+
+    def load(self):
+        """
+        load the existing datasets, if there are any, e.g. so the history continues where the last experiment
+        left off. old datasets which were appended to as lists are decimated here.
+        """
+        try:
+            existing = np.asarray(self.exp.get_dataset(self.dataset, archive=False), dtype=float).ravel()
+        except (KeyError, ValueError, TypeError):
+            existing = np.zeros(0)
+        try:
+            decimated = np.asarray(self.exp.get_dataset(self.decimated_dataset, archive=False), dtype=float)
+            self.decimated = decimated.reshape(-1, 3)
+        except (KeyError, ValueError, TypeError):
+            self.decimated = np.zeros((0, 3))
+
+        # decimate everything but the most recent values in whole blocks
+        n_old = max(len(existing) - self.n_recent, 0)
+        n_fold = (n_old // self.block_size) * self.block_size
+        if n_fold > 0:
+            self._add_blocks(existing[:n_fold].reshape(-1, self.block_size))
+        self.n = len(existing) - n_fold
+        self.recent[:self.n] = existing[n_fold:]
+        self._write(decimated_changed=True)
+
+    def reset(self, values=[]):
+        """replace the history with values, e.g. at the start of an experiment"""
+        values = np.asarray(values, dtype=float).ravel()[-self.n_recent:]
+        self.n = len(values)
+        self.recent[:self.n] = values
+        self.decimated = np.zeros((0, 3))
+        self._write(decimated_changed=True)
+
+    def last(self) -> TFloat:
+        """the most recent value, or 0.0 if there is none"""
+        return float(self.recent[self.n - 1]) if self.n > 0 else 0.0
+
+    def values(self):
+        """the recent values at full resolution"""
+        return self.recent[:self.n].copy()
+
+    @rpc(flags={"async"})
+    def append(self, value: TFloat):
+        """
+        add a value to the history. this is an async RPC so it can be called from the kernel without blocking.
+        only the value is sent to the master, unless a block was decimated.
+        """
+        self.recent[self.n] = value
+        self.n += 1
+
+        if self.n == len(self.recent):
+            self._add_blocks(self.recent[:self.block_size].reshape(1, self.block_size))
+            self.recent[:self.n - self.block_size] = self.recent[self.block_size:self.n]
+            self.n -= self.block_size
+            self._write(decimated_changed=True)
+        else:
+            self._append(value)
+
+    def _add_blocks(self, blocks):
+        """decimate each row of blocks to (min, mean, max) and add them to the decimated history"""
+        new_blocks = np.stack([blocks.min(axis=1), blocks.mean(axis=1), blocks.max(axis=1)], axis=1)
+        self.decimated = np.concatenate([self.decimated, new_blocks])[-self.max_blocks:]
+
+    def _append(self, value):
+        try:
+            self.exp.append_to_dataset(self.dataset, float(value))
+        except Exception:
+            # e.g. the dataset hasn't been written yet, or was replaced by something we can't append to
+            self._write()
+
+    def _write(self, decimated_changed=False):
+        try:
+            self.exp.set_dataset(self.dataset, self.recent[:self.n].tolist(),
+                                 broadcast=self.broadcast, persist=self.persist)
+            if decimated_changed:
+                self.exp.set_dataset(self.decimated_dataset, self.decimated.copy(),
+                                     broadcast=self.broadcast, persist=self.persist)
+        except Exception as e:
+            logging.warning(f"could not update {self.dataset}: {e}")
@@ -0,0 +1,80 @@
+"""
+Cached loader for the persistent dataset database, dataset_db.pyon.
+
+BaseExperiment.build needs to know the names of all of the datasets created by ExperimentVariables so it can
+add them as attributes of the experiment. Reading these names used to mean eval'ing the whole pyon file on every
+build, including the very long list-valued datasets (e.g. the *_history datasets written by aom_feedback.py), which
+we never want as experiment attributes. The file is now decoded with sipyco's pyon decoder, and only the values
+which can be ExperimentVariables (numbers, bools, and strings) are kept in the snapshot. The snapshot is cached by
+the file's modification time and size, so re-builds in GeneralVariableScan, ExperimentCycler, etc. only pay for
+parsing when the file has actually changed on disk.
+
+intended usage:
+----
+from utilities.dataset_db import load_variables_snapshot
+
+snapshot = load_variables_snapshot(os.path.join(cwd, 'dataset_db.pyon'))
+snapshot['f_FORT'] # the value of f_FORT when the master last saved dataset_db.pyon
+----
+
+Note that the master only writes dataset_db.pyon periodically, so a dataset changed within the last few seconds may
+not be reflected in the snapshot yet.
+"""
+
+import logging
+import os
+from numbers import Number
+
+from sipyco import pyon
+
+# (path) -> ((st_mtime_ns, st_size), snapshot dict)
+_snapshot_cache = {}
+
+
+def is_variable_value(value) -> bool:
+    """
+    whether a dataset value could be an ExperimentVariable, i.e. a number, bool, or string.
+
+    lists and arrays are excluded, since these are auto-generated datasets such as the RF history or monitor
+    datasets, which can be very long and are not needed as experiment attributes.
+    """
+    return isinstance(value, (Number, str)) and not isinstance(value, complex)
+
+
+def load_variables_snapshot(path: str) -> dict:
+    """
+    Get a dictionary of {name: value} for all of the variable-like datasets in a pyon dataset database.
+
+    The parsed file is cached, and the cache is invalidated whenever the file's modification time or size changes.
+    The dictionary returned is a copy, so it is safe for the caller to modify it.
+
+    :param path: the path to dataset_db.pyon
+    :return: dict mapping dataset names to values for datasets which pass is_variable_value
+    """
+    stat = os.stat(path)
+    key = (stat.st_mtime_ns, stat.st_size)
+
+    cached = _snapshot_cache.get(path)
+    if cached is not None and cached[0] == key:
+        return dict(cached[1])
+
+    with open(path) as f:
+        datasets = pyon.decode(f.read())
+
+    # newer versions of the dataset db store each dataset as a dictionary with the value and metadata
+    snapshot = {}
+    for name, value in datasets.items():
+        if isinstance(value, dict) and "value" in value:
+            value = value["value"]
+        if is_variable_value(value):
+            snapshot[name] = value
+
+    logging.debug(f"loaded {len(snapshot)} of {len(datasets)} datasets from {path}")
+
+    _snapshot_cache[path] = (key, snapshot)
+    return dict(snapshot)
+
+
+def clear_cache():
+    """forget all cached snapshots, e.g. to force dataset_db.pyon to be parsed again"""
+    _snapshot_cache.clear()
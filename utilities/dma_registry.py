@@ -0,0 +1,286 @@
+"""
+A registry of the DMA sequences used by the experiment functions, e.g. the chopped optical pumping and the
+atom readouts.
+
+Emitting a sequence from the CPU costs about a microsecond of slack per event every time, whereas playing back a
+DMA recording costs a few microseconds total. Any part of a shot which only depends on the ExperimentVariables,
+and not on e.g. the laser feedback amplitudes, can therefore be recorded once and played back every shot.
+
+Each sequence is declared with the kernel function which emits its events (relative to now_mu), the variables
+it depends on, and optionally a variable which must be > 0 for the sequence to be used at all, e.g. t_pumping.
+The registry keeps a snapshot of the dependency values on the kernel from when each sequence was recorded, so if
+any of them change, e.g. from one step of a GeneralVariableScan to the next, even when the scan variables are
+set on the kernel, the sequence is recorded again the next time it is updated. The handles are cached on the
+kernel, so playing back doesn't look up the recording by name every shot.
+
+Experiment functions should call update before the measurement loop. If a sequence is stale when it is played
+back, it is recorded there, which takes a break_realtime and so shifts the rest of the shot, and a warning is
+logged, since that means a variable it depends on changed during the measurement loop or update wasn't called.
+
+A DMA recording can hold at most MAX_DMA_EVENTS events, and anything past that is silently dropped (see
+examples/dma_test.py), so each sequence also declares the number of events it emits, or an upper bound. Chopped
+sequences, i.e. a number of identical cycles with a fixed period, declare the number of events per cycle, the
+number of cycles, and the period. They are recorded as a block of as many cycles as fit, which is played back
+as many times as needed, plus a recording of the remaining cycles. Each playback is placed with at_mu at the
+start time of its first cycle, so the chained playbacks have exactly the timing of the full sequence. If a
+sequence, or one cycle of a chopped sequence, doesn't fit in a recording, recording it fails with an assertion
+error instead of being truncated.
+
+intended usage:
+----
+# in experiment_functions
+DMA_SEQUENCES = {
+    "first_shot": dict(emit=first_shot_sequence, dependencies=['t_SPCM_first_shot'], events=5),
+    # chopped_blow_away_sequence(self, n_cycles) emits n_cycles cycles, each starting t_BA_chop_period after
+    # the previous one, and chopped_blow_away_cycles(self) returns how many cycles the whole sequence has
+    "chopped_blow_away": dict(emit=chopped_blow_away_sequence, dependencies=['t_blowaway', 't_BA_chop_period'],
+                              condition='t_blowaway', events=2, cycles=chopped_blow_away_cycles,
+                              period='t_BA_chop_period')
+}
+
+# in prepare. BaseExperiment does this with experiment_functions.DMA_SEQUENCES
+self.dma_sequences = DMASequenceRegistry(self, DMA_SEQUENCES)
+
+@kernel
+def my_experiment(self):
+    self.core.reset()
+    self.dma_sequences.update() # record the sequences before the measurement loop so we don't lose slack later
+    ...
+    self.dma_sequences.first_shot.playback()
+----
+"""
+
+from artiq.experiment import *
+import logging
+import numpy as np
+from types import MethodType
+
+# the most events a DMA recording can hold
+MAX_DMA_EVENTS = 2**12
+
+
+class DMASequence:
+    """a sequence in the registry. use this to update or play it back on the kernel"""
+
+    def __init__(self, registry, index, name):
+        self.registry = registry
+        self.core = registry.core
+        self.index = index
+        self.name = name
+
+    @kernel
+    def update(self):
+        """record the sequence if it hasn't been recorded yet, or if any of its dependencies changed"""
+        if self.registry.is_stale(self.index):
+            self.registry.record(self.index)
+            self.core.break_realtime()
+
+    @kernel
+    def playback(self):
+        """
+        play back the sequence. if it is stale, it is recorded first, which moves the timeline with break_realtime,
+        so this logs a warning. call the registry's update before the measurement loop so that doesn't happen.
+        """
+        if self.registry.is_stale(self.index):
+            self.registry.warn_stale_playback(self.index)
+            self.registry.record(self.index)
+            self.core.break_realtime()
+        self.registry.playback(self.index)
+
+
+class DMASequenceRegistry:
+
+    def __init__(self, experiment, sequences):
+        """
+        :param experiment: the experiment, which the emit functions are called with
+        :param sequences: dict of {name: dict(emit, dependencies, events, condition=None, cycles=None, period=None)}
+            emit: a kernel function which takes the experiment and emits the events of the sequence. for a chopped
+                sequence, it also takes the number of cycles to emit.
+            dependencies: the names of the variables the sequence depends on
+            events: the number of events the sequence emits (per cycle, for a chopped sequence), or a kernel
+                function which takes the experiment and returns it. an upper bound is fine.
+            condition: the name of a variable which must be > 0 for update to record the sequence, or None
+            cycles: for a chopped sequence, a kernel function which takes the experiment and returns the number of
+                cycles in the whole sequence
+            period: for a chopped sequence, the name of the variable with the time between cycles in seconds
+            sequences with a dependency the experiment doesn't have are left out, with a warning.
+        """
+        self.exp = experiment
+        self.core = experiment.core
+        self.core_dma = experiment.core_dma
+
+        self.names = []
+        self.dependencies = []
+        self.specs = []
+        for name, spec in sequences.items():
+            dependencies = list(spec['dependencies'])
+            for key in ['condition', 'period']:
+                if spec.get(key):
+                    dependencies.append(spec[key])
+            missing = [var for var in dependencies if not hasattr(experiment, var)]
+            if missing:
+                logging.warning(f"DMA sequence {name} left out, since the experiment doesn't have {missing}")
+                continue
+            assert (spec.get('cycles') is None) == (spec.get('period') is None), \
+                f"DMA sequence {name} needs both cycles and period to be chopped"
+            setattr(self, "emit_" + name, spec['emit'])
+            if not isinstance(spec['events'], int):
+                setattr(self, "events_" + name, spec['events'])
+            if spec.get('cycles') is not None:
+                setattr(self, "cycles_" + name, spec['cycles'])
+            setattr(self, name, DMASequence(self, len(self.names), name))
+            self.names.append(name)
+            self.dependencies.append(dependencies)
+            self.specs.append(spec)
+        # the recordings of the cycles left over after the repeated blocks of the chopped sequences
+        self.remainder_names = [name + "_remainder" for name in self.names]
+
+        # where each sequence's dependency values start in the flat arrays below
+        self.offsets = [0]
+        for dependencies in self.dependencies:
+            self.offsets.append(self.offsets[-1] + len(dependencies))
+
+        n = max(len(self.names), 1)
+        self.recorded = [False] * n
+        self.recorded_values = np.zeros(max(self.offsets[-1], 1))
+        self.current_values = np.zeros(max(self.offsets[-1], 1))
+        self.handles = [(np.int32(0), np.int64(0), np.int32(0))] * n
+        self.remainder_handles = [(np.int32(0), np.int64(0), np.int32(0))] * n
+        self.block_cycles = [0] * n # the number of cycles in the recording which is played back repeatedly
+        self.n_blocks = [0] * n # the number of times it is played back
+        self.remainder_cycles = [0] * n
+        self.periods_mu = np.zeros(n, dtype=np.int64)
+        self.n_recordings = 0
+        self.n_stale_playbacks = 0 # host-side, see warn_stale_playback
+
+        # we can't getattr on the kernel, so the code which reads the dependencies and calls the emit functions is
+        # generated from the names
+        value_lines = []
+        enabled_lines = []
+        emit_lines = []
+        events_lines = []
+        cycles_lines = []
+        period_lines = []
+        for i, (name, spec) in enumerate(zip(self.names, self.specs)):
+            branch = "if" if i == 0 else "elif"
+            value_lines.append(f"{branch} index == {i}:")
+            value_lines += [f"    out[{self.offsets[i] + k}] = float(self.exp.{var})"
+                            for k, var in enumerate(self.dependencies[i])]
+            value_lines.append("    pass")
+            if spec.get('condition'):
+                enabled_lines.append(f"if index == {i}:")
+                enabled_lines.append(f"    return self.exp.{spec['condition']} > 0")
+            events_lines.append(f"if index == {i}:")
+            if isinstance(spec['events'], int):
+                events_lines.append(f"    return {spec['events']}")
+            else:
+                events_lines.append(f"    return self.events_{name}(self.exp)")
+            emit_lines.append(f"{branch} index == {i}:")
+            if spec.get('cycles') is not None:
+                emit_lines.append(f"    self.emit_{name}(self.exp, n_cycles)")
+                cycles_lines.append(f"if index == {i}:")
+                cycles_lines.append(f"    return self.cycles_{name}(self.exp)")
+                period_lines.append(f"if index == {i}:")
+                period_lines.append(f"    return self.core.seconds_to_mu(self.exp.{spec['period']})")
+            else:
+                emit_lines.append(f"    self.emit_{name}(self.exp)")
+        enabled_lines.append("return True")
+        events_lines.append("return 0")
+        cycles_lines.append("return 1")
+        period_lines.append("return self.core.seconds_to_mu(0.0)")
+
+        self.dependency_values = MethodType(kernel_from_string(["self", "index", "out"],
+                                                               "\n".join(value_lines) or "pass"), self)
+        self.enabled = MethodType(kernel_from_string(["self", "index"], "\n".join(enabled_lines)), self)
+        self.emit = MethodType(kernel_from_string(["self", "index", "n_cycles"],
+                                                  "\n".join(emit_lines) or "pass"), self)
+        self.events = MethodType(kernel_from_string(["self", "index"], "\n".join(events_lines)), self)
+        self.cycles = MethodType(kernel_from_string(["self", "index"], "\n".join(cycles_lines)), self)
+        self.period_mu = MethodType(kernel_from_string(["self", "index"], "\n".join(period_lines)), self)
+
+    @rpc(flags={"async"})
+    def warn_stale_playback(self, index: TInt32):
+        self.n_stale_playbacks += 1
+        logging.warning(f"DMA sequence {self.names[index]} was recorded in the middle of a shot, which shifted the "
+                        f"timeline. call dma_sequences.update() before the measurement loop, and don't change "
+                        f"{self.dependencies[index]} inside it ({self.n_stale_playbacks} times so far)")
+
+    @kernel
+    def is_stale(self, index: TInt32) -> TBool:
+        """whether the sequence needs to be recorded, i.e. it hasn't been or any of its dependencies changed"""
+        self.dependency_values(index, self.current_values)
+        stale = not self.recorded[index]
+        for k in range(self.offsets[index], self.offsets[index + 1]):
+            if self.current_values[k] != self.recorded_values[k]:
+                stale = True
+        return stale
+
+    @kernel
+    def record(self, index: TInt32):
+        """
+        record the sequence, split into a repeated block and a remainder if it has too many events for one
+        recording. recording changes the DMA epoch, which invalidates the handles of the other sequences, so all
+        of the handles are fetched again.
+        """
+        self.dependency_values(index, self.current_values)
+
+        events = self.events(index)
+        n_cycles = self.cycles(index)
+        assert events <= MAX_DMA_EVENTS, "DMA sequence (or one cycle of it) has too many events for a recording"
+        assert n_cycles >= 0, "DMA sequence has a negative number of cycles"
+
+        block_cycles = n_cycles
+        if events > 0 and block_cycles > MAX_DMA_EVENTS // events:
+            block_cycles = MAX_DMA_EVENTS // events
+        self.block_cycles[index] = block_cycles
+        self.n_blocks[index] = n_cycles // block_cycles if block_cycles > 0 else 0
+        self.remainder_cycles[index] = n_cycles - self.n_blocks[index] * block_cycles
+        self.periods_mu[index] = self.period_mu(index)
+
+        if block_cycles > 0:
+            with self.core_dma.record(self.names[index]):
+                self.emit(index, block_cycles)
+        if self.remainder_cycles[index] > 0:
+            with self.core_dma.record(self.remainder_names[index]):
+                self.emit(index, self.remainder_cycles[index])
+
+        for k in range(self.offsets[index], self.offsets[index + 1]):
+            self.recorded_values[k] = self.current_values[k]
+        self.recorded[index] = True
+        self.n_recordings += 1
+
+        for i in range(len(self.names)):
+            if self.recorded[i]:
+                if self.block_cycles[i] > 0:
+                    self.handles[i] = self.core_dma.get_handle(self.names[i])
+                if self.remainder_cycles[i] > 0:
+                    self.remainder_handles[i] = self.core_dma.get_handle(self.remainder_names[i])
+
+    @kernel
+    def playback(self, index: TInt32):
+        """
+        play back the recordings of a sequence, each one at the start time of its first cycle. the cursor ends up
+        where it would after emitting the whole sequence. assumes the sequence is up to date, see DMASequence.playback
+        """
+        start = now_mu()
+        block_mu = self.block_cycles[index] * self.periods_mu[index]
+        for k in range(self.n_blocks[index]):
+            at_mu(start + k * block_mu)
+            self.core_dma.playback_handle(self.handles[index])
+        if self.remainder_cycles[index] > 0:
+            at_mu(start + self.n_blocks[index] * block_mu)
+            self.core_dma.playback_handle(self.remainder_handles[index])
+
+    @kernel
+    def update(self):
+        """
+        record every sequence which is enabled and stale. call this at the start of an experiment function, so that
+        the sequences aren't recorded in the middle of a shot, which would use up the slack.
+        """
+        recorded_any = False
+        for i in range(len(self.names)):
+            if self.enabled(i) and self.is_stale(i):
+                self.record(i)
+                recorded_any = True
+        if recorded_any:
+            self.core.break_realtime()
@@ -0,0 +1,98 @@
+"""
+For ending a measurement loop early once its result is clearly worse than what it's being compared with, e.g. an
+optimizer candidate which loads far fewer atoms than the best parameters found so far.
+
+This works for costs which are -100 times a binomial fraction, like the loading or the retention fraction (see
+BINOMIAL_COSTS in cost_functions). After k successes in n trials, the fraction has a Beta(k+1, n-k+1) posterior
+for a uniform prior. Every block_size measurements, end_measurement sends the counts so far to the host, which
+computes the upper confidence bound on the fraction. If even that would be a worse cost than target_cost, the
+measurement loop is ended, and stopped_at records the number of measurements which were taken, so the cost can be
+computed from just those.
+
+BaseExperiment gives every experiment a disabled one, for which check does nothing.
+
+intended usage:
+----
+# in prepare, after BaseExperiment.prepare
+self.early_stopping = EarlyStopping(self, successes=atom_loading_successes, block_size=20, confidence=0.99)
+
+# on the host, before each run of the measurement loop
+self.early_stopping.reset(target_cost=self.best_cost)
+self.run_kernel()
+n_taken = self.early_stopping.stopped_at if self.early_stopping.stopped_at > 0 else self.n_measurements
+----
+"""
+
+from artiq.experiment import *
+import numpy as np
+from scipy.stats import beta
+
+
+class EarlyStopping:
+
+    def __init__(self, experiment, successes=None, block_size=1, min_measurements=0, confidence=0.99):
+        """
+        :param experiment: the experiment with the counts lists
+        :param successes: a function which takes the experiment, a counts_list, and a counts2_list, and returns
+            (successes, trials), such that the cost is -100*successes/trials. see BINOMIAL_COSTS in cost_functions.
+            early stopping is disabled if this is None
+        :param block_size: the number of measurements between checks
+        :param min_measurements: the least number of measurements to take before stopping
+        :param confidence: the confidence with which the cost has to be worse than the target to stop
+        """
+        self.exp = experiment
+        self.core = experiment.core
+        self.successes = successes
+        self.enabled = successes is not None
+        self.block_size = max(int(block_size), 1)
+        self.min_measurements = int(min_measurements)
+        self.confidence = confidence
+        self.target_cost = np.inf
+
+        # kernel-side
+        self.last_checked = 0
+        self.stopped_at = 0 # the number of measurements taken when the loop was stopped, or 0
+
+    def reset(self, target_cost):
+        """
+        reset before running the measurement loop. call this on the host
+
+        :param target_cost: the loop is stopped when the cost is confidently worse (i.e. greater) than this
+        """
+        self.target_cost = target_cost
+        self.last_checked = 0
+        self.stopped_at = 0
+
+    def posterior(self, counts_list, counts2_list):
+        """the parameters of the Beta posterior of the fraction in the cost"""
+        k, n = self.successes(self.exp, counts_list, counts2_list)
+        return k + 1, n - k + 1
+
+    @rpc
+    def is_clearly_worse(self, counts_list: TList(TInt32), counts2_list: TList(TInt32), n: TInt32) -> TBool:
+        """whether the cost of the first n measurements is worse than target_cost, even at the confidence bound"""
+        a, b = self.posterior(counts_list[:n], counts2_list[:n])
+        best_possible_cost = -100 * beta.ppf(self.confidence, a, b)
+        return best_possible_cost > self.target_cost
+
+    @kernel
+    def check(self, counts_list: TList(TInt32), counts2_list: TList(TInt32), measurement: TInt32) -> TBool:
+        """
+        whether to end the measurement loop now. call this after the measurement index has been updated
+
+        :param counts_list: the first shot counts of the measurements so far
+        :param counts2_list: the second shot counts of the measurements so far
+        :param measurement: the number of measurements taken
+        :return: True if the loop should be ended
+        """
+        if not self.enabled:
+            return False
+        if measurement < self.min_measurements or measurement - self.last_checked < self.block_size:
+            return False
+        self.last_checked = measurement
+
+        stop = self.is_clearly_worse(counts_list, counts2_list, measurement)
+        self.core.break_realtime() # waiting for the host uses up the slack
+        if stop:
+            self.stopped_at = measurement
+        return stop
@@ -0,0 +1,219 @@
+"""
+An incremental h5 writer for saving experiment results while the experiment is running.
+
+write_results in write_h5.py used to open a new file in "w" mode and write every dataset each time it was called,
+e.g. after every step of GeneralVariableScan, so a long scan wrote the same data to disk over and over. This
+writer keeps track of what is in the file between calls. One dimensional numeric datasets, e.g. photocounts, are stored as
+resizable chunked h5 datasets, and only the rows added since the last write are appended. Everything else is
+(re)written only if it has changed. The file is flushed, fsync'd, and closed at the end of each write, so it is
+still a valid h5 file if the experiment is aborted, and HDF5's file locking doesn't stop analysis scripts or applets
+from opening it between writes.
+
+Note that changing values in place, e.g. with mutate_dataset, is not detected for the appended datasets. Use
+set_dataset for these instead, which replaces the value and causes the dataset to be rewritten.
+
+The layout of the file is the same as what DatasetManager.write_hdf5 produces, i.e. "datasets" and "archive"
+groups plus any metadata at the top level, so the analysis code doesn't need to change.
+
+intended usage:
+----
+writer = IncrementalH5Writer("my_results.h5")
+for step in range(n_steps):
+    ... take some data
+    writer.write({'datasets': dataset_mgr.local, 'archive': dataset_mgr.archive}, metadata={'rid': rid})
+writer.close()
+----
+"""
+
+import logging
+import os
+from numbers import Number
+
+import h5py
+import numpy as np
+
+# the number of rows in each chunk of an appendable dataset
+CHUNK_ROWS = 1024
+
+
+def dataset_value(entry):
+    """
+    get the value of a dataset from a DatasetManager entry.
+    ARTIQ 8+ stores each dataset as a dictionary with the value and hdf5 options, whereas older versions store the
+    bare value.
+    """
+    if isinstance(entry, dict) and "value" in entry:
+        return entry["value"]
+    return entry
+
+
+class ListSnapshot:
+    """
+    the first 'length' entries of a list which is only ever appended to, e.g. a dataset we append_to_dataset.
+    this lets us snapshot the datasets without copying the lists.
+    """
+    __slots__ = ("value", "length")
+
+    def __init__(self, value, length):
+        self.value = value
+        self.length = length
+
+
+def snapshot_datasets(datasets) -> dict:
+    """
+    take a snapshot of the datasets which can be written later, e.g. by another thread, even if the datasets are
+    changed in the meantime. lists are snapshotted by reference and length, since we only ever append to them or
+    replace them with set_dataset. arrays are copied, and everything else is immutable.
+
+    :param datasets: dict of {dataset name: DatasetManager entry}, e.g. dataset_mgr.local
+    :return: dict of {dataset name: value}
+    """
+    snapshot = {}
+    for name, entry in datasets.items():
+        value = dataset_value(entry)
+        if isinstance(value, list):
+            snapshot[name] = ListSnapshot(value, len(value))
+        elif isinstance(value, np.ndarray):
+            snapshot[name] = value.copy()
+        else:
+            snapshot[name] = value
+    return snapshot
+
+
+def unwrap(value):
+    """:return: (value, number of entries) for lists and ListSnapshots, else (value, None)"""
+    if isinstance(value, ListSnapshot):
+        return value.value, value.length
+    if isinstance(value, (list, np.ndarray)) and np.ndim(value) > 0:
+        return value, len(value)
+    return value, None
+
+
+def is_appendable(arr) -> bool:
+    """whether an array can be stored as a resizable dataset which we only append to, i.e. 1D and numeric"""
+    return arr.ndim == 1 and arr.dtype.kind in 'biuf'
+
+
+class IncrementalH5Writer:
+
+    def __init__(self, filename):
+        """
+        :param filename: the h5 file to write. it is overwritten if it already exists
+        """
+        self.filename = filename
+        self.file = h5py.File(filename, "w")
+        self.file.close()
+        self.file = None
+
+        # (group name, dataset name) -> [value object, number of rows written] for the appendable datasets.
+        # append_to_dataset appends to the same list object, whereas set_dataset replaces it, so if the object
+        # changes or gets shorter we rewrite the dataset instead of appending.
+        self.appended = {}
+
+        # (group name, dataset name) -> the last value written, for the datasets which are rewritten when they change
+        self.written = {}
+
+        self.bytes_written = 0 # the number of bytes of dataset values written, for benchmarking
+        self.n_writes = 0
+
+    def _append_new_rows(self, group_name, group, name, value, length) -> bool:
+        """
+        append the rows added to value since the last write, if value is the same list or array we wrote last time.
+        only the new rows are converted, so this is cheap even for long datasets.
+
+        :return: True if the rows were appended (or there were none), False if the dataset needs to be rewritten
+        """
+        previous = self.appended.get((group_name, name))
+        if previous is None or previous[0] is not value or length is None or name not in group:
+            return False
+
+        n_written = previous[1]
+        if length < n_written:
+            return False
+        if length > n_written:
+            dset = group[name]
+            new_rows = np.asarray(value[n_written:length])
+            if new_rows.ndim != 1 or not np.can_cast(new_rows.dtype, dset.dtype, casting='same_kind'):
+                return False
+            dset.resize((length,))
+            dset[n_written:] = new_rows
+            self.bytes_written += new_rows.nbytes
+            previous[1] = length
+        return True
+
+    def _write_appendable(self, group_name, group, name, value, arr):
+        """(re)create a resizable dataset, e.g. because it is new or was reset with set_dataset"""
+        if name in group:
+            del group[name]
+        group.create_dataset(name, data=arr, maxshape=(None,), chunks=(CHUNK_ROWS,))
+        self.bytes_written += arr.nbytes
+        self.appended[(group_name, name)] = [value, len(arr)]
+        self.written.pop((group_name, name), None)
+
+    def _write_value(self, group_name, group, name, value):
+        key = (group_name, name)
+
+        # immutable values which haven't changed don't need to be written again
+        if key in self.written and name in group:
+            last = self.written[key]
+            if isinstance(value, (str, Number)) and type(last) == type(value) and last == value:
+                return
+
+        if name in group:
+            del group[name]
+        group[name] = value
+        self.bytes_written += np.asarray(value).nbytes
+        self.written[key] = value
+        self.appended.pop(key, None)
+
+    def write(self, groups, metadata={}):
+        """
+        write the datasets which have changed since the last call, then flush the file to disk
+
+        :param groups: dict of {group name: {dataset name: DatasetManager entry}},
+            e.g. {'datasets': dataset_mgr.local, 'archive': dataset_mgr.archive}. the datasets can also be
+            snapshots from snapshot_datasets.
+        :param metadata: dict of values to write at the top level of the file, e.g. {'rid': rid}
+        """
+        self.file = h5py.File(self.filename, "a")
+        try:
+            self._write_groups(groups, metadata)
+            self.flush()
+        finally:
+            self.close()
+        self.n_writes += 1
+
+    def _write_groups(self, groups, metadata):
+        for group_name, datasets in groups.items():
+            group = self.file.require_group(group_name)
+            for name, entry in datasets.items():
+                value, length = unwrap(dataset_value(entry))
+                try:
+                    if self._append_new_rows(group_name, group, name, value, length):
+                        continue
+                    if length is not None:
+                        arr = np.asarray(value[:length])
+                        if is_appendable(arr):
+                            self._write_appendable(group_name, group, name, value, arr)
+                        else:
+                            self._write_value(group_name, group, name, arr)
+                    else:
+                        self._write_value(group_name, group, name, value)
+                except Exception as e:
+                    logging.warning(f"could not write {group_name}/{name} to {self.filename}: {e}")
+
+        for name, value in metadata.items():
+            self._write_value('', self.file, name, value)
+
+    def flush(self):
+        """flush to disk so the file is valid even if the experiment is aborted before we close it"""
+        self.file.flush()
+        try:
+            os.fsync(self.file.id.get_vfd_handle())
+        except Exception as e:
+            logging.debug(f"fsync failed for {self.filename}: {e}")
+
+    def close(self):
+        if self.file is not None:
+            self.file.close()
+            self.file = None
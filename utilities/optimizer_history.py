@@ -0,0 +1,184 @@
+"""
+A persistent store of the points evaluated by the M-LOOP optimizers, so that a new optimization of the same
+variables can start from what we learned in earlier runs instead of from scratch.
+
+Each point is a row in an SQLite database with the optimizer, the experiment and cost functions, the names and
+bounds of the variables, the parameter values, the cost and its uncertainty, the time it was evaluated, and a JSON
+snapshot of the ExperimentVariables which the optimizer considers relevant (e.g. the overrides).
+
+A point from an earlier run is compatible with a new run if it is from the same optimizer, experiment function,
+cost function, and variables (in the same order), its parameters are within the new bounds, and its snapshot has
+the same values of any variables that the cost scales with, e.g. n_measurements for a number of atoms. Older
+points are down-weighted by scaling the cost towards 0 by 2**(-age/half_life), which works since the best cost is
+the most negative, see cost_functions. The best compatible point after down-weighting is used as M-LOOP's first_params.
+
+M-LOOP only takes earlier training points from a learner archive, so all of the compatible points are also written
+to a temporary archive, which is passed to the controller as training_filename. In the archive, the costs are kept as
+they were and older points are trusted less instead, by inflating their uncertainties by 2**(age/half_life).
+
+M-LOOP calls get_next_cost_dict from its interface thread, and an SQLite connection can only be used by the thread
+which opened it, so each method opens its own short-lived connection.
+
+intended usage:
+----
+history = OptimizerHistory(os.path.join(cwd, "optimizer_history.sqlite"))
+run_key = dict(optimizer="GeneralVariableOptimizer", experiment_function="atom_loading_experiment",
+               cost_function="atom_loading_cost", variables=['AZ_bottom_volts_RO', 'AZ_top_volts_RO'])
+first_params = history.warm_start_params(**run_key, min_bounds=min_bounds, max_bounds=max_bounds, max_age_days=7)
+training_filename = history.write_training_archive(archive_path, **run_key, min_bounds=min_bounds,
+                                                   max_bounds=max_bounds, max_age_days=7)
+...
+history.add(**run_key, min_bounds=min_bounds, max_bounds=max_bounds, params=params, cost=cost, uncertainty=uncer)
+----
+"""
+
+import json
+import logging
+import pickle
+import sqlite3
+import time
+from contextlib import closing
+
+import numpy as np
+
+SECONDS_PER_DAY = 24 * 3600
+
+
+class OptimizerHistory:
+
+    def __init__(self, path):
+        """
+        :param path: the path to the SQLite database file, which is created if it doesn't exist
+        """
+        self.path = path
+        with closing(self.connect()) as connection:
+            connection.execute("""CREATE TABLE IF NOT EXISTS points (
+            id INTEGER PRIMARY KEY,
+            timestamp REAL,
+            optimizer TEXT,
+            experiment_function TEXT,
+            cost_function TEXT,
+            variables TEXT,
+            min_bounds TEXT,
+            max_bounds TEXT,
+            params TEXT,
+            cost REAL,
+            uncertainty REAL,
+            snapshot TEXT)""")
+            connection.execute("""CREATE INDEX IF NOT EXISTS points_by_run
+                ON points (optimizer, experiment_function, cost_function, variables)""")
+            connection.commit()
+
+    def connect(self) -> sqlite3.Connection:
+        """a new connection to the database, for use in the calling thread only"""
+        return sqlite3.connect(self.path, timeout=10)
+
+    def add(self, optimizer, experiment_function, cost_function, variables, min_bounds, max_bounds, params, cost,
+            uncertainty, snapshot=None):
+        """
+        store an evaluated point
+
+        :param optimizer: the name of the optimizer, e.g. the experiment class name
+        :param experiment_function: the name of the experiment function
+        :param cost_function: the name of the cost function
+        :param variables: the names of the variables, in the order of params
+        :param min_bounds: the lower bounds of the variables
+        :param max_bounds: the upper bounds of the variables
+        :param params: the values of the variables
+        :param cost: the cost
+        :param uncertainty: the uncertainty of the cost
+        :param snapshot: optional dict of {name: value} of the relevant ExperimentVariables
+        """
+        with closing(self.connect()) as connection:
+            connection.execute(
+                "INSERT INTO points (timestamp, optimizer, experiment_function, cost_function, variables, min_bounds, "
+                "max_bounds, params, cost, uncertainty, snapshot) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                (time.time(), optimizer, experiment_function, cost_function, json.dumps(list(variables)),
+                 json.dumps([float(x) for x in min_bounds]), json.dumps([float(x) for x in max_bounds]),
+                 json.dumps([float(x) for x in params]), float(cost), float(uncertainty),
+                 json.dumps(snapshot if snapshot is not None else {}, default=float)))
+            connection.commit()
+
+    def compatible_points(self, optimizer, experiment_function, cost_function, variables, min_bounds, max_bounds,
+                          max_age_days=7, match=None) -> list:
+        """
+        the points from the last max_age_days which were evaluated with the same optimizer, functions, and
+        variables, and which are within the bounds
+
+        :param match: optional dict of {name: value} which the snapshots of the points must agree with
+        :return: a list of dicts with keys params, cost, uncertainty, age_days, snapshot
+        """
+        now = time.time()
+        with closing(self.connect()) as connection:
+            rows = connection.execute(
+                "SELECT timestamp, params, cost, uncertainty, snapshot FROM points WHERE optimizer = ? AND "
+                "experiment_function = ? AND cost_function = ? AND variables = ? AND timestamp > ?",
+                (optimizer, experiment_function, cost_function, json.dumps(list(variables)),
+                 now - max_age_days * SECONDS_PER_DAY)).fetchall()
+
+        points = []
+        for timestamp, params, cost, uncertainty, snapshot in rows:
+            params = json.loads(params)
+            snapshot = json.loads(snapshot)
+            if match and any(snapshot.get(name) != value for name, value in match.items()):
+                continue
+            if np.all(np.array(params) >= np.array(min_bounds)) and np.all(np.array(params) <= np.array(max_bounds)):
+                points.append({'params': params, 'cost': cost, 'uncertainty': uncertainty,
+                               'age_days': (now - timestamp) / SECONDS_PER_DAY, 'snapshot': snapshot})
+        return points
+
+    def warm_start_params(self, optimizer, experiment_function, cost_function, variables, min_bounds, max_bounds,
+                          max_age_days=7, half_life_days=1, match=None):
+        """
+        the best compatible point, with the costs down-weighted by age, or None if there aren't any. see the
+        module docstring
+
+        :param max_age_days: points older than this are ignored
+        :param half_life_days: the age at which a cost counts for half
+        :param match: optional dict of {name: value} which the snapshots of the points must agree with
+        :return: a list of the parameter values, or None
+        """
+        points = self.compatible_points(optimizer, experiment_function, cost_function, variables, min_bounds,
+                                        max_bounds, max_age_days, match)
+        if not points:
+            logging.info(f"no compatible points in {self.path} to warm start from")
+            return None
+
+        best = min(points, key=lambda point: point['cost'] * 2 ** (-point['age_days'] / half_life_days))
+        logging.info(f"warm starting from a point with cost {best['cost']} from {best['age_days']:.2f} days ago")
+        return best['params']
+
+    def write_training_archive(self, path, optimizer, experiment_function, cost_function, variables, min_bounds,
+                               max_bounds, max_age_days=7, half_life_days=1, match=None):
+        """
+        write the compatible points to an M-LOOP learner archive, to be passed to create_controller as
+        training_filename, or do nothing if there aren't any. the uncertainties are inflated by age, see the module
+        docstring
+
+        the archive_type is the generic 'learner', so the learner fits its own hyperparameters rather than loading
+        them from the archive.
+
+        :param path: the file to write, which must end in .pkl, since M-LOOP infers the file type from the extension
+        :param max_age_days: points older than this are ignored
+        :param half_life_days: the age at which the uncertainty of a point is doubled
+        :param match: optional dict of {name: value} which the snapshots of the points must agree with
+        :return: path, or None if there aren't any compatible points
+        """
+        points = self.compatible_points(optimizer, experiment_function, cost_function, variables, min_bounds,
+                                        max_bounds, max_age_days, match)
+        if not points:
+            return None
+
+        archive = {'archive_type': 'learner',
+                   'num_params': len(variables),
+                   'min_boundary': np.array(min_bounds, dtype=float),
+                   'max_boundary': np.array(max_bounds, dtype=float),
+                   'all_params': np.array([point['params'] for point in points], dtype=float),
+                   'all_costs': np.array([point['cost'] for point in points], dtype=float),
+                   'all_uncers': np.array([point['uncertainty'] * 2 ** (point['age_days'] / half_life_days)
+                                           for point in points], dtype=float),
+                   'bad_run_indexs': []}
+        with open(path, 'wb') as archive_file:
+            pickle.dump(archive, archive_file)
+        logging.info(f"training M-LOOP with {len(points)} points from {self.path}")
+        return path
@@ -0,0 +1,100 @@
+"""
+For interleaving several sets of values of some ExperimentVariables shot-by-shot within one run of an experiment
+function, e.g. so that slow drifts in the laser powers or the MOT position affect all of the sets the same way.
+
+The values of all of the sets are kept on the kernel. end_measurement calls next_shot on every loading attempt,
+which records which set the measurement was taken with and switches to the next set, so that afterwards the
+measurements can be split up by set, e.g. to compute a cost for each one. See GeneralVariableOptimizer.
+
+BaseExperiment gives every experiment a disabled interleaver, for which next_shot does nothing.
+
+intended usage:
+----
+# in prepare, after BaseExperiment.prepare
+self.interleaver = ParameterInterleaver(self, ['p_cooling_DP_RO', 'f_cooling_DP_RO'], max_sets=3,
+                                        n_shots=self.n_measurements)
+
+# on the host
+self.interleaver.set_values([[0.8, 130*MHz], [0.9, 130*MHz], [0.9, 131*MHz]])
+self.run_kernel() # which calls self.interleaver.start() then the experiment function
+counts_of_set_1 = [self.counts_list[i] for i in self.interleaver.measurements_of_set(1, self.n_measurements)]
+----
+"""
+
+from artiq.experiment import *
+import numpy as np
+from types import MethodType
+
+
+class ParameterInterleaver:
+
+    def __init__(self, experiment, variables, max_sets=1, n_shots=1):
+        """
+        :param experiment: the experiment which has the variables
+        :param variables: the names of the ExperimentVariables which differ between the sets
+        :param max_sets: the most sets which will be interleaved. the interleaver is disabled if this is 1
+        :param n_shots: the number of measurements which can be recorded, e.g. n_measurements
+        """
+        self.exp = experiment
+        self.core = experiment.core
+        self.variables = list(variables)
+        self.n_variables = len(self.variables)
+        self.max_sets = max(int(max_sets), 1)
+        self.enabled = self.max_sets > 1 and self.n_variables > 0
+
+        # kernel-side
+        self.n_sets = 1
+        self.current_set = 0
+        self.values = np.zeros(max(self.max_sets * self.n_variables, 1))
+        self.sets = [0] * max(int(n_shots), 1) # the set each measurement was taken with
+
+        # we can't setattr on the kernel, so the assignments are generated from the variable names. casting each
+        # value to the type of the current attribute keeps the kernel types the same. see GeneralVariableScan
+        setter_lines = []
+        for i, var in enumerate(self.variables):
+            value = getattr(experiment, var)
+            if isinstance(value, (bool, np.bool_)):
+                setter_lines.append(f"self.exp.{var} = values[offset + {i}] != 0.0")
+            elif isinstance(value, (int, np.integer)):
+                setter_lines.append(f"self.exp.{var} = int(values[offset + {i}])")
+            else:
+                setter_lines.append(f"self.exp.{var} = values[offset + {i}]")
+        self.set_variables = MethodType(kernel_from_string(["self", "values", "offset"],
+                                                           "\n".join(setter_lines) or "pass"), self)
+
+    def set_values(self, parameter_sets):
+        """
+        set the values of the sets to interleave in the next kernel. call this on the host
+
+        :param parameter_sets: a list of at most max_sets lists, each with a value for each of the variables
+        """
+        assert 0 < len(parameter_sets) <= self.max_sets, f"can interleave 1 to {self.max_sets} sets"
+        self.n_sets = len(parameter_sets)
+        for k, parameters in enumerate(parameter_sets):
+            assert len(parameters) == self.n_variables, f"each set needs a value for each of {self.variables}"
+            for i, value in enumerate(parameters):
+                self.values[k * self.n_variables + i] = float(value)
+
+    def measurements_of_set(self, k, n_measurements) -> list:
+        """the indices of the first n_measurements measurements which were taken with set k. call this on the host"""
+        if not self.enabled:
+            return list(range(n_measurements))
+        return [i for i in range(min(n_measurements, len(self.sets))) if self.sets[i] == k]
+
+    @kernel
+    def start(self):
+        """switch to the first set. call this before the experiment function"""
+        if self.enabled:
+            self.current_set = 0
+            self.set_variables(self.values, 0)
+
+    @kernel
+    def next_shot(self, measurement: TInt32):
+        """record that this measurement was taken with the current set, and switch to the next one"""
+        if not self.enabled:
+            return
+        if measurement < len(self.sets):
+            self.sets[measurement] = self.current_set
+        if self.n_sets > 1:
+            self.current_set = (self.current_set + 1) % self.n_sets
+            self.set_variables(self.values, self.current_set * self.n_variables)
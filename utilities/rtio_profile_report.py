@@ -0,0 +1,79 @@
+"""
+Summarize the RTIO profile datasets written by utilities/rtio_profiler.py: for each phase, the number of times it
+ran, its duration, a histogram of the durations, and the minimum slack when entering and exiting it.
+
+usage:
+----
+python utilities/rtio_profile_report.py path/to/results.h5 [--bins 10] [--ref-period 1e-9]
+----
+or from python, e.g. in a notebook:
+----
+from utilities.rtio_profile_report import load_profile, summarize
+print(summarize(load_profile("results.h5")))
+----
+"""
+
+import argparse
+
+import h5py
+import numpy as np
+
+COLUMNS = ['phase', 't_enter_mu', 'duration_mu', 'slack_enter_mu', 'slack_exit_mu']
+
+
+def load_profile(filename) -> dict:
+    """
+    :param filename: an h5 file from write_results or the ARTIQ master
+    :return: dict with the phase names under 'phase_names' and each of COLUMNS as an array
+    """
+    with h5py.File(filename, "r") as f:
+        datasets = f["datasets"]
+        names = datasets["rtio_profile_phase_names"][()]
+        if isinstance(names, bytes):
+            names = names.decode()
+        profile = {'phase_names': names.split(",")}
+        for name in COLUMNS:
+            profile[name] = np.asarray(datasets["rtio_profile_" + name][()], dtype=np.int64)
+    return profile
+
+
+def histogram_lines(values, bins, width=40) -> list:
+    """a text histogram, one line per bin"""
+    counts, edges = np.histogram(values, bins=bins)
+    scale = width/max(counts.max(), 1)
+    return [f"      {edges[i]:10.1f} - {edges[i + 1]:10.1f} us | {'#'*int(round(counts[i]*scale))} {counts[i]}"
+            for i in range(len(counts))]
+
+
+def summarize(profile, ref_period=1e-9, bins=10) -> str:
+    """
+    :param profile: the output of load_profile
+    :param ref_period: the RTIO reference period, for converting machine units to seconds
+    :param bins: the number of bins in the duration histograms
+    :return: the report
+    """
+    lines = []
+    for i, name in enumerate(profile['phase_names']):
+        selected = profile['phase'] == i
+        if not np.any(selected):
+            lines.append(f"{name}: no records")
+            continue
+        duration_us = profile['duration_mu'][selected]*ref_period*1e6
+        slack_enter_us = profile['slack_enter_mu'][selected]*ref_period*1e6
+        slack_exit_us = profile['slack_exit_mu'][selected]*ref_period*1e6
+        lines.append(f"{name}: {np.sum(selected)} records, duration median {np.median(duration_us):.1f} us, "
+                     f"min {duration_us.min():.1f} us, max {duration_us.max():.1f} us")
+        lines.append(f"    min slack: {slack_enter_us.min():.1f} us on entry, {slack_exit_us.min():.1f} us on exit"
+                     f"{' - UNDERFLOW RISK' if min(slack_enter_us.min(), slack_exit_us.min()) < 0 else ''}")
+        lines += histogram_lines(duration_us, bins)
+    return "\n".join(lines)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="summarize the RTIO profile in an h5 results file")
+    parser.add_argument("filename")
+    parser.add_argument("--bins", type=int, default=10, help="the number of bins in the duration histograms")
+    parser.add_argument("--ref-period", type=float, default=1e-9, help="the RTIO reference period in seconds")
+    args = parser.parse_args()
+
+    print(summarize(load_profile(args.filename), ref_period=args.ref_period, bins=args.bins))
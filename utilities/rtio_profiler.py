@@ -0,0 +1,149 @@
+"""
+For profiling the timeline of our kernels, e.g. how long each phase of a shot takes and how much slack we have
+going into it.
+
+Each phase is a context manager which records now_mu and the slack, i.e. now_mu minus the RTIO counter, when the
+kernel enters and exits it. The records are kept in a kernel-side buffer which is sent to the host with one async
+RPC when flush is called, e.g. once per measurement in end_measurement. The host appends them to the datasets
+rtio_profile_phase, rtio_profile_t_enter_mu, rtio_profile_duration_mu, rtio_profile_slack_enter_mu and
+rtio_profile_slack_exit_mu, so they end up in the h5 file along with the other results. The phase names are in
+rtio_profile_phase_names as a comma separated string, and utilities/rtio_profile_report.py summarizes a file.
+
+The slack tells us how far ahead of the hardware the kernel is. If the minimum slack going into a phase stays well
+above zero, the padding delays before it, e.g. the delay(1*ms) in load_MOT_and_FORT, can be shortened.
+
+When the profiler is disabled (enable_rtio_profiler in ExperimentVariables), entering and exiting a phase
+only costs checking a bool.
+
+intended usage:
+----
+# in prepare. BaseExperiment does this for the phases of a shot
+self.rtio_profiler = RTIOProfiler(self, phases=["MOT_loading", "first_shot"])
+
+@kernel
+def run(self):
+    ...
+    with self.rtio_profiler.MOT_loading:
+        load_MOT_and_FORT(self)
+    with self.rtio_profiler.first_shot:
+        first_shot(self)
+    self.rtio_profiler.flush()
+----
+"""
+
+from artiq.experiment import *
+import numpy as np
+
+# the maximum nesting of phases
+MAX_DEPTH = 8
+
+
+class RTIOPhase:
+    """a named phase, e.g. the first atom readout. use it with a with statement"""
+
+    def __init__(self, profiler, index, name):
+        self.profiler = profiler
+        self.core = profiler.core
+        self.index = index
+        self.name = name
+
+    @kernel
+    def __enter__(self):
+        self.profiler.enter(self.index)
+
+    @kernel
+    def __exit__(self, type, value, traceback):
+        self.profiler.exit()
+
+
+class RTIOProfiler:
+
+    def __init__(self, experiment, phases, enabled=True, buffer_size=64):
+        """
+        :param experiment: the experiment which owns the datasets
+        :param phases: the phase names. each becomes an RTIOPhase attribute of the profiler, so they must be
+            valid attribute names
+        :param enabled: whether to record anything
+        :param buffer_size: the number of phase records to keep on the kernel between flushes. if the buffer
+            fills up, it is flushed early, or if we are in the middle of a phase, further records are dropped
+        """
+        self.exp = experiment
+        self.core = experiment.core
+        self.phase_names = list(phases)
+        self.enabled = enabled
+        self.buffer_size = buffer_size
+
+        for i, name in enumerate(self.phase_names):
+            setattr(self, name, RTIOPhase(self, i, name))
+
+        # kernel-side buffers
+        self.n = 0
+        self.depth = 0
+        self.dropped = 0
+        self.open_records = np.full(MAX_DEPTH, -1, dtype=np.int32) # the record index of each open phase
+        self.phases = np.zeros(buffer_size, dtype=np.int32)
+        self.t_enter_mu = np.zeros(buffer_size, dtype=np.int64)
+        self.t_exit_mu = np.zeros(buffer_size, dtype=np.int64)
+        self.slack_enter_mu = np.zeros(buffer_size, dtype=np.int64)
+        self.slack_exit_mu = np.zeros(buffer_size, dtype=np.int64)
+
+        # host-side results. these lists are the dataset values, so they are only ever appended to
+        self.columns = {name: [] for name in ['phase', 't_enter_mu', 'duration_mu', 'slack_enter_mu',
+                                              'slack_exit_mu']}
+        if self.enabled:
+            self.exp.set_dataset("rtio_profile_phase_names", ",".join(self.phase_names))
+            for name, column in self.columns.items():
+                self.exp.set_dataset("rtio_profile_" + name, column)
+
+    @kernel
+    def enter(self, phase: TInt32):
+        if not self.enabled:
+            return
+        if self.n >= self.buffer_size:
+            if self.depth == 0:
+                self.flush()
+        i = -1
+        if self.n < self.buffer_size and self.depth < MAX_DEPTH:
+            i = self.n
+            self.n += 1
+            t = now_mu()
+            self.phases[i] = phase
+            self.t_enter_mu[i] = t
+            self.t_exit_mu[i] = t
+            self.slack_enter_mu[i] = t - self.core.get_rtio_counter_mu()
+        else:
+            self.dropped += 1
+        if self.depth < MAX_DEPTH:
+            self.open_records[self.depth] = i
+        self.depth += 1
+
+    @kernel
+    def exit(self):
+        if not self.enabled or self.depth == 0:
+            return
+        self.depth -= 1
+        if self.depth < MAX_DEPTH:
+            i = self.open_records[self.depth]
+            if i >= 0:
+                t = now_mu()
+                self.t_exit_mu[i] = t
+                self.slack_exit_mu[i] = t - self.core.get_rtio_counter_mu()
+
+    @kernel
+    def flush(self):
+        """send the records of the phases which have finished to the host. does nothing inside a phase"""
+        if self.n > 0 and self.depth == 0:
+            self.record(self.n, self.phases, self.t_enter_mu, self.t_exit_mu, self.slack_enter_mu,
+                        self.slack_exit_mu)
+            self.n = 0
+
+    @rpc(flags={"async"})
+    def record(self, n: TInt32, phases, t_enter_mu, t_exit_mu, slack_enter_mu, slack_exit_mu):
+        """append the first n records to the datasets"""
+        self.columns['phase'].extend(int(x) for x in phases[:n])
+        self.columns['t_enter_mu'].extend(int(x) for x in t_enter_mu[:n])
+        self.columns['duration_mu'].extend(int(t_exit_mu[i] - t_enter_mu[i]) for i in range(n))
+        self.columns['slack_enter_mu'].extend(int(x) for x in slack_enter_mu[:n])
+        self.columns['slack_exit_mu'].extend(int(x) for x in slack_exit_mu[:n])
+        for name, column in self.columns.items():
+            self.exp.set_dataset("rtio_profile_" + name, column)
@@ -0,0 +1,854 @@
+"""
+Fake devices for running our kernel code on the host, e.g. to benchmark the AOMPowerStabilizer or
+atom_loading_experiment on a laptop without a Kasli.
+
+ARTIQ runs a @kernel function on the host instead of compiling it if the core device's run method simply calls it,
+and delay, now_mu, at_mu, parallel and sequential work on the host once a time manager is set with
+artiq.language.core.set_time_manager. SimCore does both. The other classes here stand in for the devices in
+BaseExperiment and have the methods our code calls, so the kernel code runs unchanged.
+
+How to use it:
+- set which_node to "sim" in ExperimentVariables, or pass node="sim" to BaseExperiment, e.g. in
+  tests/SimAtomLoadingBenchmark.py. BaseExperiment then reads utilities/config/sim, where simulation.json says
+  which node's hardware to mimic ("gateware") along with the model parameters below, and the device aliases and
+  feedback channels are copies of that node's.
+- the experiment runs as usual, e.g. with artiq_run. only the scheduler is a real device.
+- self.core.report() summarizes where the time went. see SimCore.stats
+
+What is simulated:
+- the timeline, in machine units. each device call advances it by roughly what the real driver does, e.g. an
+  Urukul set or a Sampler sample takes a few us, so the simulated RTIO time of a sequence is about right.
+  the CPU is assumed to be infinitely fast, so the RTIO counter only catches up with now_mu at inputs, e.g.
+  Sampler reads and SPCM counts, and at wait_until_mu, like it does on the hardware when the kernel blocks.
+- Sampler channels which monitor a feedback channel in feedback_channels.json read
+    gain*sin^2(pi/2*amplitude)*laser power
+  while the dds switch is on, where the gain is such that the default amplitude gives the first set point, and
+  the laser power drifts slowly and has some noise. other Sampler channels read noise.
+- SPCM counts are Poisson with a rate of dark_rate, plus background_rate while the cooling light is on, plus
+  atom_rate while the cooling light is on and there is an atom in the FORT. the rate is integrated over the gate
+  from a timestamped history of the switches, since a DMA playback applies the switch changes after the gate,
+  e.g. turning the cooling light off, before the counts are read. an atom is loaded with probability
+  loading_probability when the FORT is turned on after being off for more than t_reload, and survives being off
+  for t with probability exp(-t/t_release).
+- DMA recordings store the device calls and replay them on playback. A recording with more than MAX_DMA_EVENTS
+  events raises an error, since the hardware would silently truncate it.
+
+What is profiled:
+- the number of kernels run and the host (wall clock) time spent in them
+- the simulated RTIO time and number of RTIO events
+- RPCs, i.e. calls from kernel code to host functions, sync and async, and the host time spent in them
+"""
+
+from artiq.experiment import *
+from artiq.language import core as core_language
+import builtins
+import collections
+import gc
+import json
+import bisect
+import logging
+import os
+import sys
+import sysconfig
+import time
+import numpy as np
+
+from utilities.dma_registry import MAX_DMA_EVENTS
+
+# how far ahead of the RTIO counter reset and break_realtime put now_mu, in machine units, as on the core device
+SLACK_MU = 125000
+
+# the most switch changes the model remembers per switch, for integrating the SPCM count rate over a gate
+MAX_SWITCH_HISTORY = 1000
+
+# approximate timeline durations of the device calls, in seconds
+T_DDS_SET = 1.5*us
+T_DDS_ATT = 1.0*us
+T_DDS_INIT = 1*ms
+T_CPLD_INIT = 1*ms
+T_SAMPLER_SAMPLE = 3.0*us
+T_SAMPLER_INIT = 1*ms
+T_ZOTINO_WRITE = 1.0*us
+T_ZOTINO_INIT = 1*ms
+
+# where the host code which isn't ours lives, for telling apart our functions from the library functions which
+# are builtins on the core device
+_artiq_core_file = os.path.abspath(core_language.__file__)
+_numpy_dir = os.path.dirname(os.path.abspath(np.__file__))
+_library_dirs = tuple(os.path.abspath(p) for p in
+                      {sysconfig.get_paths()[k] for k in ['stdlib', 'platstdlib', 'purelib', 'platlib']})
+
+
+def _is_library_file(filename):
+    return os.path.abspath(filename).startswith(_library_dirs)
+
+
+class _TimeContext:
+    __slots__ = ("start", "now", "end", "parallel")
+
+    def __init__(self, t, parallel):
+        self.start = t
+        self.now = t
+        self.end = t
+        self.parallel = parallel
+
+
+class SimTimeManager:
+    """the timeline in machine units, for delay, now_mu, at_mu, and with parallel/sequential on the host"""
+
+    def __init__(self, ref_period):
+        self.ref_period = ref_period
+        self.stack = [_TimeContext(0, False)]
+
+    def enter_sequential(self):
+        self.stack.append(_TimeContext(self.stack[-1].now, False))
+
+    def enter_parallel(self):
+        self.stack.append(_TimeContext(self.stack[-1].now, True))
+
+    def exit(self):
+        ctx = self.stack.pop()
+        t = ctx.end if ctx.parallel else ctx.now
+        parent = self.stack[-1]
+        if parent.parallel:
+            parent.end = max(parent.end, t)
+        else:
+            parent.now = t
+
+    def take_time_mu(self, duration):
+        ctx = self.stack[-1]
+        if ctx.parallel:
+            # each statement in a parallel block starts at the same time
+            ctx.end = max(ctx.end, ctx.now + int(duration))
+        else:
+            ctx.now += int(duration)
+
+    def take_time(self, duration):
+        self.take_time_mu(round(duration/self.ref_period))
+
+    def get_time_mu(self):
+        return np.int64(self.stack[-1].now)
+
+    def set_time_mu(self, t):
+        ctx = self.stack[-1]
+        ctx.now = int(t)
+        if ctx.parallel:
+            ctx.end = max(ctx.end, ctx.now)
+
+
+class _DMARecording:
+
+    def __init__(self, name, handle_id):
+        self.name = name
+        self.handle_id = handle_id
+        self.actions = [] # (t_mu relative to the start of the recording, function) for the device calls
+        self.n_events = 0
+        self.duration_mu = 0
+
+
+class SimCore:
+
+    def __init__(self, ref_period=1e-9, profile_rpcs=True):
+        """
+        :param ref_period: the RTIO reference period in seconds
+        :param profile_rpcs: whether to count the RPCs made from kernel code. this slows the kernels down
+            a lot, since it uses sys.setprofile, but not the simulated RTIO time.
+        """
+        self.ref_period = ref_period
+        self.ref_multiplier = 8
+        self.coarse_ref_period = ref_period*self.ref_multiplier
+        self.profile_rpcs = profile_rpcs
+
+        self.time_manager = SimTimeManager(ref_period)
+        core_language.set_time_manager(self.time_manager)
+
+        # rtio_log is a compiler builtin, so it isn't defined on the host
+        builtins.rtio_log = self.rtio_log
+
+        self.rtio_counter = 0
+        self.recording = None # the _DMARecording being recorded, if any
+        self.kernel_codes = set() # the code of the @kernel functions which have been run
+        self._level = 0 # > 0 while a kernel is running
+        self._kernel_frames = set()
+        self._rpc_start = {}
+        self._code_kinds = {}
+        self._classes_with_kernels = {}
+        self._warned_underflow = False
+        self.reset_stats()
+
+    def reset_stats(self):
+        self.stats = {
+            'kernels': 0,
+            'host_time': 0.0, # wall clock time spent in kernels, including RPCs
+            'rtio_time': 0.0, # simulated timeline advanced by the kernels
+            'rtio_events': 0,
+            'underflows': 0,
+            'rpcs': 0,
+            'async_rpcs': 0,
+            'rpc_time': 0.0, # wall clock time spent in RPCs
+            'rpc_counts': collections.Counter(), # (kind, name) -> calls
+            'rpc_times': collections.Counter() # (kind, name) -> seconds
+        }
+
+    # the core device API
+
+    def run(self, k_function, k_args, k_kwargs):
+        function = k_function.artiq_embedded.function
+        self.kernel_codes.add(function.__code__)
+
+        if self._level > 0:
+            # a kernel called from a kernel is one statement, even inside a parallel block
+            self.time_manager.enter_sequential()
+            try:
+                return function(*k_args, **k_kwargs)
+            finally:
+                self.time_manager.exit()
+
+        if len(k_args) > 0:
+            self.embed(k_args[0])
+
+        self._level += 1
+        t0 = time.perf_counter()
+        self.break_realtime() # the runtime starts each kernel a little ahead of the RTIO counter
+        t0_mu = self.time_manager.get_time_mu()
+        if self.profile_rpcs:
+            sys.setprofile(self._profile)
+        try:
+            return function(*k_args, **k_kwargs)
+        finally:
+            if self.profile_rpcs:
+                sys.setprofile(None)
+            self._kernel_frames.clear()
+            self._rpc_start.clear()
+            self._level -= 1
+            self.stats['kernels'] += 1
+            self.stats['host_time'] += time.perf_counter() - t0
+            self.stats['rtio_time'] += max(self.time_manager.get_time_mu() - t0_mu, 0)*self.ref_period
+
+    def reset(self):
+        self.time_manager.set_time_mu(self.get_rtio_counter_mu() + SLACK_MU)
+
+    def break_realtime(self):
+        min_now = self.get_rtio_counter_mu() + SLACK_MU
+        if self.time_manager.get_time_mu() < min_now:
+            self.time_manager.set_time_mu(min_now)
+
+    def get_rtio_counter_mu(self) -> TInt64:
+        # the CPU is infinitely fast, so assume it stays about one slack ahead of the RTIO counter
+        self.rtio_counter = max(self.rtio_counter, int(self.time_manager.get_time_mu()) - SLACK_MU)
+        return np.int64(self.rtio_counter)
+
+    def wait_until_mu(self, cursor_mu):
+        self.rtio_counter = max(self.rtio_counter, int(cursor_mu))
+
+    def seconds_to_mu(self, seconds):
+        return np.int64(seconds//self.ref_period)
+
+    def mu_to_seconds(self, mu):
+        return mu*self.ref_period
+
+    def rtio_log(self, channel, *args):
+        self._event()
+
+    # for the devices
+
+    def _event(self, n=1):
+        """an RTIO output event at now_mu"""
+        if self.recording is not None:
+            self.recording.n_events += n
+            return
+        self.stats['rtio_events'] += n
+        if self.time_manager.get_time_mu() < self.rtio_counter:
+            self.stats['underflows'] += 1
+            if not self._warned_underflow:
+                logging.warning(f"RTIO underflow at {self.time_manager.get_time_mu()} mu "
+                                f"(RTIO counter {self.rtio_counter} mu)")
+                self._warned_underflow = True
+
+    def _input(self, t_mu=None):
+        """the kernel blocks until an input at t_mu (default now_mu) arrives, so the RTIO counter catches up"""
+        if t_mu is None:
+            t_mu = self.time_manager.get_time_mu()
+        if self.recording is None:
+            self.wait_until_mu(t_mu)
+
+    def _apply(self, action):
+        """change the state of a device now, or at playback if we are recording a DMA sequence"""
+        if self.recording is not None:
+            self.recording.actions.append((int(self.time_manager.get_time_mu()), action))
+        else:
+            action()
+
+    def now(self) -> float:
+        """the timeline in seconds, for the models"""
+        return float(self.time_manager.get_time_mu())*self.ref_period
+
+    # profiling
+
+    def embed(self, obj):
+        """
+        give the objects reachable from obj which have @kernel methods a core attribute, which the kernel
+        decorator looks up when a kernel method is called from the host. on the core device, the compiler
+        finds the core through the object it was called on, so e.g. AOMPowerStabilizer doesn't need one.
+        """
+        stack = [obj]
+        seen = set()
+        while stack:
+            o = stack.pop()
+            if id(o) in seen:
+                continue
+            seen.add(id(o))
+            if isinstance(o, (list, tuple)):
+                stack.extend(x for x in o if hasattr(x, '__dict__'))
+                continue
+            if not hasattr(o, '__dict__') or isinstance(o, (type, SimDevice)) or callable(o):
+                continue
+            filename = getattr(sys.modules.get(type(o).__module__), '__file__', None)
+            if filename is not None and _is_library_file(filename):
+                continue
+            if not hasattr(o, 'core') and self._has_kernels(type(o)):
+                try:
+                    o.core = self
+                except AttributeError:
+                    pass
+            stack.extend(vars(o).values())
+
+    def _has_kernels(self, cls):
+        if cls not in self._classes_with_kernels:
+            self._classes_with_kernels[cls] = any(
+                getattr(getattr(getattr(cls, name, None), 'artiq_embedded', None), 'core_name', None) is not None
+                for name in dir(cls))
+        return self._classes_with_kernels[cls]
+
+    def _classify(self, code):
+        """
+        :return: what a call to code from kernel code would be on the core device: "kernel" for code which
+            is compiled with the kernel, "device" for device drivers and the time functions, "rpc" or "async rpc"
+        """
+        if code in self._code_kinds:
+            return self._code_kinds[code]
+
+        kind = None
+        if code.co_name.startswith('<'):
+            kind = "kernel" # comprehensions etc. are part of the function they are in
+        elif os.path.abspath(code.co_filename) in [os.path.abspath(__file__), _artiq_core_file]:
+            kind = "device"
+        else:
+            for ref in gc.get_referrers(code):
+                if getattr(ref, '__code__', None) is code and hasattr(ref, 'artiq_embedded'):
+                    embedded = ref.artiq_embedded
+                    if embedded.core_name is not None:
+                        kind = "device" # the kernel decorator's wrapper, which calls run
+                    elif embedded.function is not None:
+                        kind = "kernel" # portable
+                    else:
+                        kind = "async rpc" if "async" in embedded.flags else "rpc"
+                    break
+        if kind is None:
+            if os.path.abspath(code.co_filename).startswith(_numpy_dir):
+                kind = "device" # numpy functions are compiler builtins
+            else:
+                kind = "rpc"
+
+        self._code_kinds[code] = kind
+        return kind
+
+    def _profile(self, frame, event, arg):
+        if event == 'call':
+            code = frame.f_code
+            if code in self.kernel_codes:
+                self._kernel_frames.add(id(frame))
+                return
+            caller = frame.f_back
+            if caller is None or id(caller) not in self._kernel_frames:
+                return
+            kind = self._classify(code)
+            if kind == "kernel":
+                self._kernel_frames.add(id(frame))
+            elif kind != "device":
+                self._rpc_start[id(frame)] = ((kind, getattr(code, 'co_qualname', code.co_name)),
+                                             time.perf_counter())
+        elif event == 'return':
+            self._kernel_frames.discard(id(frame))
+            started = self._rpc_start.pop(id(frame), None)
+            if started is not None:
+                key, t0 = started
+                dt = time.perf_counter() - t0
+                self.stats['async_rpcs' if key[0] == "async rpc" else 'rpcs'] += 1
+                self.stats['rpc_time'] += dt
+                self.stats['rpc_counts'][key] += 1
+                self.stats['rpc_times'][key] += dt
+
+    def report(self, n_rpcs=20) -> str:
+        """a summary of the stats, with the n_rpcs most called RPCs"""
+        s = self.stats
+        rtio_time = s['rtio_time']
+        lines = [f"{s['kernels']} kernels: {s['host_time']:.3f} s on the host, {rtio_time:.3f} s simulated RTIO time, "
+                 f"{s['rtio_events']} RTIO events, {s['underflows']} underflows",
+                 f"{s['rpcs']} sync RPCs and {s['async_rpcs']} async RPCs: {s['rpc_time']:.3f} s on the host"]
+        for key, n in s['rpc_counts'].most_common(n_rpcs):
+            kind, name = key
+            lines.append(f"    {n:8d} x {kind:9s} {name}: {s['rpc_times'][key]*1e3:.1f} ms")
+        return "\n".join(lines)
+
+
+class SimDevice:
+
+    def __init__(self, core, name):
+        self.core = core
+        self.name = name
+
+
+class SimDMA(SimDevice):
+
+    def __init__(self, core, name="core_dma"):
+        super().__init__(core, name)
+        self.recordings = {}
+        self.handles = {}
+
+    def record(self, name):
+        """with self.core_dma.record(name): ..."""
+        return _DMARecordContext(self, name)
+
+    def erase(self, name):
+        recording = self.recordings.pop(name, None)
+        if recording is not None:
+            self.handles.pop(recording.handle_id)
+
+    def get_handle(self, name):
+        recording = self.recordings[name]
+        return (np.int32(0), np.int64(recording.duration_mu), np.int32(recording.handle_id))
+
+    def playback(self, name):
+        self._play(self.recordings[name])
+
+    def playback_handle(self, handle):
+        self._play(self.handles[int(handle[2])])
+
+    def _play(self, recording):
+        t0 = int(self.core.time_manager.get_time_mu())
+        self.core._event(recording.n_events)
+        for t, action in recording.actions:
+            self.core.time_manager.set_time_mu(t0 + t)
+            action()
+        self.core.time_manager.set_time_mu(t0 + recording.duration_mu)
+
+
+class _DMARecordContext:
+
+    def __init__(self, dma, name):
+        self.dma = dma
+        self.name = name
+
+    def __enter__(self):
+        self.dma.erase(self.name)
+        self.recording = _DMARecording(self.name, len(self.dma.handles) + 1)
+        while self.recording.handle_id in self.dma.handles:
+            self.recording.handle_id += 1
+        self.saved_now_mu = self.dma.core.time_manager.get_time_mu()
+        self.dma.core.time_manager.set_time_mu(0)
+        self.dma.core.recording = self.recording
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.recording.duration_mu = int(self.dma.core.time_manager.get_time_mu())
+        self.dma.core.recording = None
+        self.dma.core.time_manager.set_time_mu(self.saved_now_mu)
+        # the hardware silently truncates the recording, so fail here instead
+        if exc_type is None and self.recording.n_events > MAX_DMA_EVENTS:
+            raise RuntimeError(f"DMA recording {self.name} has {self.recording.n_events} events, "
+                               f"but a recording can hold at most {MAX_DMA_EVENTS}")
+        self.dma.recordings[self.name] = self.recording
+        self.dma.handles[self.recording.handle_id] = self.recording
+
+
+class SimTTL(SimDevice):
+    """a TTLInOut. counts are drawn from the model if this is one of the SPCM channels"""
+
+    def __init__(self, core, name, model=None):
+        super().__init__(core, name)
+        self.model = model
+        self.state = 0
+        self.t_changed = 0.0
+        self.t_gate = (0.0, 0.0)
+        self.t_gate_start = 0.0
+        self.input_level = 0 # what sample_get returns, e.g. 0 for a locked laser on ttl_D1_lock_monitor
+
+    def _set(self, state):
+        self.core._event()
+        def action():
+            if state != self.state:
+                self.state = state
+                self.t_changed = self.core.now()
+                if self.model is not None:
+                    self.model.switched(self, state)
+        self.core._apply(action)
+
+    def output(self):
+        self.core._event()
+
+    def input(self):
+        self.core._event()
+
+    def set_o(self, o):
+        self._set(1 if o else 0)
+
+    def on(self):
+        self._set(1)
+
+    def off(self):
+        self._set(0)
+
+    def pulse_mu(self, duration):
+        with sequential:
+            self.on()
+            delay_mu(duration)
+            self.off()
+
+    def pulse(self, duration):
+        with sequential:
+            self.on()
+            delay(duration)
+            self.off()
+
+    def _set_sensitivity(self, value):
+        """the gate is timed when the sensitivity changes, so it is right for a gate played back with DMA too"""
+        self.core._event()
+        def action():
+            if value:
+                self.t_gate_start = self.core.now()
+            else:
+                self.t_gate = (self.t_gate_start, self.core.now())
+        self.core._apply(action)
+
+    def gate_rising_mu(self, duration):
+        with sequential:
+            self._set_sensitivity(1)
+            delay_mu(duration)
+            self._set_sensitivity(0)
+        return now_mu()
+
+    def gate_rising(self, duration):
+        return self.gate_rising_mu(self.core.seconds_to_mu(duration))
+
+    def gate_falling(self, duration):
+        return self.gate_rising(duration)
+
+    def gate_both(self, duration):
+        return self.gate_rising(duration)
+
+    def count(self, up_to_timestamp_mu) -> TInt32:
+        self.core._input(up_to_timestamp_mu)
+        if self.model is None:
+            return 0
+        return self.model.counts(self.name, self.t_gate)
+
+    def timestamp_mu(self, up_to_timestamp_mu) -> TInt64:
+        """the excitation photons aren't modelled, so there are never any clicks to timestamp"""
+        self.core._input(up_to_timestamp_mu)
+        return np.int64(-1)
+
+    def sample_input(self):
+        self.core._event()
+
+    def sample_get(self) -> TInt32:
+        self.core._input()
+        return self.input_level
+
+    def sample_get_nonrt(self) -> TInt32:
+        return self.input_level
+
+
+class SimEdgeCounter(SimTTL):
+    """an EdgeCounter, e.g. ttl0_counter"""
+
+    def gate_rising_mu(self, duration):
+        t_end = super().gate_rising_mu(duration)
+        self.t_end_mu = t_end
+        return t_end
+
+    def fetch_count(self) -> TInt32:
+        return self.count(getattr(self, 't_end_mu', now_mu()))
+
+
+class SimCPLD(SimDevice):
+
+    def init(self, blind=False):
+        self.core._event()
+        delay(T_CPLD_INIT)
+
+    def cfg_sw(self, channel, on):
+        self.core._event()
+
+    def set_att(self, channel, att):
+        self.core._event()
+        delay(T_DDS_ATT)
+
+
+class SimAD9910(SimDevice):
+    """an Urukul channel. the model reads its amplitude and whether its switch is on"""
+
+    def __init__(self, core, name, cpld=None, model=None):
+        super().__init__(core, name)
+        self.cpld = cpld
+        self.sw = SimTTL(core, name + "_sw", model)
+        self.frequency = 0.0
+        self.amplitude = 0.0
+        self.phase = 0.0
+        self.att = 0.0
+
+    def init(self, blind=False):
+        self.core._event()
+        delay(T_DDS_INIT)
+
+    def set(self, frequency=0.0, phase=0.0, phase_mode=0, ref_time_mu=-1, amplitude=1.0, profile=7, ram_destination=-1):
+        self.core._event()
+        def action():
+            self.frequency = frequency
+            self.phase = phase
+            self.amplitude = amplitude
+        self.core._apply(action)
+        delay(T_DDS_SET)
+        return 0
+
+    def set_frequency(self, frequency):
+        return self.set(frequency=frequency, amplitude=self.amplitude)
+
+    def set_amplitude(self, amplitude):
+        return self.set(frequency=self.frequency, amplitude=amplitude)
+
+    def get(self):
+        self.core._input()
+        return self.frequency, self.phase, self.amplitude
+
+    def set_att(self, att):
+        self.core._event()
+        self.att = att
+        delay(T_DDS_ATT)
+
+    def get_att(self) -> TFloat:
+        return self.att
+
+    def cfg_sw(self, state):
+        self.sw.set_o(state)
+
+
+class SimZotino(SimDevice):
+
+    def __init__(self, core, name, n_channels=32):
+        super().__init__(core, name)
+        self.voltages = [0.0]*n_channels
+        self.pending = {}
+
+    def init(self, blind=False):
+        self.core._event()
+        delay(T_ZOTINO_INIT)
+
+    def write_dac(self, channel, voltage):
+        self.core._event()
+        self.pending[channel] = voltage
+        delay(T_ZOTINO_WRITE)
+
+    def load(self):
+        self.core._event()
+        def action():
+            for channel, voltage in self.pending.items():
+                self.voltages[channel] = voltage
+            self.pending = {}
+        self.core._apply(action)
+
+    def set_dac(self, voltages, channels=list(range(32))):
+        for i in range(len(voltages)):
+            self.write_dac(channels[i], voltages[i])
+        self.load()
+
+
+class SimSampler(SimDevice):
+
+    def __init__(self, core, name, model=None):
+        super().__init__(core, name)
+        self.model = model
+        self.gains = [0]*8
+
+    def init(self):
+        self.core._event()
+        delay(T_SAMPLER_INIT)
+
+    def set_gain_mu(self, channel, gain):
+        self.gains[channel] = gain
+
+    def sample(self, data):
+        self.core._event()
+        delay(T_SAMPLER_SAMPLE)
+        self.core._input() # the kernel waits for the ADC data
+        for i in range(len(data)):
+            data[i] = self.model.voltage(self.name, i) if self.model is not None else 0.0
+
+    def sample_mu(self, data):
+        voltages = [0.0]*len(data)
+        self.sample(voltages)
+        for i in range(len(data)):
+            data[i] = int(voltages[i]*(1 << 15)/10)
+
+
+class SimModel:
+    """the AOM power and atom model, which the Samplers and SPCM TTLs read from"""
+
+    def __init__(self, core, experiment, config, feedback_channels):
+        """
+        :param core: the SimCore
+        :param experiment: the experiment, for looking up the devices and the set point values
+        :param config: the "model" dictionary from simulation.json
+        :param feedback_channels: the contents of feedback_channels.json, for which Sampler channel monitors
+            which dds channel
+        """
+        self.core = core
+        self.exp = experiment
+        self.rng = np.random.default_rng(config.get('seed', None))
+
+        self.dark_rate = config.get('dark_rate', 100.0)
+        self.background_rate = config.get('background_rate', 3000.0)
+        self.atom_rate = config.get('atom_rate', 30000.0)
+        self.loading_probability = config.get('loading_probability', 0.5)
+        self.t_reload = config.get('t_reload', 1*ms)
+        self.t_release = config.get('t_release', 20*us)
+        self.laser_noise = config.get('laser_noise', 0.002)
+        self.laser_drift = config.get('laser_drift', 0.02)
+        self.t_drift = config.get('t_drift', 60.0)
+        self.sampler_noise = config.get('sampler_noise', 0.0005)
+        self.spcm_devices = config.get('spcm_devices', ["ttl0", "ttl0_counter"])
+        self.fort_device = experiment.alias_map[config.get('fort_dds', 'dds_FORT')]
+        self.cooling_device = experiment.alias_map[config.get('cooling_dds', 'dds_cooling_DP')]
+
+        self.atom = False
+        self.t_FORT_off = -np.inf
+
+        # (timeline in seconds, state) of the cooling and FORT switches and of whether there is an atom, in time
+        # order, for the counts in a gate. see counts
+        self.history = {name: [(-np.inf, False)] for name in ['cooling', 'FORT', 'atom']}
+
+        # (sampler name, channel) -> [dds device name, gain, drift phase]
+        self.monitors = {}
+        for sampler_name, channels in feedback_channels.items():
+            for dds_name, ch_params in channels.items():
+                if dds_name not in experiment.alias_map:
+                    continue
+                set_point = getattr(experiment, ch_params['set_points'][0], 1.0)
+                p_dBm = getattr(experiment, ch_params.get('power_dataset', ''), 0.0)
+                ampl = (2*50*10**(p_dBm/10 - 3))**(1/2)
+                response = np.sin(np.pi/2*min(ampl, 1.0))**2
+                gain = set_point/response if response > 0 else set_point
+                self.monitors[(sampler_name, ch_params['sampler_ch'])] = [experiment.alias_map[dds_name], gain,
+                                                                         self.rng.uniform(0, 2*np.pi)]
+
+    def _dds(self, device_name):
+        return getattr(self.exp, device_name)
+
+    def voltage(self, sampler_name, channel) -> float:
+        noise = self.rng.normal(0, self.sampler_noise)
+        monitor = self.monitors.get((sampler_name, channel))
+        if monitor is None:
+            return noise
+        device_name, gain, phase = monitor
+        dds = self._dds(device_name)
+        if not dds.sw.state:
+            return noise
+        laser = 1 + self.laser_drift*np.sin(2*np.pi*self.core.now()/self.t_drift + phase)
+        laser *= 1 + self.rng.normal(0, self.laser_noise)
+        return gain*np.sin(np.pi/2*min(dds.amplitude, 1.0))**2*laser + noise
+
+    def _record(self, name, state):
+        """add a state change at now to the history, which is kept in time order"""
+        history = self.history[name]
+        bisect.insort(history, (self.core.now(), bool(state)))
+        if len(history) > MAX_SWITCH_HISTORY:
+            del history[:len(history) - MAX_SWITCH_HISTORY]
+
+    def _state_at(self, name, t) -> bool:
+        history = self.history[name]
+        return history[max(bisect.bisect_right(history, (t, True)) - 1, 0)][1]
+
+    def switched(self, ttl, state):
+        """
+        a switch changed state. the cooling and FORT switches are recorded for the counts, and the FORT's is
+        used for loading and losing atoms
+        """
+        if ttl.name == self.cooling_device + "_sw":
+            self._record('cooling', state)
+        if ttl.name != self.fort_device + "_sw":
+            return
+        self._record('FORT', state)
+        if not state:
+            self.t_FORT_off = self.core.now()
+            return
+        t_off = self.core.now() - self.t_FORT_off
+        if t_off > self.t_reload:
+            self.atom = self.rng.random() < self.loading_probability
+        elif self.atom:
+            self.atom = self.rng.random() < np.exp(-t_off/self.t_release)
+        self._record('atom', self.atom)
+
+    def counts(self, device_name, gate) -> int:
+        """Poisson counts with the rate integrated over the gate, from the switch states during it"""
+        if device_name not in self.spcm_devices:
+            return 0
+        t_start, t_end = gate
+        if t_end <= t_start:
+            return 0
+        changes = sorted(set([t_start, t_end] + [t for history in self.history.values() for t, _ in history
+                                                 if t_start < t < t_end]))
+        expected = 0.0
+        for t0, t1 in zip(changes[:-1], changes[1:]):
+            rate = self.dark_rate
+            if self._state_at('cooling', t0):
+                rate += self.background_rate
+                if self._state_at('atom', t0) and self._state_at('FORT', t0):
+                    rate += self.atom_rate
+            expected += rate*(t1 - t0)
+        return int(self.rng.poisson(expected))
+
+
+def attach(experiment, device_names, config_dir):
+    """
+    set simulated devices as attributes of the experiment, in place of experiment.setattr_device
+
+    :param experiment: the experiment
+    :param device_names: the device names, as in the device_db, e.g. "core", "ttl0", "urukul0_ch1"
+    :param config_dir: the directory with simulation.json and feedback_channels.json
+    :return: the SimModel
+    """
+    with open(os.path.join(config_dir, "simulation.json")) as f:
+        config = json.load(f)
+    with open(os.path.join(config_dir, "feedback_channels.json")) as f:
+        feedback_channels = json.load(f)
+
+    core = SimCore(ref_period=config.get('ref_period', 1e-9), profile_rpcs=config.get('profile_rpcs', True))
+    experiment.core = core
+    model = SimModel(core, experiment, config.get('model', {}), feedback_channels)
+
+    for name in device_names:
+        if name == "core":
+            continue
+        elif name == "scheduler":
+            experiment.setattr_device(name)
+        elif name == "core_dma":
+            setattr(experiment, name, SimDMA(core, name))
+        elif name.startswith("urukul") and name.endswith("_cpld"):
+            setattr(experiment, name, SimCPLD(core, name))
+        elif name.startswith("urukul"):
+            cpld = getattr(experiment, name.split("_")[0] + "_cpld", None)
+            setattr(experiment, name, SimAD9910(core, name, cpld, model))
+        elif name.startswith("zotino"):
+            setattr(experiment, name, SimZotino(core, name))
+        elif name.startswith("sampler"):
+            setattr(experiment, name, SimSampler(core, name, model))
+        elif name.startswith("ttl") and name.endswith("_counter"):
+            setattr(experiment, name, SimEdgeCounter(core, name, model))
+        elif name.startswith("ttl"):
+            setattr(experiment, name, SimTTL(core, name, model))
+        else:
+            logging.warning(f"no simulated device for {name}")
+
+    experiment.sim_model = model
+    core.embed(experiment)
+    return model
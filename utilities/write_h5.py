@@ -11,6 +11,8 @@ import traceback
 from collections import OrderedDict
 import importlib.util
 import linecache
+import atexit
+import threading
 
 import h5py
 
@@ -30,9 +32,126 @@ from artiq.compiler import import_cache
 from artiq.coredevice.core import CompileError, host_only, _render_diagnostic
 from artiq import __version__ as artiq_version 
 
+from utilities.h5_writer import IncrementalH5Writer, snapshot_datasets
+
+
+# filename -> IncrementalH5Writer, so repeated calls to write_results only append what is new.
+# when writing in the background, these are only used by the writer thread.
+_writers = {}
+
+
+class BackgroundResultsWriter:
+
+    def __init__(self, max_pending=4):
+        """
+        A thread which writes results files so the h5 I/O doesn't block the experiment.
+
+        Each pending write is a snapshot of the datasets (see h5_writer.snapshot_datasets), and only the newest
+        snapshot for a given file matters, so submitting a write for a file that already has one pending replaces it.
+        :param max_pending: the maximum number of files with pending writes. submit blocks if this is reached.
+        """
+        self.max_pending = max_pending
+        self.pending = OrderedDict() # filename -> (submit time, groups, metadata)
+        self.condition = threading.Condition()
+        self.busy = False
+        self.stopped = False
+        self.last_latency = 0.0 # time from submitting to finishing the most recent write
+
+        self.thread = threading.Thread(target=self._run, name="write_results", daemon=True)
+        self.thread.start()
+
+    def submit(self, filename, groups, metadata) -> int:
+        """
+        queue a write, replacing any write which is still pending for the same file
+        :return: the number of pending writes, i.e. the queue depth
+        """
+        with self.condition:
+            while filename not in self.pending and len(self.pending) >= self.max_pending:
+                self.condition.wait()
+            self.pending[filename] = (time.time(), groups, metadata)
+            self.condition.notify_all()
+            return len(self.pending)
+
+    def _run(self):
+        while True:
+            with self.condition:
+                while not self.pending and not self.stopped:
+                    self.condition.wait()
+                if not self.pending:
+                    return
+                filename, (t_submit, groups, metadata) = self.pending.popitem(last=False)
+                self.busy = True
+                self.condition.notify_all()
+
+            try:
+                metadata["expid"] = pyon.encode(metadata["expid"])
+                if filename not in _writers:
+                    _writers[filename] = IncrementalH5Writer(filename)
+                _writers[filename].write(groups, metadata)
+            except Exception as e:
+                logging.warning(f"write_results failed for {filename}: {e}")
+
+            with self.condition:
+                self.last_latency = time.time() - t_submit
+                self.busy = False
+                self.condition.notify_all()
+
+    def wait(self):
+        """block until all of the pending writes are done"""
+        with self.condition:
+            while self.pending or self.busy:
+                self.condition.wait()
+
+    def stop(self):
+        """finish the pending writes and stop the thread"""
+        with self.condition:
+            self.stopped = True
+            self.condition.notify_all()
+        self.thread.join()
+
+
+_background_writer = None
+
+
+def wait_for_writes():
+    """block until any results being written in the background have been written"""
+    if _background_writer is not None:
+        _background_writer.wait()
+
+
+def close_writers():
+    """
+    finish any background writes and forget the files written by write_results. call this at the end of an
+    experiment's run, e.g. with experiment.finish_results from BaseExperiment, so nothing is left pending if the
+    worker is killed afterwards.
+    """
+    global _background_writer
+    if _background_writer is not None:
+        _background_writer.stop()
+        _background_writer = None
+    for writer in _writers.values():
+        writer.close()
+    _writers.clear()
+
+
+atexit.register(close_writers)
+
 
 @rpc(flags={"async"})
-def write_results(experiment, name=None):
+def write_results(experiment, name=None, incremental=True, background=True):
+    """
+    write the experiment's datasets to an h5 file in the results directory.
+
+    :param experiment: the experiment whose datasets we want to save
+    :param name: appended to the filename
+    :param incremental: if True, the file is kept open and only datasets that have changed since the last call are
+        written, see utilities/h5_writer.py. if False, the whole file is rewritten.
+    :param background: if True (and incremental), a snapshot of the datasets is written by a separate thread, so this
+        returns right away. the queue depth and the latency of the last write are saved in the datasets
+        write_results_queue_depth and write_results_latency. use background=False for a write which has to be on
+        disk when this returns, e.g. a last save in case the worker refuses to die.
+    """
+    global _background_writer
     try:    
         experiment.setattr_device("scheduler")
         rid = experiment.scheduler.rid
@@ -46,13 +165,37 @@ def write_results(experiment, name=None):
             filename = "{:09}-{}_{}.h5".format(rid, experiment.__class__.__name__, name)
         else:
             filename = "{:09}-{}Synchronous.h5".format(rid, experiment.__class__.__name__)
-        with h5py.File(filename, "w") as f:
-            dataset_mgr.write_hdf5(f)
-            f["artiq_version"] = artiq_version
-            f["rid"] = rid
-            f["start_time"] = start_time
-            f["run_time"] = run_time
-            f["expid"] = pyon.encode(expid)
+
+        metadata = {"artiq_version": artiq_version,
+                    "rid": rid,
+                    "start_time": start_time,
+                    "run_time": run_time,
+                    "expid": expid}
+
+        if incremental and background:
+            if _background_writer is None:
+                _background_writer = BackgroundResultsWriter()
+            # the dataset manager isn't thread safe, so the snapshot is taken and the datasets are set here
+            groups = {'datasets': snapshot_datasets(dataset_mgr.local),
+                      'archive': snapshot_datasets(dataset_mgr.archive)}
+            queue_depth = _background_writer.submit(filename, groups, metadata)
+            experiment.set_dataset("write_results_queue_depth", queue_depth, broadcast=True)
+            experiment.set_dataset("write_results_latency", _background_writer.last_latency, broadcast=True)
+        elif incremental:
+            # a background write of the same file may still be pending
+            wait_for_writes()
+            metadata["expid"] = pyon.encode(expid)
+            if filename not in _writers:
+                _writers[filename] = IncrementalH5Writer(filename)
+            _writers[filename].write({'datasets': dataset_mgr.local, 'archive': dataset_mgr.archive}, metadata)
+        else:
+            wait_for_writes()
+            with h5py.File(filename, "w") as f:
+                dataset_mgr.write_hdf5(f)
+                f["artiq_version"] = artiq_version
+                f["rid"] = rid
+                f["start_time"] = start_time
+                f["run_time"] = run_time
+                f["expid"] = pyon.encode(expid)
     except Exception as e:
-        pass
-    
\ No newline at end of file
+        logging.warning(f"write_results failed: {e}")